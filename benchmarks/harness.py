@@ -0,0 +1,138 @@
+"""
+Harness.py
+
+Runs the BASIC programs in benchmarks/programs on every execution engine and reports statements per
+second, startup time and peak memory, optionally as JSON for comparing releases.
+
+    python benchmarks/harness.py [--engine name ...] [--repeat n] [--no-optimize] [--json file] [program ...]
+
+The statements of a program are counted once with a statement hook, on the ast engine with the
+optimizer off. Every engine runs it with its output captured, and its output has to match that of
+the counting run, so a run with the optimizer on also checks that it changes nothing.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+from interpreter import Interpreter, ENGINES  # noqa: E402
+
+PROGRAMS = os.path.join(HERE, "programs")
+
+
+def programs(names):
+    found = sorted(name[:-len(".bas")] for name in os.listdir(PROGRAMS) if name.endswith(".bas"))
+    for name in names:
+        if name not in found:
+            raise SystemExit("No benchmark {}, choose from {}".format(name, ", ".join(found)))
+    return names or found
+
+
+def start(name, engine, optimize=True):
+    # an interpreter with the program loaded and, for the compiling engines, compiled
+    interpreter = Interpreter(engine, "fast")
+    interpreter.set_optimize(optimize)
+    interpreter.load_file(os.path.join(PROGRAMS, name + ".bas"))
+    interpreter.output = io.StringIO()
+    if engine == "vm":
+        interpreter.compile()
+    elif engine == "python":
+        interpreter.translate()
+    return interpreter
+
+
+def count(name):
+    # statements executed by a run of the program, and its output
+    interpreter = start(name, "ast", False)
+    statements = [0]
+
+    def counter(interpreter, event, node):
+        statements[0] += 1
+    interpreter.add_hook("statement", counter)
+    interpreter.run()
+    return statements[0], interpreter.output.getvalue()
+
+
+def measure(name, engine, repeat, optimize):
+    # best startup and run times over the repeats, peak traced memory of one more run, and the output
+    startup = None
+    elapsed = None
+    output = None
+    for i in range(repeat):
+        begin = time.perf_counter()
+        interpreter = start(name, engine, optimize)
+        ready = time.perf_counter()
+        interpreter.run()
+        end = time.perf_counter()
+        startup = ready - begin if startup is None else min(startup, ready - begin)
+        elapsed = end - ready if elapsed is None else min(elapsed, end - ready)
+        output = interpreter.output.getvalue()
+    tracemalloc.start()
+    try:
+        start(name, engine, optimize).run()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return startup, elapsed, peak, output
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description="Run the BASIC benchmarks on the execution engines.")
+    parser.add_argument("programs", nargs="*", help="benchmarks to run, all of them by default")
+    parser.add_argument("--engine", action="append", choices=ENGINES, help="engine to measure, may be repeated")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement, the best one counts")
+    parser.add_argument("--no-optimize", dest="optimize", action="store_false", help="run with the optimizer off")
+    parser.add_argument("--json", metavar="FILE", help="also write the results as JSON, '-' for stdout")
+    options = parser.parse_args(args)
+    engines = options.engine or list(ENGINES)
+    results = []
+    status = 0
+    print("{:<10} {:<8} {:>10} {:>10} {:>10} {:>14} {:>10}".format("program", "engine", "statements", "startup",
+                                                                   "run", "statements/s", "peak KiB"))
+    for name in programs(options.programs):
+        statements, expected = count(name)
+        for engine in engines:
+            startup, elapsed, peak, output = measure(name, engine, max(options.repeat, 1), options.optimize)
+            matches = output == expected
+            if not matches:
+                status = 1
+            rate = statements / elapsed if elapsed else 0.0
+            print("{:<10} {:<8} {:>10} {:>9.2f}ms {:>9.2f}ms {:>14,.0f} {:>10.1f}{}".format(
+                name, engine, statements, startup * 1e3, elapsed * 1e3, rate, peak / 1024,
+                "" if matches else "  OUTPUT DIFFERS"))
+            results.append({
+                "program": name,
+                "engine": engine,
+                "statements": statements,
+                "startup_seconds": startup,
+                "run_seconds": elapsed,
+                "statements_per_second": rate,
+                "peak_bytes": peak,
+                "output_matches": matches,
+            })
+    if options.json is not None:
+        report = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": options.repeat,
+            "optimize": options.optimize,
+            "results": results,
+        }
+        if options.json == "-":
+            json.dump(report, sys.stdout, indent=1)
+            print()
+        else:
+            with open(options.json, "w") as writefile:
+                json.dump(report, writefile, indent=1)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
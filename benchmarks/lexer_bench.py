@@ -0,0 +1,76 @@
+"""
+Lexer_bench.py
+
+Tokens per second of the classic and the fast lexer on large synthetic programs.
+
+    python benchmarks/lexer_bench.py [lines] [repeats]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from tokenizer import LEXERS  # noqa: E402
+
+TEMPLATES = [
+    "let {a} = {a} + {n} * ({b} - {n})",
+    "print \"value of {a} is \";{a};\" and {b} \";{b}",
+    "if {a} >= {n} then let {b} = {b} + 1 : goto {line} else print {a}",
+    "for {a} = 1 to {n} step 2",
+    "next {a}",
+    "dim {a}[{n}][{n}] : let {a}[{b}][1] = rnd({n})",
+    "input \"how many\" {a}",
+    "rem ** a remark with some words in it **",
+    "if {a} <> {b} then print sum({a});max({b}) : let {a} = {a} / 3",
+]
+
+NAMES = ["a", "b", "count", "total", "x1", "y2", "index", "value"]
+
+
+def program(size, seed=1):
+    # source text of size random lines made from the templates
+    rng = random.Random(seed)
+    lines = []
+    for i in range(size):
+        lines.append(rng.choice(TEMPLATES).format(a=rng.choice(NAMES), b=rng.choice(NAMES),
+                                                  n=rng.randint(1, 1000), line=rng.randint(1, size) * 10))
+    return lines
+
+
+def measure(lexer, lines, repeats):
+    # best time over the repeats of tokenizing every line, and the number of tokens made
+    best = None
+    count = 0
+    for i in range(repeats):
+        start = time.perf_counter()
+        count = 0
+        for line in lines:
+            count += len(lexer.tokenize(line))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, count
+
+
+def main(args):
+    size = int(args[0]) if args else 20000
+    repeats = int(args[1]) if len(args) > 1 else 3
+    lines = program(size)
+    reference = None
+    for name, lexer in LEXERS.items():
+        lexer = lexer()
+        tokens = [[(token.type, token.value) for token in lexer.tokenize(line)] for line in lines]
+        if reference is None:
+            reference = tokens
+        elif tokens != reference:
+            print("{} lexer gives different tokens".format(name))
+            return 1
+        elapsed, count = measure(lexer, lines, repeats)
+        print("{:<8} {:>9} lines {:>10} tokens {:8.3f}s {:>12,.0f} tokens/s".format(name, len(lines), count, elapsed,
+                                                                                   count / elapsed))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
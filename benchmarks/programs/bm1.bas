@@ -0,0 +1,5 @@
+10 rem Rugg Feldman benchmark 1  empty FOR loop
+20 print "S"
+30 for k = 1 to 1000
+40 next k
+50 print "E"
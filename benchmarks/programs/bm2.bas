@@ -0,0 +1,6 @@
+10 rem Rugg Feldman benchmark 2  IF/GOTO loop
+20 print "S"
+30 let k = 0
+40 let k = k + 1
+50 if k < 1000 then goto 40
+60 print "E"
@@ -0,0 +1,7 @@
+10 rem Rugg Feldman benchmark 3  arithmetic with variables
+20 print "S"
+30 let k = 0
+40 let k = k + 1
+50 let a = k / k * k + k - k
+60 if k < 1000 then goto 40
+70 print "E"
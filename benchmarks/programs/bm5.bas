@@ -0,0 +1,12 @@
+10 rem Rugg Feldman benchmark 5  benchmark 4 plus a subroutine call
+11 rem the dialect has no GOSUB the call and return are two GOTOs
+20 print "S"
+30 let k = 0
+40 let k = k + 1
+50 let a = k / 2 * 3 + 4 - 5
+60 goto 200
+70 if k < 1000 then goto 40
+80 print "E"
+90 goto 300
+200 goto 70
+300 rem end
@@ -0,0 +1,15 @@
+10 rem Rugg Feldman benchmark 6  benchmark 5 plus an array and an inner FOR loop
+11 rem the dialect has no GOSUB the call and return are two GOTOs
+20 print "S"
+30 let k = 0
+40 dim m[5]
+50 let k = k + 1
+60 let a = k / 2 * 3 + 4 - 5
+70 goto 200
+80 for l = 1 to 5
+90 next l
+100 if k < 1000 then goto 50
+110 print "E"
+120 goto 300
+200 goto 80
+300 rem end
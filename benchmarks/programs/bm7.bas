@@ -0,0 +1,16 @@
+10 rem Rugg Feldman benchmark 7  benchmark 6 storing into the array in the inner loop
+11 rem the dialect has no GOSUB the call and return are two GOTOs
+20 print "S"
+30 let k = 0
+40 dim m[6]
+50 let k = k + 1
+60 let a = k / 2 * 3 + 4 - 5
+70 goto 200
+80 for l = 1 to 5
+90 let m[l] = a
+100 next l
+110 if k < 1000 then goto 50
+120 print "E"
+130 goto 300
+200 goto 80
+300 rem end
@@ -0,0 +1,10 @@
+10 rem Rugg Feldman benchmark 8  arithmetic in place of the power LOG and SIN functions
+11 rem the dialect has none of them each is replaced by a product or a quotient
+20 print "S"
+30 let k = 0
+40 let k = k + 1
+50 let a = k * k
+60 let b = a / k
+70 let c = b / (k + 1)
+80 if k < 1000 then goto 40
+90 print "E"
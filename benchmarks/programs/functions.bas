@@ -0,0 +1,12 @@
+10 rem user functions  a memoized recursive one and one reading a variable in a loop
+20 def fn fib(n) = if n < 2 then n else fn fib(n - 1) + fn fib(n - 2)
+30 def fn poly(x) = x * x * c + x * 3 + 1
+40 let c = 2
+50 let s = 0
+60 for i = 1 to 2000
+70 let s = s + fn poly(i)
+80 next i
+90 for j = 1 to 60
+100 let s = s + fn fib(j)
+110 next j
+120 print fn fib(80); " "; s
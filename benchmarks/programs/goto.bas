@@ -0,0 +1,10 @@
+10 rem a loop made of GOTOs jumping back and forth
+20 let k = 0
+30 let s = 0
+40 goto 100
+50 let s = s + k
+60 goto 120
+100 let k = k + 1
+110 goto 50
+120 if k < 2000 then goto 100
+130 print s
@@ -0,0 +1,10 @@
+10 rem three nested FOR loops
+20 let s = 0
+30 for i = 1 to 20
+40 for j = 1 to 20
+50 for k = 1 to 20
+60 let s = s + i * j - k
+70 next k
+80 next j
+90 next i
+100 print s
@@ -0,0 +1,13 @@
+10 rem sieve of Eratosthenes over a DIM array counts the primes up to n
+20 let n = 8190
+30 dim f[8300]
+31 rem the last step of the inner loop may pass n so f has room for it
+40 let c = 0
+50 for i = 2 to n
+60 if f[i] = 1 then goto 110
+70 let c = c + 1
+80 if i * i > n then goto 110
+90 for j = i * i to n step i
+100 let f[j] = 1 : next j
+110 next i
+120 print c;" primes"
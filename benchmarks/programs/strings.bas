@@ -0,0 +1,4 @@
+10 rem PRINT of many strings and numbers
+20 for i = 1 to 2000
+30 print "line ";i;" of the report: ";"value ";i * 3;" total ";i * i;" done"
+40 next i
@@ -0,0 +1,305 @@
+"""
+Checkpoint.py
+
+Saves the whole state of a run to disk and restores it, so a long run can be resumed where it
+stopped: the program, the line to go on with, the FOR loops and GOSUBs under way, the variables,
+the functions defined, the state of the RND generator, which then draws the very numbers it
+would have drawn, the files open with their positions and the next DATA value. Hidden variables
+of hoisted invariants are not kept, they are computed again.
+
+A checkpoint "name" is the directory name.ckpt holding state.json and a chunk file. The elements of
+every DIM array are cut into chunks that are stored in the chunk file under a digest of their
+contents, so a chunk is only written when no chunk with its contents is stored yet: saving again
+writes the parts of the arrays that changed and little else. Chunks go to the end of the chunk file
+and state.json is replaced in one step, so a save cut short leaves the previous checkpoint whole.
+The chunk file is written afresh once the chunks no longer in use take up more room than the rest.
+"""
+from variables import Array, UNSET
+from loop import Loop
+from array import array
+import hashlib
+import json
+import os
+import sys
+import parser
+
+VERSION = 1
+CHUNK = 8192  # array elements per chunk
+STATE = "state.json"
+
+
+def error(msg="Bad checkpoint"):
+    raise SyntaxError(msg)
+
+
+def directory(name):
+    return name + ".ckpt"
+
+
+def encode_node(node):
+    # a syntax tree as JSON, for the functions defined, without the variable slots resolved in it
+    if isinstance(node, list):
+        return [encode_node(item) for item in node]
+    elif isinstance(node, tuple):
+        return {"tuple": [encode_node(item) for item in node]}
+    elif hasattr(node, "__dict__"):
+        return {"node": type(node).__name__,
+                "fields": {key: None if key == "slot" else encode_node(value) for key, value in vars(node).items()}}
+    return node
+
+
+def decode_node(value):
+    if isinstance(value, list):
+        return [decode_node(item) for item in value]
+    elif isinstance(value, dict):
+        if "tuple" in value:
+            return tuple(decode_node(item) for item in value.get("tuple"))
+        kind = getattr(parser, value.get("node"), None)
+        if not isinstance(kind, type) or kind.__module__ != parser.__name__:
+            error()
+        node = kind.__new__(kind)
+        node.__dict__.update({key: decode_node(field) for key, field in value.get("fields").items()})
+        return node
+    return value
+
+
+class Store:
+    # the chunk file of a checkpoint and the chunks it holds
+
+    def __init__(self, path):
+        self.path = path
+        self.generation = 0  # number of the chunk file, it changes when the file is written afresh
+        self.size = 0  # bytes of the chunk file in use
+        self.chunks = {}  # digest -> (offset, length) in the chunk file
+        self.writefile = None
+
+    def filename(self, generation=None):
+        return os.path.join(self.path, "chunks.{}".format(self.generation if generation is None else generation))
+
+    def put(self, data):
+        # the digest of a chunk, written out unless it is stored already
+        digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+        if digest not in self.chunks:
+            if self.writefile is None:
+                self.writefile = open(self.filename(), "r+b" if os.path.exists(self.filename()) else "wb")
+                # whatever a save cut short left behind the chunks in use is overwritten
+                self.writefile.truncate(self.size)
+                self.writefile.seek(self.size)
+            self.writefile.write(data)
+            self.chunks.update({digest: (self.size, len(data))})
+            self.size += len(data)
+        return digest
+
+    def flush(self):
+        if self.writefile is not None:
+            self.writefile.flush()
+            os.fsync(self.writefile.fileno())
+            self.writefile.close()
+            self.writefile = None
+
+    def get(self, readfile, digest):
+        entry = self.chunks.get(digest)
+        if entry is None:
+            error()
+        offset, length = entry
+        readfile.seek(offset)
+        data = readfile.read(length)
+        if len(data) != length:
+            error()
+        return data
+
+
+class Checkpoints:
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.stores = {}  # checkpoint name -> Store, for saving it again
+        self.name = None  # checkpoint a run saves every so many lines
+        self.every = None  # lines between those saves, None for none
+        self.saved = 0  # checkpoints saved
+        self.written = 0  # bytes of array chunks written by the last save
+
+    def directory(self, name):
+        return directory(self.interpreter.path(name))
+
+    def store(self, name, state=None):
+        # the chunk store of a checkpoint, as its state.json left it when it is not open yet
+        store = self.stores.get(name)
+        if store is None or state is not None:
+            store = self.stores[name] = Store(self.directory(name))
+            try:
+                state = self.read_state(name) if state is None else state
+            except OSError:
+                return store  # a new checkpoint
+            store.generation = state.get("generation")
+            store.size = state.get("size")
+            store.chunks = {digest: tuple(entry) for digest, entry in state.get("chunks").items()}
+        return store
+
+    def read_state(self, name):
+        with open(os.path.join(self.directory(name), STATE)) as readfile:
+            try:
+                state = json.load(readfile)
+            except ValueError:
+                error()
+        if state.get("version") != VERSION:
+            error("Unsupported checkpoint")
+        return state
+
+    # ######################### saving ##################################
+    def save(self, name, linepos):
+        # write the state of the interpreter, which resumes with the line at linepos, None when no run is
+        # under way
+        interpreter = self.interpreter
+        os.makedirs(self.directory(name), exist_ok=True)
+        store = self.store(name)
+        size = store.size
+        used = set()
+        variables = {}
+        try:
+            for key, value in zip(interpreter.variables.names, interpreter.variables.values):
+                if value is UNSET or key.startswith("%"):
+                    continue
+                if type(value) is Array:
+                    value = self.save_array(store, value, used)
+                variables.update({key: value})
+            store.flush()
+        except BaseException:
+            # the store is read again from the checkpoint left as it was
+            if store.writefile is not None:
+                store.writefile.close()
+            self.stores.pop(name, None)
+            raise
+        self.written = store.size - size
+        live = {digest: store.chunks.get(digest) for digest in used}
+        steps = interpreter.steps
+        running = linepos is not None
+        state = {
+            "version": VERSION,
+            "generation": store.generation,
+            "size": store.size,
+            "chunks": live,
+            "program": sorted(interpreter.program.items()),
+            "line": None if linepos is None or linepos >= len(steps) else steps[linepos],
+            "running": running,
+            "loops": [[key, loop.start, loop.end, steps[loop.line], loop.step]
+                      for key, loop in interpreter.looptable.items()] if running else [],
+            "gosubs": [steps[pos] for pos in interpreter.gosubs] if running else [],
+            "files": interpreter.files.state() if running else None,
+            "variables": variables,
+            "functions": [encode_node([function.name, function.params, function.expr])
+                          for function in interpreter.functions.functions.values()],
+            "random": encode_node(interpreter.random.getstate()),
+            "every": [self.name, self.every] if running and self.every else None,
+        }
+        self.write_state(name, state)
+        store.chunks = live
+        self.saved += 1
+        if store.size > 2 * sum(length for offset, length in live.values()) + CHUNK * 8:
+            self.compact(name, state)
+
+    def save_array(self, store, value, used):
+        items = value.items
+        kind = "q" if type(items) is array else "list"
+        digests = []
+        for start in range(0, len(items), CHUNK):
+            part = items[start:start + CHUNK]
+            if kind == "q":
+                if sys.byteorder == "big":
+                    part.byteswap()
+                data = part.tobytes()
+            else:
+                data = json.dumps(part).encode()
+            digest = store.put(data)
+            used.add(digest)
+            digests.append(digest)
+        return {"dims": value.dims, "kind": kind, "length": len(items), "chunks": digests}
+
+    def write_state(self, name, state):
+        # replace state.json in one step, a reader sees the old checkpoint or the new one
+        path = os.path.join(self.directory(name), STATE)
+        temp = "{}.{}.tmp".format(path, os.getpid())
+        with open(temp, "w") as writefile:
+            json.dump(state, writefile, separators=(",", ":"))
+            writefile.flush()
+            os.fsync(writefile.fileno())
+        os.replace(temp, path)
+
+    def compact(self, name, state):
+        # copy the chunks in use to a new chunk file and drop the old one
+        store = self.stores.get(name)
+        old = store.filename()
+        chunks = {}
+        size = 0
+        with open(old, "rb") as readfile, open(store.filename(store.generation + 1), "wb") as writefile:
+            for digest in sorted(store.chunks, key=lambda digest: store.chunks.get(digest)):
+                data = store.get(readfile, digest)
+                writefile.write(data)
+                chunks.update({digest: (size, len(data))})
+                size += len(data)
+            writefile.flush()
+            os.fsync(writefile.fileno())
+        store.generation += 1
+        store.size = size
+        store.chunks = chunks
+        state.update({"generation": store.generation, "size": size, "chunks": chunks})
+        self.write_state(name, state)
+        os.remove(old)
+
+    # ######################### restoring ##################################
+    def load(self, name):
+        # restore the state saved under a name, return the position of the line to go on with, None when
+        # no run was under way
+        interpreter = self.interpreter
+        try:
+            state = self.read_state(name)
+        except OSError as e:
+            error("Cannot resume {}: {}".format(name, e.strerror))
+        try:
+            store = self.store(name, state)
+            values = state.get("variables")
+            arrays = [key for key, value in values.items() if type(value) is dict]
+            if arrays:
+                with open(store.filename(), "rb") as readfile:
+                    for key in arrays:
+                        values.update({key: self.load_array(store, readfile, values.get(key))})
+            program = {lineno: code for lineno, code in state.get("program")}
+            functions = [decode_node(function) for function in state.get("functions")]
+            random = decode_node(state.get("random"))
+        except (OSError, KeyError, TypeError, ValueError):
+            error()
+        interpreter.replace_program(program)
+        interpreter.clear()
+        for key, value in values.items():
+            interpreter.variables.set(key, value)
+        for key, params, expr in functions:
+            interpreter.functions.define(parser.Def(key, params, expr))
+        interpreter.random.setstate(random)
+        if self.every is None and state.get("every"):
+            # a run that saved itself every so many lines goes on doing so
+            self.name, self.every = state.get("every")
+        if not state.get("running"):
+            return None
+        interpreter.prepare()
+        lineindex = interpreter.lineindex
+        for key, start, end, line, step in state.get("loops"):
+            interpreter.looptable.update({key: Loop(start, end, lineindex.get(line), step)})
+        interpreter.gosubs.extend(lineindex.get(line) for line in state.get("gosubs"))
+        interpreter.files.restore_state(state.get("files"))
+        line = state.get("line")
+        return len(interpreter.steps) if line is None else lineindex.get(line)
+
+    def load_array(self, store, readfile, value):
+        if value.get("kind") == "q":
+            items = array("q")
+            for digest in value.get("chunks"):
+                items.frombytes(store.get(readfile, digest))
+            if sys.byteorder == "big":
+                items.byteswap()
+        else:
+            items = []
+            for digest in value.get("chunks"):
+                items.extend(json.loads(store.get(readfile, digest)))
+        if len(items) != value.get("length"):
+            error()
+        return Array(value.get("dims"), items)
@@ -0,0 +1,453 @@
+"""
+Compiler.py
+
+Compiles a whole program into one flat list of bytecode instructions for the VM.
+Every instruction is an (opcode, argument) pair. Each line is compiled on its own, with the
+jumps inside it relative to the instruction that follows them, so its code runs wherever it is
+placed. Linking lays out the code of the lines in line order and resolves the GOTO jumps to
+instruction positions. A line is only compiled again after it has changed, or after the types
+inferred for the program have: a comparison deciding an IF whose operands are known to be numbers
+or strings jumps on its result directly.
+"""
+from parser import Literal, Variable, Rnd, Reduce, Invariant, BinaryOp, Compare, Call, Eof, Conditional, Let, Print, If, \
+    For, Next, Goto, Gosub, Return, Def, Checkpoint, Input, Open, Close, Read, Data, Restore, Dim, Mat, Rem, Command
+import operator
+
+# opcodes
+LOAD_CONST = 0
+LOAD = 1
+STORE = 2
+LOAD_INDEX = 3
+STORE_INDEX = 4
+BINARY = 5
+COMPARE = 6
+JUMP = 7
+JUMP_IF_FALSE = 8
+FOR = 9
+NEXT = 10
+PRINT = 11
+INPUT = 12
+DIM = 13
+RND = 14
+POP = 15
+EXEC = 16
+CLEAR = 17
+ERROR = 18
+HALT = 19
+MAT = 20
+REDUCE = 21
+LOAD_HOISTED = 22
+STORE_HOISTED = 23
+PARALLEL = 24
+GOSUB = 25
+RETURN = 26
+CALL = 27
+PRINT_FILE = 28
+INPUT_FILE = 29
+READ = 30
+EOF = 31
+COMPARE_JUMP = 32
+
+OPNAMES = {
+    LOAD_CONST: "LOAD_CONST",
+    LOAD: "LOAD",
+    STORE: "STORE",
+    LOAD_INDEX: "LOAD_INDEX",
+    STORE_INDEX: "STORE_INDEX",
+    BINARY: "BINARY",
+    COMPARE: "COMPARE",
+    JUMP: "JUMP",
+    JUMP_IF_FALSE: "JUMP_IF_FALSE",
+    FOR: "FOR",
+    NEXT: "NEXT",
+    PRINT: "PRINT",
+    INPUT: "INPUT",
+    DIM: "DIM",
+    RND: "RND",
+    POP: "POP",
+    EXEC: "EXEC",
+    CLEAR: "CLEAR",
+    ERROR: "ERROR",
+    HALT: "HALT",
+    MAT: "MAT",
+    REDUCE: "REDUCE",
+    LOAD_HOISTED: "LOAD_HOISTED",
+    STORE_HOISTED: "STORE_HOISTED",
+    PARALLEL: "PARALLEL",
+    GOSUB: "GOSUB",
+    RETURN: "RETURN",
+    CALL: "CALL",
+    PRINT_FILE: "PRINT_FILE",
+    INPUT_FILE: "INPUT_FILE",
+    READ: "READ",
+    EOF: "EOF",
+    COMPARE_JUMP: "COMPARE_JUMP",
+}
+
+OPERATORS = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": operator.truediv,
+    "=": operator.eq,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "<>": operator.ne,
+}
+
+SYMBOLS = {function: symbol for symbol, function in OPERATORS.items()}
+
+
+class CompileError(Exception):
+    # raised for programs the VM cannot run, the interpreter then falls back to the AST engine
+    pass
+
+
+class Program:
+    def __init__(self):
+        self.code = []
+        self.lines = []  # pc -> line number, for the disassembler
+        self.starts = {}  # line number -> pc of its first instruction
+        self.slots = {}  # variable name -> slot
+        self.arrays = set()  # names holding DIM arrays rather than scalars
+
+
+class Line:
+    # the code of one program line
+    def __init__(self, statements, arrays, types):
+        self.statements = statements  # syntax tree it was compiled from
+        self.arrays = arrays  # array names of the program it was compiled for
+        self.types = types  # signature of the inferred types of the program it was compiled for
+        self.code = []
+        self.gotos = []  # (pc in the line, target line number) of GOTO and GOSUB jumps
+        self.slots = {}  # variable name -> slot
+
+
+class Compiler:
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.program = None
+        self.lineno = None
+        self.line = None  # line being compiled
+        self.lines = {}  # line number -> Line, the compiled lines of the program last linked
+        self.names = {}  # line number -> (statements, names it subscripts or dimensions)
+        self.arrays = frozenset()  # array names the compiled lines were compiled for
+        self.hoisted = None  # hoisted invariants of the interpreter the compiled lines hold
+        self.compiled = 0  # lines compiled by the last compile
+
+    def error(self, msg):
+        raise CompileError("line {}: {}".format(self.lineno, msg))
+
+    def emit(self, op, arg=None):
+        self.line.code.append((op, arg))
+        return len(self.line.code) - 1
+
+    def patch(self, pc, target):
+        op, arg = self.line.code[pc]
+        self.line.code[pc] = (op, (arg, target) if op == COMPARE_JUMP else target)
+
+    def distance(self, pc):
+        # jump from the instruction at pc to the next one emitted
+        return len(self.line.code) - pc - 1
+
+    def slot(self, name):
+        # slots come from the interpreter's variable store so the VM works on it directly
+        slot = self.interpreter.variables.slot(name)
+        self.line.slots.update({name: slot})
+        return slot
+
+    def compile(self):
+        # compile the lines that changed since the last compile and link the program
+        interpreter = self.interpreter
+        self.program = program = Program()
+        lines = [(lineno, interpreter.parsed(lineno)) for lineno in sorted(interpreter.program.keys())]
+        # names that are ever subscripted or dimensioned are stored as arrays
+        names = {}
+        for lineno, statements in lines:
+            entry = self.names.get(lineno)
+            if entry is None or entry[0] is not statements:
+                entry = (statements, set())
+                self.collectArrays(statements, entry[1])
+            names.update({lineno: entry})
+            program.arrays.update(entry[1])
+        self.names = names
+        arrays = self.arrays if program.arrays == self.arrays else frozenset(program.arrays)
+        # hoisting rewrites the trees of the lines of loops in place, their code is out of date
+        touched = set()
+        if interpreter.hoisted is not self.hoisted:
+            touched = {line for entry in interpreter.hoisted or [] for line in entry[:2]}
+        # the fast paths of a line depend on the types inferred for the whole program
+        types = interpreter.inference.signature
+        compiled = {}
+        self.compiled = 0
+        for lineno, statements in lines:
+            line = self.lines.get(lineno)
+            if line is None or line.statements is not statements or line.arrays is not arrays or \
+                    line.types is not types or lineno in touched:
+                self.lineno = lineno
+                line = self.line = Line(statements, arrays, types)
+                self.compileStatements(statements, True)
+                self.compiled += 1
+            compiled.update({lineno: line})
+        self.lineno = None
+        self.line = None
+        self.lines = compiled
+        self.arrays = arrays
+        self.hoisted = interpreter.hoisted
+        return self.link()
+
+    def link(self):
+        # lay out the compiled lines in line order and point the GOTO and GOSUB jumps at their targets
+        program = self.program
+        code = program.code
+        gotos = []
+        for lineno, line in self.lines.items():
+            start = len(code)
+            program.starts.update({lineno: start})
+            code.extend(line.code)
+            program.lines.extend([lineno] * len(line.code))
+            program.slots.update(line.slots)
+            gotos.extend((start + pc, target) for pc, target in line.gotos)
+        code.append((HALT, None))
+        program.lines.append(None)
+        for pc, target in gotos:
+            if target in program.starts:
+                code[pc] = (code[pc][0], program.starts.get(target) - pc - 1)
+            else:
+                code[pc] = (ERROR, "Line number does not exist")
+        return program
+
+    def collectArrays(self, nodes, arrays):
+        for node in nodes:
+            if isinstance(node, (Dim, Mat)):
+                arrays.add(node.name)
+            elif isinstance(node, Variable) and node.indexes:
+                arrays.add(node.name)
+            for child in vars(node).values():
+                if isinstance(child, list):
+                    self.collectArrays(child, arrays)
+                elif hasattr(child, "__dict__"):
+                    self.collectArrays([child], arrays)
+
+    # ######################### statements ##################################
+    def compileStatements(self, statements, terminal):
+        # terminal is true when the chain runs to the end of the line, where a jump may leave it
+        for pos, statement in enumerate(statements):
+            self.compileStatement(statement, terminal and pos == len(statements) - 1)
+
+    def compileStatement(self, node, terminal):
+        kind = type(node)
+        if kind is Let:
+            self.compileLet(node)
+        elif kind is Print:
+            if node.channel is not None:
+                self.compileExpression(node.channel)
+            for item in node.items:
+                self.compileExpression(item)
+            self.emit(PRINT if node.channel is None else PRINT_FILE, len(node.items))
+        elif kind is If:
+            self.compileIf(node, terminal)
+        elif kind is For:
+            self.compileFor(node)
+        elif kind is Next:
+            if not terminal:
+                self.error("NEXT must end its line")
+            self.emit(NEXT, self.scalar(node.name))
+        elif kind is Goto:
+            if not terminal:
+                self.error("GOTO must end its line")
+            self.line.gotos.append((self.emit(JUMP, node.lineno), node.lineno))
+        elif kind is Gosub:
+            if not terminal:
+                self.error("GOSUB must end its line")
+            self.line.gotos.append((self.emit(GOSUB, node.lineno), node.lineno))
+        elif kind is Return:
+            if not terminal:
+                self.error("RETURN must end its line")
+            self.emit(RETURN)
+        elif kind is Input:
+            if node.channel is not None:
+                self.compileExpression(node.channel)
+                self.emit(INPUT_FILE, self.scalar(node.name))
+            else:
+                self.emit(INPUT, (self.scalar(node.name), "?" if node.prompt is None else node.prompt))
+        elif kind is Read:
+            for target in node.targets:
+                self.compileStore(target, lambda: self.emit(READ))
+        elif kind is Dim:
+            for dim in node.dims:
+                self.compileExpression(dim)
+            self.emit(DIM, (self.slot(node.name), len(node.dims)))
+        elif kind is Mat:
+            # whole array operations run in bulk, their operands are evaluated by the tree walker
+            self.slot(node.name)
+            self.emit(MAT, node)
+        elif kind in (Def, Checkpoint, Open, Close, Restore):
+            self.emit(EXEC, node)
+        elif kind is Rem or kind is Data:
+            pass
+        elif kind is Command:
+            if node.name in ("RUN", "NEW", "LOAD", "RESUME", "PROFILE"):
+                self.error("{} inside a program".format(node.name))
+            if node.name == "CLEAR":
+                self.emit(CLEAR)
+            else:
+                self.emit(EXEC, node)
+        else:
+            self.error("cannot compile {}".format(kind.__name__))
+
+    def scalar(self, name):
+        if name in self.program.arrays:
+            self.error("{} is an array".format(name))
+        return self.slot(name)
+
+    def compileLet(self, node):
+        self.compileStore(node.target, lambda: self.compileExpression(node.expr))
+
+    def compileStore(self, target, compile):
+        # store the value pushed by the code compile emits in a variable or array element
+        slot = self.slot(target.name)
+        if target.name in self.program.arrays:
+            count = self.compileIndex(target)
+            compile()
+            self.emit(STORE_INDEX, (slot, count))
+        else:
+            compile()
+            self.emit(STORE, slot)
+
+    def compileIf(self, node, terminal):
+        skip = self.compileCondition(node.condition)
+        self.compileStatements(node.then_branch, terminal)
+        if node.else_branch is None:
+            self.patch(skip, self.distance(skip))
+        else:
+            end = self.emit(JUMP)
+            self.patch(skip, self.distance(skip))
+            self.compileStatements(node.else_branch, terminal)
+            self.patch(end, self.distance(end))
+
+    def compileFor(self, node):
+        slot = self.scalar(node.name)
+        first = not self.line.code
+        self.compileExpression(node.start)
+        self.compileExpression(node.end)
+        if node.step is None:
+            self.emit(LOAD_CONST, 1)
+        else:
+            self.compileExpression(node.step)
+        if node.parallel:
+            # a loop run by the workers goes on after its NEXT line, otherwise it runs here
+            self.emit(PARALLEL, (slot, self.lineno, node.name))
+        # NEXT resumes straight after the FOR, unless other code precedes it on the line which
+        # the interpreter would run again, then the whole line is resumed
+        pc = len(self.line.code)
+        self.emit(FOR, (slot, 0 if first else -pc - 1, tuple(self.slot(invariant.name)
+                                                             for invariant in node.hoisted)))
+
+    # ######################### expressions ##################################
+    def compileCondition(self, node):
+        # the code of a condition and the jump taken when it is not True, return the pc of the jump to patch
+        inference = self.interpreter.inference
+        if type(node) is Compare and inference.integer(node.left) and inference.integer(node.right):
+            # integers always compare to a boolean, so the jump tests the comparison itself
+            self.compileExpression(node.left)
+            self.compileExpression(node.right)
+            return self.emit(COMPARE_JUMP, OPERATORS[node.op])
+        self.compileExpression(node)
+        return self.emit(JUMP_IF_FALSE)
+
+    def compileIndex(self, variable):
+        # push the subscripts, a bare array name selects the first element, return their count
+        if not variable.indexes:
+            self.emit(LOAD_CONST, 0)
+        for index in variable.indexes:
+            self.compileExpression(index)
+        return len(variable.indexes) or 1
+
+    def compileExpression(self, node):
+        kind = type(node)
+        if kind is Literal:
+            self.emit(LOAD_CONST, node.value)
+        elif kind is Variable:
+            slot = self.slot(node.name)
+            if node.name in self.program.arrays:
+                self.emit(LOAD_INDEX, (slot, self.compileIndex(node)))
+            else:
+                self.emit(LOAD, slot)
+        elif kind is BinaryOp:
+            self.compileExpression(node.left)
+            self.compileExpression(node.right)
+            self.emit(BINARY, OPERATORS[node.op])
+        elif kind is Compare:
+            self.compileExpression(node.left)
+            self.compileExpression(node.right)
+            self.emit(COMPARE, OPERATORS[node.op])
+        elif kind is Rnd:
+            self.emit(RND, node.limit)
+        elif kind is Reduce:
+            self.emit(REDUCE, (self.slot(node.variable.name), node.function))
+        elif kind is Call:
+            for arg in node.args:
+                self.compileExpression(arg)
+            self.emit(CALL, (node.name, len(node.args)))
+        elif kind is Eof:
+            self.compileExpression(node.channel)
+            self.emit(EOF)
+        elif kind is Conditional:
+            skip = self.compileCondition(node.condition)
+            self.compileExpression(node.then_expr)
+            end = self.emit(JUMP)
+            self.patch(skip, self.distance(skip))
+            self.compileExpression(node.else_expr)
+            self.patch(end, self.distance(end))
+        elif kind is Invariant:
+            # the kept value, or the expression computed and kept on the first use
+            slot = self.slot(node.name)
+            skip = self.emit(LOAD_HOISTED)
+            self.compileExpression(node.expr)
+            self.emit(STORE_HOISTED, slot)
+            self.patch(skip, (slot, self.distance(skip)))
+        else:
+            self.error("cannot compile {}".format(kind.__name__))
+
+
+def disassemble(program, lineno=None):
+    # return a readable listing of the instructions of one line, or of the whole program
+    names = {slot: name for name, slot in program.slots.items()}
+    listing = []
+    for pc, (op, arg) in enumerate(program.code):
+        if lineno is not None and program.lines[pc] != lineno:
+            continue
+        if op in (LOAD, STORE, NEXT, STORE_HOISTED, INPUT_FILE):
+            text = "{} ({})".format(arg, names.get(arg))
+        elif op in (FOR, LOAD_HOISTED):
+            # relative jumps are listed with the position they lead to
+            text = "{} ({}) {!r}".format(arg[0], names.get(arg[0]), pc + 1 + arg[1])
+            if op == FOR and arg[2]:
+                text += " resets {}".format(", ".join("{} ({})".format(slot, names.get(slot)) for slot in arg[2]))
+        elif op in (JUMP, JUMP_IF_FALSE, GOSUB):
+            text = str(pc + 1 + arg)
+        elif op in (INPUT, LOAD_INDEX, STORE_INDEX, DIM, REDUCE, PARALLEL):
+            text = "{} ({}) {!r}".format(arg[0], names.get(arg[0]), arg[1])
+        elif op in (BINARY, COMPARE):
+            text = SYMBOLS.get(arg)
+        elif op == COMPARE_JUMP:
+            text = "{} {}".format(SYMBOLS.get(arg[0]), pc + 1 + arg[1])
+        elif op == LOAD_CONST:
+            text = repr(arg)
+        elif op in (EXEC, MAT):
+            text = "DEF FN {}".format(arg.name) if type(arg) is Def else \
+                "CHECKPOINT {!r}".format(arg.name) if type(arg) is Checkpoint else \
+                type(arg).__name__.upper() if type(arg) in (Open, Close, Restore) else arg.name
+        elif op == CALL:
+            text = "FN {} {}".format(arg[0], arg[1])
+        elif arg is None:
+            text = ""
+        else:
+            text = str(arg)
+        line = program.lines[pc] if pc == 0 or program.lines[pc - 1] != program.lines[pc] else ""
+        listing.append("{:>6} {:>6} {:<14}{}".format("" if line is None else line, pc, OPNAMES[op], text))
+    return listing
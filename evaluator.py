@@ -0,0 +1,284 @@
+"""
+Evaluator.py
+
+Walks the syntax trees built by the Parser, keeping the program state in the owning Interpreter
+"""
+from parser import Literal, Variable, Rnd, Reduce, Invariant, BinaryOp, Compare, Call, Eof, Conditional, Let, Print, If, \
+    For, Next, Goto, Gosub, Return, Def, Checkpoint, Input, Open, Close, Read, Data, Restore, Dim, Mat, Rem, Command
+from loop import Loop
+from variables import UNSET, Array
+from matrix import mat, reduce
+import operator
+
+BINARY = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": operator.truediv,
+}
+
+COMPARE = {
+    "=": operator.eq,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "<>": operator.ne,
+}
+
+# GOSUBs that may be waiting for their RETURN at once
+GOSUB_DEPTH = 10000
+
+
+class Evaluator:
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.statements = {
+            Let: self.executeLet,
+            Print: self.executePrint,
+            If: self.executeIf,
+            For: self.executeFor,
+            Next: self.executeNext,
+            Goto: self.executeGoto,
+            Gosub: self.executeGosub,
+            Return: self.executeReturn,
+            Def: self.executeDef,
+            Checkpoint: self.executeCheckpoint,
+            Input: self.executeInput,
+            Open: self.executeOpen,
+            Close: self.executeClose,
+            Read: self.executeRead,
+            Data: self.executeRem,
+            Restore: self.executeRestore,
+            Dim: self.executeDim,
+            Mat: self.executeMat,
+            Rem: self.executeRem,
+            Command: self.executeCommand,
+        }
+        self.expressions = {
+            Literal: self.evaluateLiteral,
+            Variable: self.evaluateVariable,
+            Rnd: self.evaluateRnd,
+            Reduce: self.evaluateReduce,
+            Invariant: self.evaluateInvariant,
+            BinaryOp: self.evaluateBinaryOp,
+            Compare: self.evaluateCompare,
+            Call: self.evaluateCall,
+            Eof: self.evaluateEof,
+            Conditional: self.evaluateConditional,
+        }
+
+    def error(self, msg="Syntax Error"):
+        raise SyntaxError(msg)
+
+    def execute(self, statements):
+        # run the statements of one line in order
+        for statement in statements:
+            self.statements[type(statement)](statement)
+
+    def evaluate(self, node):
+        return self.expressions[type(node)](node)
+
+    # ######################### statements ##################################
+    def slot(self, node):
+        # variable slots are looked up once per node and then kept on it
+        if node.slot is None:
+            node.slot = self.interpreter.variables.slot(node.name)
+        return node.slot
+
+    def executeLet(self, node):
+        variables = self.interpreter.variables
+        slot = self.slot(node.target)
+        indexes = self.subscripts(node.target)
+        result = self.evaluate(node.expr)
+        if not indexes and type(variables.values[slot]) is not Array:
+            variables.values[slot] = result
+        else:
+            variables.store(slot, result, indexes)
+
+    def executeDim(self, node):
+        self.interpreter.variables.set(node.name, Array([self.evaluate(dim) for dim in node.dims]))
+
+    def executeMat(self, node):
+        values = self.interpreter.variables.values
+        slot = self.slot(node)
+        operands = [self.operand(operand) for operand in node.operands]
+        values[slot] = mat(node.function, values[slot], operands, [self.evaluate(dim) for dim in node.dims])
+
+    def executePrint(self, node):
+        if node.channel is not None:
+            channel = self.evaluate(node.channel)
+            self.interpreter.files.write(channel, "".join([str(self.evaluate(item)) for item in node.items]))
+            return
+        string = "".join([str(self.evaluate(item)) for item in node.items])
+        print(string if string else "", file=self.interpreter.output)
+
+    def executeIf(self, node):
+        if self.evaluate(node.condition) is True:
+            self.execute(node.then_branch)
+        elif node.else_branch is not None:
+            self.execute(node.else_branch)
+
+    def executeFor(self, node):
+        interpreter = self.interpreter
+        e1 = self.evaluate(node.start)
+        e2 = self.evaluate(node.end)
+        step = 1 if node.step is None else self.evaluate(node.step)
+        if node.name not in interpreter.looptable:
+            if node.parallel and interpreter.parallel.run(interpreter.current_line(), node.name, e1, e2, step):
+                return
+            values = interpreter.variables.values
+            values[self.slot(node)] = e1
+            for invariant in node.hoisted:
+                values[self.slot(invariant)] = UNSET
+            interpreter.looptable.update({node.name: Loop(e1, e2, interpreter.linepos, step)})
+
+    def executeNext(self, node):
+        interpreter = self.interpreter
+        loop = interpreter.looptable.get(node.name)
+        if loop is None:
+            self.error("NEXT without FOR")
+        values = interpreter.variables.values
+        slot = self.slot(node)
+        if values[slot] < loop.end:
+            values[slot] += loop.step
+            interpreter.linepos = loop.line - 1  # deduct one to account for increment after execution
+        else:
+            interpreter.looptable.pop(node.name)
+
+    def executeGoto(self, node):
+        lineindex = self.interpreter.lineindex
+        if node.lineno in lineindex:
+            self.interpreter.linepos = lineindex.get(node.lineno) - 1
+        else:
+            self.error("Line number does not exist")
+
+    def executeGosub(self, node):
+        interpreter = self.interpreter
+        lineindex = interpreter.lineindex
+        if node.lineno not in lineindex:
+            self.error("Line number does not exist")
+        interpreter.push_return(interpreter.linepos)
+        interpreter.linepos = lineindex.get(node.lineno) - 1
+
+    def executeReturn(self, node):
+        interpreter = self.interpreter
+        if not interpreter.gosubs:
+            self.error("RETURN without GOSUB")
+        interpreter.linepos = interpreter.gosubs.pop()  # the line after the GOSUB runs next
+
+    def executeDef(self, node):
+        self.interpreter.functions.define(node)
+
+    def executeCheckpoint(self, node):
+        self.interpreter.checkpoint(node.name, None if node.every is None else self.evaluate(node.every))
+
+    def executeInput(self, node):
+        if node.channel is not None:
+            result = self.interpreter.files.input(self.evaluate(node.channel))
+        else:
+            result = self.interpreter.read_input("?" if node.prompt is None else node.prompt)
+        self.interpreter.variables.set(node.name, result)
+
+    def executeOpen(self, node):
+        self.interpreter.files.open(self.evaluate(node.path), node.mode, self.evaluate(node.channel))
+
+    def executeClose(self, node):
+        if not node.channels:
+            self.interpreter.files.close()
+        for channel in node.channels:
+            self.interpreter.files.close(self.evaluate(channel))
+
+    def executeRead(self, node):
+        variables = self.interpreter.variables
+        for target in node.targets:
+            slot = self.slot(target)
+            indexes = self.subscripts(target)
+            result = self.interpreter.files.read()
+            if not indexes and type(variables.values[slot]) is not Array:
+                variables.values[slot] = result
+            else:
+                variables.store(slot, result, indexes)
+
+    def executeRestore(self, node):
+        self.interpreter.files.restore(node.lineno)
+
+    def executeRem(self, node):
+        pass  # do nothing ignore remarks
+
+    def executeCommand(self, node):
+        interpreter = self.interpreter
+        if node.name == "LIST":
+            interpreter.compileList()
+        elif node.name == "RUN":
+            interpreter.run()
+        elif node.name == "NEW":
+            interpreter.new()
+        elif node.name == "CLEAR":
+            interpreter.clear()
+        elif node.name == "LOAD":
+            interpreter.load(node.argument)
+        elif node.name == "SAVE":
+            interpreter.save(node.argument)
+        elif node.name == "RESUME":
+            interpreter.resume(node.argument)
+        elif node.name == "DIS":
+            interpreter.disassemble(node.argument)
+        elif node.name == "PROFILE":
+            interpreter.profile(node.argument)
+        elif node.name == "?":
+            interpreter.show()
+
+    # ######################### expressions ##################################
+    def subscripts(self, variable):
+        return [self.evaluate(index) for index in variable.indexes]
+
+    def operand(self, node):
+        # a bare variable is passed whole, so an array operand is the array itself
+        if type(node) is Variable and not node.indexes:
+            return self.interpreter.variables.values[self.slot(node)]
+        return self.evaluate(node)
+
+    def evaluateLiteral(self, node):
+        return node.value
+
+    def evaluateVariable(self, node):
+        variables = self.interpreter.variables
+        slot = self.slot(node)
+        if not node.indexes:
+            value = variables.values[slot]
+            if value is not UNSET and type(value) is not Array:
+                return value
+        return variables.load(slot, self.subscripts(node))
+
+    def evaluateRnd(self, node):
+        return self.interpreter.random.randint(1, node.limit)
+
+    def evaluateReduce(self, node):
+        return reduce(node.function, self.operand(node.variable))
+
+    def evaluateInvariant(self, node):
+        values = self.interpreter.variables.values
+        slot = self.slot(node)
+        value = values[slot]
+        if value is UNSET:
+            value = values[slot] = self.evaluate(node.expr)
+        return value
+
+    def evaluateBinaryOp(self, node):
+        return BINARY[node.op](self.evaluate(node.left), self.evaluate(node.right))
+
+    def evaluateCompare(self, node):
+        return True if COMPARE[node.op](self.evaluate(node.left), self.evaluate(node.right)) else False
+
+    def evaluateCall(self, node):
+        return self.interpreter.functions.call(node.name, [self.evaluate(arg) for arg in node.args])
+
+    def evaluateEof(self, node):
+        return self.interpreter.files.eof(self.evaluate(node.channel))
+
+    def evaluateConditional(self, node):
+        if self.evaluate(node.condition) is True:
+            return self.evaluate(node.then_expr)
+        return self.evaluate(node.else_expr)
@@ -0,0 +1,201 @@
+"""
+Files.py
+
+Sequential files for OPEN, INPUT #, PRINT #, EOF and CLOSE, and the DATA pool READ takes its values
+from. A file opened for INPUT is read a block of about BUFFER bytes at a time, which is split into
+lines, so a file of any size streams through in bounded memory and most INPUT # only take the next
+line of the block. A file opened for OUTPUT or APPEND has a write buffer of BUFFER bytes, so the
+lines PRINT # writes go out in large batches. The DATA statements of a program are gathered into
+one pool before it runs; READ takes the next value of the pool and RESTORE goes back to its start
+or to the values of a line.
+"""
+from tokenizer import Tokentype
+from parser import Data
+from optimizer import walk
+import os
+import re
+
+# bytes read or written at a time
+BUFFER = 1 << 20
+
+# modes of OPEN
+MODES = ("INPUT", "OUTPUT", "APPEND")
+
+# numbers INPUT takes a line for, with an optional sign
+INTEGER = re.compile(r"\s*[-+]?\d+\s*")
+DECIMAL = re.compile(r"\s*[-+]?(\d+\.\d*|\.\d+|\d+(?=[eE]))([eE][-+]?\d+)?\s*")
+
+
+def value(text):
+    # a line read for INPUT: an int or a float when it is a number, the text itself otherwise
+    if INTEGER.fullmatch(text):
+        return int(text)
+    if DECIMAL.fullmatch(text):
+        return float(text)
+    return text
+
+
+class Channel:
+    # a file opened with OPEN
+
+    def __init__(self, path, mode, file, offset=0):
+        self.path = path  # absolute, so a resumed run finds it from any directory
+        self.mode = mode
+        self.file = file
+        self.offset = offset  # bytes of the file read by INPUT # so far
+        self.lines = []  # lines of the block read last
+        self.index = 0  # position in lines of the line INPUT # takes next
+
+    def fill(self):
+        # read the next block of lines, False at the end of the file
+        self.lines = self.file.readlines(BUFFER)
+        self.index = 0
+        return bool(self.lines)
+
+    def readline(self):
+        # the next line without its line end, None at the end of the file
+        if self.index >= len(self.lines) and not self.fill():
+            return None
+        line = self.lines[self.index]
+        self.index += 1
+        self.offset += len(line)
+        return line.decode(errors="replace").rstrip("\r\n")
+
+    def eof(self):
+        return self.index >= len(self.lines) and not self.fill()
+
+    def tell(self):
+        # bytes of the file read or written, what a resumed run goes on from
+        if self.mode == "INPUT":
+            return self.offset
+        self.file.flush()
+        return self.file.tell()
+
+
+class Files:
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.channels = {}  # file number -> Channel
+        self.data = []  # values of the DATA statements of the program, in line order
+        self.lines = {}  # line number -> position in data of the first value of that line or after it
+        self.datapos = 0  # position in data of the value READ takes next
+
+    def error(self, msg="Syntax Error"):
+        raise SyntaxError(msg)
+
+    # ######################### files ##################################
+    def channel(self, number, mode=None):
+        channel = self.channels.get(number)
+        if channel is None:
+            self.error("File #{} is not open".format(number))
+        if mode == "INPUT" and channel.mode != "INPUT":
+            self.error("File #{} is not open for INPUT".format(number))
+        if mode == "OUTPUT" and channel.mode == "INPUT":
+            self.error("File #{} is not open for OUTPUT".format(number))
+        return channel
+
+    def open(self, path, mode, number):
+        if type(number) is not int or number < 1:
+            self.error("Bad file number {}".format(number))
+        if type(path) is not str:
+            self.error("File name must be a string")
+        if number in self.channels:
+            self.error("File #{} is already open".format(number))
+        self.channels.update({number: self.reopen(os.path.abspath(self.interpreter.path(path)), mode)})
+
+    def reopen(self, path, mode, offset=None):
+        # a channel of a file, at offset when a resumed run goes on with it
+        try:
+            if mode == "INPUT":
+                file = open(path, "rb", buffering=BUFFER)
+                if offset:
+                    file.seek(offset)
+            else:
+                if offset is not None:
+                    # whatever was written after the checkpoint is written again
+                    with open(path, "r+b") as writefile:
+                        writefile.truncate(offset)
+                file = open(path, "w" if mode == "OUTPUT" and offset is None else "a", buffering=BUFFER,
+                            encoding="utf-8", errors="replace", newline="\n")
+        except OSError as e:
+            self.error("Cannot open {}: {}".format(path, e.strerror))
+        return Channel(path, mode, file, offset or 0)
+
+    def close(self, number=None):
+        # CLOSE a file, every file without a number
+        numbers = list(self.channels) if number is None else [number]
+        for number in numbers:
+            self.channel(number)
+            self.channels.pop(number).file.close()
+
+    def flush(self):
+        for channel in self.channels.values():
+            if channel.mode != "INPUT":
+                channel.file.flush()
+
+    def input(self, number):
+        # INPUT #: the next line of a file
+        text = self.channel(number, "INPUT").readline()
+        if text is None:
+            self.error("Out of data in file #{}".format(number))
+        return value(text)
+
+    def write(self, number, text):
+        # PRINT #: a line to a file
+        self.channel(number, "OUTPUT").file.write(text + "\n")
+
+    def eof(self, number):
+        return True if self.channel(number, "INPUT").eof() else False
+
+    # ######################### DATA ##################################
+    def prepare(self):
+        # set up a run: close the files left open and gather the DATA pool of the program
+        self.close()
+        interpreter = self.interpreter
+        self.data = []
+        self.lines = {}
+        self.datapos = 0
+        for lineno in interpreter.steps:
+            self.lines.update({lineno: len(self.data)})
+            if not any(token.type is Tokentype.DATA for token in interpreter.tokens(lineno)):
+                continue
+            try:
+                statements = interpreter.parsed(lineno)
+            except SyntaxError:
+                self.error("Bad DATA in line {}".format(lineno))
+            for statement in walk(statements):
+                if type(statement) is Data:
+                    self.data.extend(statement.values)
+
+    def read(self):
+        # READ: the next value of the DATA pool
+        if self.datapos >= len(self.data):
+            self.error("Out of DATA")
+        self.datapos += 1
+        return self.data[self.datapos - 1]
+
+    def restore(self, lineno=None):
+        # RESTORE: READ goes on with the first DATA value, or the first of a line or after it
+        if lineno is None:
+            self.datapos = 0
+        elif lineno in self.lines:
+            self.datapos = self.lines.get(lineno)
+        else:
+            self.error("Line number does not exist")
+
+    # ######################### checkpoints ##################################
+    def state(self):
+        return {"channels": [[number, channel.path, channel.mode, channel.tell()]
+                             for number, channel in sorted(self.channels.items())],
+                "data": self.datapos}
+
+    def restore_state(self, state):
+        self.close()
+        directory = self.interpreter.directory
+        for number, path, mode, offset in state.get("channels"):
+            if directory is not None:
+                # a checkpoint of a session only reopens files inside its directory
+                self.interpreter.path(os.path.relpath(path, directory))
+            self.channels.update({number: self.reopen(path, mode, offset)})
+        self.datapos = state.get("data")
@@ -0,0 +1,160 @@
+"""
+Functions.py
+
+User functions defined with DEF FN. The expression of a definition is compiled once into a Python
+function of its parameters, which every engine calls. A function is pure when its value depends on
+its arguments alone: it reads no variables, draws no RND and calls only pure functions. Pure
+functions are memoized in a bounded least recently used cache, so a recursive definition such as
+FN fib computes each value once. Redefining a function empties every cache.
+"""
+from parser import Literal, Variable, Rnd, Reduce, Invariant, BinaryOp, Compare, Call, Eof, Conditional
+from optimizer import text
+from translator import OPERATORS
+from matrix import reduce
+import functools
+
+# values a pure function keeps by default, the least recently used are dropped first
+MEMO = 4096
+
+
+class Function:
+    # a function defined with DEF FN
+    def __init__(self, name, params, expr, body):
+        self.name = name
+        self.params = params
+        self.expr = expr
+        self.body = body  # python function of the parameters
+        self.calls = set()  # names of the functions it calls
+        self.reads = False  # whether it reads variables or draws RND
+        self.pure = False
+        self.function = body  # what a call runs, memoized when the function is pure
+
+    def source(self):
+        return "FN {}({}) = {}".format(self.name, ", ".join(self.params), text(self.expr))
+
+
+class Functions:
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.functions = {}  # name -> Function
+        self.memo = MEMO  # values a pure function keeps, 0 for no memoization
+
+    def error(self, msg="Syntax Error"):
+        raise SyntaxError(msg)
+
+    def __bool__(self):
+        return bool(self.functions)
+
+    def define(self, node):
+        # DEF FN, redefining a function with the same text keeps its cache
+        old = self.functions.get(node.name)
+        if old is not None and old.params == node.params and text(old.expr) == text(node.expr):
+            return
+        locals = {param: "a{}".format(pos) for pos, param in enumerate(node.params)}
+        function = Function(node.name, node.params, node.expr, None)
+        source = "lambda {}: {}".format(", ".join(locals.values()), self.expression(node.expr, locals, function))
+        variables = self.interpreter.variables
+        namespace = {
+            "load": variables.load,
+            "values": variables.values,
+            "randint": self.interpreter.random.randint,
+            "reduce": reduce,
+            "call": self.call,
+            "eof": self.interpreter.files.eof,
+        }
+        function.body = function.function = eval(compile(source, "<FN {}>".format(node.name), "eval"), namespace)
+        self.functions.update({node.name: function})
+        self.settle()
+
+    def settle(self):
+        # work out which functions are pure and memoize those, every cache starts empty
+        functions = self.functions
+        pure = {name for name, function in functions.items() if not function.reads}
+        changed = True
+        while changed:
+            changed = False
+            for name in list(pure):
+                if not functions.get(name).calls <= pure:
+                    pure.discard(name)
+                    changed = True
+        for name, function in functions.items():
+            function.pure = name in pure
+            if function.pure and self.memo:
+                function.function = functools.lru_cache(maxsize=self.memo, typed=True)(function.body)
+            else:
+                function.function = function.body
+
+    def set_memo(self, size):
+        self.memo = size
+        self.settle()
+
+    def call(self, name, args):
+        function = self.functions.get(name)
+        if function is None:
+            self.error("Undefined function FN {}".format(name))
+        if len(args) != len(function.params):
+            self.error("Wrong number of arguments for FN {}".format(name))
+        try:
+            return function.function(*args)
+        except RecursionError:
+            self.error("FN {} nested too deeply".format(name))
+
+    def clear(self):
+        self.functions = {}
+
+    def report(self):
+        # a line per function: whether it is pure and how its cache fares
+        lines = []
+        for name, function in sorted(self.functions.items()):
+            if function.function is function.body:
+                lines.append("{} {}".format(function.source(), "pure" if function.pure else "impure"))
+                continue
+            info = function.function.cache_info()
+            total = info.hits + info.misses
+            lines.append("{} pure, cache hits {} misses {} rate {:.1f}% size {} of {}".format(
+                function.source(), info.hits, info.misses, 100 * info.hits / total if total else 0.0,
+                info.currsize, info.maxsize))
+        return lines
+
+    # ######################### expressions ##################################
+    def expression(self, node, locals, function):
+        # python source of the expression of a definition, noting what it calls and reads
+        def expression(child):
+            return self.expression(child, locals, function)
+
+        kind = type(node)
+        if kind is Literal:
+            return repr(node.value)
+        elif kind is Variable:
+            if node.name in locals:
+                if node.indexes:
+                    self.error("Parameter {} of FN {} cannot be subscripted".format(node.name, function.name))
+                return locals.get(node.name)
+            function.reads = True
+            slot = self.interpreter.variables.slot(node.name)
+            return "load({}, ({}))".format(slot, "".join(expression(index) + ", " for index in node.indexes))
+        elif kind is Rnd:
+            function.reads = True
+            return "randint(1, {})".format(node.limit)
+        elif kind is Reduce:
+            function.reads = True
+            return "reduce({!r}, values[{}])".format(node.function,
+                                                      self.interpreter.variables.slot(node.variable.name))
+        elif kind is Invariant:
+            return expression(node.expr)
+        elif kind is Eof:
+            function.reads = True
+            return "eof({})".format(expression(node.channel))
+        elif kind is Call:
+            function.calls.add(node.name)
+            return "call({!r}, ({}))".format(node.name, "".join(expression(arg) + ", " for arg in node.args))
+        elif kind is Conditional:
+            return "({} if {} is True else {})".format(expression(node.then_expr), expression(node.condition),
+                                                       expression(node.else_expr))
+        elif kind is Compare:
+            return "(True if {} {} {} else False)".format(expression(node.left), OPERATORS[node.op],
+                                                          expression(node.right))
+        elif kind is BinaryOp:
+            return "({} {} {})".format(expression(node.left), OPERATORS[node.op], expression(node.right))
+        self.error("Cannot define FN {}".format(function.name))
@@ -0,0 +1,151 @@
+"""
+Hooks.py
+
+Execution hooks in the spirit of sys.settrace. Callbacks registered on an Interpreter are called
+for line, statement, variable write, loop iteration and jump events. Events are only produced by the
+traced run, which the interpreter switches to for a whole RUN when a hook is registered, so a run
+without hooks pays nothing for them.
+"""
+from evaluator import Evaluator
+
+# event -> what the callback receives besides the interpreter and the event name
+EVENTS = {
+    "line": "line number",
+    "statement": "statement node",
+    "write": "(variable name, value)",
+    "loop": "(variable name, value) when NEXT goes round again",
+    "jump": "(line number, target line number) of a GOTO, GOSUB or RETURN",
+}
+
+
+class Hook:
+    # a callback(interpreter, event, argument) called for every nth event
+    def __init__(self, event, callback, every=1):
+        if event not in EVENTS:
+            raise ValueError("Unknown event {}, choose one of {}".format(event, ", ".join(EVENTS)))
+        if every < 1:
+            raise ValueError("every must be at least 1")
+        self.event = event
+        self.callback = callback
+        self.every = every
+        self.count = 0
+
+
+class Hooks:
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.hooks = {event: [] for event in EVENTS}
+        self.evaluator = TracedEvaluator(interpreter, self)
+
+    def add(self, event, callback, every=1):
+        hook = Hook(event, callback, every)
+        self.hooks.get(event).append(hook)
+        return hook
+
+    def remove(self, hook):
+        self.hooks.get(hook.event).remove(hook)
+
+    def __bool__(self):
+        return any(self.hooks.values())
+
+    def fire(self, event, argument):
+        for hook in self.hooks.get(event):
+            hook.count += 1
+            if hook.count >= hook.every:
+                hook.count = 0
+                hook.callback(self.interpreter, event, argument)
+
+    def run(self, execute_line):
+        # the line loop of RUN with events and debug output, statements run on the traced tree walker
+        # when hooks are registered
+        interpreter = self.interpreter
+        evaluator = interpreter.evaluator
+        if self:
+            interpreter.evaluator = self.evaluator
+        lines = self.hooks.get("line")
+        try:
+            while interpreter.linepos < len(interpreter.steps):
+                lineno = interpreter.steps[interpreter.linepos]
+                print("Current line := {} Code to execute := {}".format(interpreter.linepos, interpreter.program.get(
+                    lineno))) if interpreter.debug else False
+                if lines:
+                    self.fire("line", lineno)
+                execute_line(lineno)
+                interpreter.dump()
+                interpreter.linepos += 1
+        finally:
+            interpreter.evaluator = evaluator
+
+
+class TracedEvaluator(Evaluator):
+    # the tree walker reporting statements, writes, loop iterations and jumps to the hooks
+
+    def __init__(self, interpreter, hooks):
+        super().__init__(interpreter)
+        self.hooks = hooks
+
+    def execute(self, statements):
+        fire = self.hooks.fire
+        for statement in statements:
+            fire("statement", statement)
+            self.statements[type(statement)](statement)
+
+    def executeLet(self, node):
+        indexes = self.subscripts(node.target)
+        result = self.evaluate(node.expr)
+        self.interpreter.variables.store(self.slot(node.target), result, indexes)
+        self.hooks.fire("write", (node.target.name, result))
+
+    def executeInput(self, node):
+        super().executeInput(node)
+        self.written(node.name)
+
+    def executeRead(self, node):
+        for target in node.targets:
+            indexes = self.subscripts(target)
+            result = self.interpreter.files.read()
+            self.interpreter.variables.store(self.slot(target), result, indexes)
+            self.hooks.fire("write", (target.name, result))
+
+    def executeDim(self, node):
+        super().executeDim(node)
+        self.written(node.name)
+
+    def executeMat(self, node):
+        super().executeMat(node)
+        self.written(node.name)
+
+    def executeFor(self, node):
+        started = node.name not in self.interpreter.looptable
+        super().executeFor(node)
+        if started:
+            self.written(node.name)
+
+    def executeNext(self, node):
+        super().executeNext(node)
+        if node.name in self.interpreter.looptable:
+            value = self.interpreter.variables.get(node.name)
+            self.hooks.fire("write", (node.name, value))
+            self.hooks.fire("loop", (node.name, value))
+
+    def executeGoto(self, node):
+        interpreter = self.interpreter
+        lineno = interpreter.steps[interpreter.linepos] if interpreter.linepos < len(interpreter.steps) else None
+        super().executeGoto(node)
+        self.hooks.fire("jump", (lineno, node.lineno))
+
+    def executeGosub(self, node):
+        lineno = self.interpreter.current_line()
+        super().executeGosub(node)
+        self.hooks.fire("jump", (lineno, node.lineno))
+
+    def executeReturn(self, node):
+        interpreter = self.interpreter
+        lineno = interpreter.current_line()
+        super().executeReturn(node)
+        pos = interpreter.linepos + 1
+        self.hooks.fire("jump", (lineno, interpreter.steps[pos] if pos < len(interpreter.steps) else None))
+
+    def written(self, name):
+        self.hooks.fire("write", (name, self.interpreter.variables.get(name)))
@@ -0,0 +1,271 @@
+"""
+Image.py
+
+Binary program images for SAVE and LOAD. An image holds every source line together with its
+token stream, so a loaded program runs without being lexed again. Images are read through mmap.
+
+Plain text programs, one numbered line per line as typed at the prompt, and programs saved with
+pickle by older versions load as well. Their tokens are kept in a sidecar image in a
+__basiccache__ directory next to the program, which is used again for as long as the hash of the
+program file matches the one recorded in it.
+"""
+from tokenizer import Tokentype, Token, KEYWORDS, KEYWORD_TOKENS, SYMBOL_TOKENS, LEXERS
+from array import array
+import hashlib
+import io
+import mmap
+import os
+import pickle
+import re
+import struct
+import sys
+
+MAGIC = b"PYBASIC\0"
+VERSION = 2  # 2 skips the text of REM when lexing
+READABLE = (1, 2)  # versions whose source still loads, the tokens of older ones are made again
+CACHE_DIR = "__basiccache__"
+LINE_NUMBER = re.compile(r"\s*([0-9]+)")  # of a line in a text program
+
+# magic, version, source hash (zero for a saved program), lexicon fingerprint, number of lines,
+# number of distinct tokens, number of token references
+HEADER = struct.Struct("<8sH32s32sIII")
+LINE = struct.Struct("<qII")  # line number, length of the utf-8 source, number of tokens
+TOKEN = struct.Struct("<BB")  # token type, value kind
+LENGTH = struct.Struct("<I")
+INTEGER = struct.Struct("<q")
+UNTOKENIZED = 0xFFFFFFFF  # token count of a line the lexer rejects
+
+# value kinds
+NONE = 0
+INT = 1
+STR = 2
+BIGINT = 3
+
+TYPES = list(Tokentype)
+TYPE_CODES = {type: code for code, type in enumerate(TYPES)}
+SHARED = {(token.type, token.value): token for token in list(KEYWORD_TOKENS.values()) + list(SYMBOL_TOKENS.values())}
+
+# tokens stored under other token types or keywords would mean something else, such images are re-lexed
+LEXICON = hashlib.sha256("\n".join([type.name for type in TYPES] + KEYWORDS).encode()).digest()
+
+
+def error(msg="Bad program image"):
+    raise SyntaxError(msg)
+
+
+# ######################### writing ##################################
+# an image is its header, a table of the distinct tokens of the program, one record per line with its
+# source, and the token streams of all lines as one array of indexes into the token table
+def encode(program, tokens, source_hash=bytes(32)):
+    # image bytes for a program (line number -> source) and the tokens of its lines (line number -> tokens)
+    table = {}  # (type, value) -> index
+    entries = []
+    lines = []
+    refs = array("I")
+    for lineno, code in sorted(program.items()):
+        source = code.encode("utf-8")
+        stream = tokens.get(lineno)
+        lines.append(LINE.pack(lineno, len(source), UNTOKENIZED if stream is None else len(stream)))
+        lines.append(source)
+        for token in stream or []:
+            key = (token.type, type(token.value), token.value)
+            index = table.get(key)
+            if index is None:
+                index = table[key] = len(table)
+                entries.append(entry(token))
+            refs.append(index)
+    if sys.byteorder == "big":
+        refs.byteswap()
+    header = HEADER.pack(MAGIC, VERSION, source_hash, LEXICON, len(lines) // 2, len(table),
+                         len(refs))
+    return b"".join([header] + entries + lines + [refs.tobytes()])
+
+
+def entry(token):
+    value = token.value
+    if value is None:
+        return TOKEN.pack(TYPE_CODES[token.type], NONE)
+    elif type(value) is int and -0x8000000000000000 <= value <= 0x7fffffffffffffff:
+        return TOKEN.pack(TYPE_CODES[token.type], INT) + INTEGER.pack(value)
+    text = str(value).encode("utf-8")
+    return TOKEN.pack(TYPE_CODES[token.type], BIGINT if type(value) is int else STR) + LENGTH.pack(len(text)) + text
+
+
+def write(path, data):
+    # replace the file in one step so a reader never sees half an image
+    temp = "{}.{}.tmp".format(path, os.getpid())
+    with open(temp, "wb") as writefile:
+        writefile.write(data)
+    os.replace(temp, path)
+
+
+def save(path, program):
+    write(path, encode(program, tokenize(program)))
+
+
+# ######################### reading ##################################
+def decode(data):
+    # (source hash, program, tokens) of an image, tokens is None when they were made for another lexicon
+    if len(data) < HEADER.size:
+        error()
+    magic, version, source_hash, lexicon, count, size, total = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version not in READABLE:
+        error("Unsupported program image")
+    pos = HEADER.size
+    try:
+        table = []
+        for i in range(size):
+            type_code, kind = TOKEN.unpack_from(data, pos)
+            pos += TOKEN.size
+            if kind == INT:
+                value, = INTEGER.unpack_from(data, pos)
+                pos += INTEGER.size
+            elif kind == NONE:
+                value = None
+            else:
+                length, = LENGTH.unpack_from(data, pos)
+                pos += LENGTH.size
+                value = data[pos:pos + length].decode("utf-8")
+                pos += length
+                if kind == BIGINT:
+                    value = int(value)
+            token_type = TYPES[type_code]
+            table.append(SHARED.get((token_type, value)) or Token(token_type, value))
+        program = {}
+        counts = []
+        for i in range(count):
+            lineno, length, tokencount = LINE.unpack_from(data, pos)
+            pos += LINE.size
+            program.update({lineno: data[pos:pos + length].decode("utf-8")})
+            pos += length
+            counts.append((lineno, tokencount))
+        refs = array("I")
+        refs.frombytes(data[pos:pos + total * refs.itemsize])
+        if len(refs) != total:
+            error()
+        if sys.byteorder == "big":
+            refs.byteswap()
+        streams = [table[index] for index in refs]
+    except (struct.error, IndexError, UnicodeDecodeError, ValueError):
+        error()
+    if lexicon != LEXICON or version != VERSION:
+        return source_hash, program, None
+    tokens = {}
+    pos = 0
+    for lineno, tokencount in counts:
+        if tokencount != UNTOKENIZED:
+            tokens.update({lineno: streams[pos:pos + tokencount]})
+            pos += tokencount
+    return source_hash, program, tokens
+
+
+def is_image(data):
+    return data[:len(MAGIC)] == MAGIC
+
+
+class ProgramUnpickler(pickle.Unpickler):
+    # programs saved with pickle are plain dicts, anything that needs a class or function is refused
+
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError("{}.{} is not allowed in a program".format(module, name))
+
+
+def unpickle(data):
+    try:
+        program = ProgramUnpickler(io.BytesIO(data[:])).load()
+    except (pickle.UnpicklingError, EOFError, ValueError, TypeError, KeyError, IndexError):
+        error("Not a program file")
+    if type(program) is not dict or \
+            not all(type(lineno) is int and type(code) is str for lineno, code in program.items()):
+        error("Not a program file")
+    return program
+
+
+def is_text(data):
+    # a text program starts with a line number, pickles never do
+    text = data[:64].lstrip()
+    return text[:1].isdigit()
+
+
+def parse_text(data):
+    # the program of a text file, every line is split as the prompt splits a numbered line
+    try:
+        lines = data[:].decode("utf-8").splitlines()
+    except UnicodeDecodeError:
+        error("Not a program file")
+    program = {}
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        result = LINE_NUMBER.match(line)
+        if result is None:
+            error("Line number expected in line {} of the file".format(number))
+        code = line[result.end():]
+        if code:
+            program.update({int(result.group(1)): code})
+    return program
+
+
+def tokenize(program):
+    # tokens of every line the lexer accepts
+    lexer = LEXERS["fast"]()
+    tokens = {}
+    for lineno, code in program.items():
+        try:
+            tokens.update({lineno: lexer.tokenize(code)})
+        except Exception:
+            pass
+    return tokens
+
+
+def cache_path(path):
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, CACHE_DIR, "{}.v{}.img".format(name, VERSION))
+
+
+def read(path):
+    # decode an image file straight from a memory map of it
+    with open(path, "rb") as readfile:
+        if os.fstat(readfile.fileno()).st_size == 0:
+            error()
+        with mmap.mmap(readfile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return decode(data)
+
+
+def cached(path, source_hash):
+    # (program, tokens) from the sidecar image of a file if it was made from the same contents
+    try:
+        cache_hash, program, tokens = read(cache_path(path))
+    except (OSError, SyntaxError):
+        return None
+    if cache_hash != source_hash or tokens is None:
+        return None
+    return program, tokens
+
+
+def store_cache(path, source_hash, program, tokens):
+    # a cache that cannot be written only costs the next load some time
+    try:
+        os.makedirs(os.path.dirname(cache_path(path)), exist_ok=True)
+        write(cache_path(path), encode(program, tokens, source_hash))
+    except OSError:
+        pass
+
+
+def load(path):
+    # (program, tokens) of a program file, tokens only holds the lines that need no lexing
+    with open(path, "rb") as readfile:
+        if os.fstat(readfile.fileno()).st_size == 0:
+            error("Not a program file")
+        with mmap.mmap(readfile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if is_image(data):
+                source_hash, program, tokens = decode(data)
+                return program, {} if tokens is None else tokens
+            source_hash = hashlib.sha256(data).digest()
+            entry = cached(path, source_hash)
+            if entry is not None:
+                return entry
+            program = parse_text(data) if is_text(data) else unpickle(data)
+    tokens = tokenize(program)
+    store_cache(path, source_hash, program, tokens)
+    return program, tokens
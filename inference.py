@@ -0,0 +1,274 @@
+"""
+Inference.py
+
+Infers before a run which types every variable and expression of the program may have: int,
+float, str or bool. The analysis ignores the order of the lines, a variable may hold any type any
+statement assigns it, or the value it holds when the run starts, so what it finds holds on every
+path through the program. A DIM array has the types of its elements. Values from INPUT and FN
+calls may be of any type, READ takes the types of the DATA pool.
+
+An operation that fails for every combination of the types of its operands, such as subtracting
+a number from a variable only ever assigned strings, is reported as a type conflict on standard
+error before the program runs. The program runs all the same and fails only when it reaches that
+operation, which it may never do.
+
+The engines use the types to pick fast paths: the VM jumps on comparisons of two integers without
+making a boolean of them first, and the translator runs a FOR loop whose start and end are
+integers and whose variable the body never assigns as a python loop over a range.
+"""
+from parser import Literal, Variable, Rnd, Reduce, Invariant, BinaryOp, Compare, Call, Eof, Conditional, Let, Print, \
+    If, For, Def, Checkpoint, Input, Open, Close, Read, Dim, Mat
+from optimizer import text
+from variables import UNSET, Array
+import sys
+
+INT = "int"
+FLOAT = "float"
+STR = "str"
+BOOL = "bool"
+
+ORDER = (INT, FLOAT, STR, BOOL)
+NAMES = {int: INT, float: FLOAT, str: STR, bool: BOOL}
+
+NONE = frozenset()
+INTEGER = frozenset((INT,))
+NUMBERS = frozenset((INT, FLOAT, BOOL))  # booleans count as 1 and 0 in arithmetic
+ANY = frozenset(ORDER)
+INPUTS = frozenset((INT, FLOAT, STR))  # what files.value makes of a line
+
+
+def arithmetic(op, left, right):
+    # type of left op right, None when it fails
+    if left in NUMBERS and right in NUMBERS:
+        if op == "/":
+            return FLOAT
+        return FLOAT if FLOAT in (left, right) else INT
+    if op == "+" and left == STR and right == STR:
+        return STR
+    if op == "*" and STR in (left, right) and (left in (INT, BOOL) or right in (INT, BOOL)):
+        return STR
+    return None
+
+
+def comparison(op, left, right):
+    if op in ("=", "<>") or (left in NUMBERS and right in NUMBERS) or left == right == STR:
+        return BOOL
+    return None
+
+
+def describe(types):
+    return "|".join(kind for kind in ORDER if kind in types)
+
+
+def elements(value):
+    # types a variable holds now, those of its elements for an array
+    if value is UNSET:
+        return NONE
+    if type(value) is not Array:
+        return frozenset((NAMES.get(type(value), STR),))
+    items = value.items
+    if type(items) is not list:
+        return INTEGER
+    return frozenset(NAMES.get(kind, STR) for kind in set(map(type, items)))
+
+
+class Inference:
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.types = None  # variable name -> frozenset of its types, None when the program could not be analysed
+        self.signature = None  # the types as one value, engines recompile when it is another
+        self.env = {}  # variable name -> set of types, while the analysis runs
+        self.data = NONE  # types of the values of the DATA pool
+        self.changed = False
+        self.lineno = None
+        self.check = False  # whether conflicts are reported, on the last pass
+        self.warned = set()  # conflicts reported by the last analysis
+
+    def analyse(self):
+        # infer the types of the program about to run and warn of its type conflicts. A program with a line
+        # that does not parse is not analysed, that line fails when it is run
+        interpreter = self.interpreter
+        self.types = None
+        lines = []
+        for lineno in interpreter.steps:
+            try:
+                lines.append((lineno, interpreter.parsed(lineno)))
+            except SyntaxError:
+                self.signature = None
+                return
+        self.env = {}
+        for name, value in zip(interpreter.variables.names, interpreter.variables.values):
+            if not name.startswith("%"):
+                self.assign(name, elements(value))
+        self.data = frozenset(NAMES.get(type(value), STR) for value in interpreter.files.data)
+        # the types only ever grow, so this ends once a pass over the program adds none
+        self.check = False
+        self.changed = True
+        while self.changed:
+            self.changed = False
+            for self.lineno, statements in lines:
+                self.statements(statements)
+        self.check = True
+        self.warned = set()
+        for self.lineno, statements in lines:
+            self.statements(statements)
+        self.check = False
+        self.lineno = None
+        self.types = {name: frozenset(types) for name, types in self.env.items()}
+        self.env = {}
+        signature = frozenset(self.types.items())
+        self.signature = self.signature if signature == self.signature else signature
+
+    def assign(self, name, types):
+        known = self.env.setdefault(name, set())
+        if not types <= known:
+            known.update(types)
+            self.changed = True
+
+    def conflict(self, source, op, left, right):
+        # a warning only, the line may never be reached
+        msg = "Type conflict in line {}: {} is {} {} {}".format(self.lineno, source, describe(left), op,
+                                                                describe(right))
+        if msg not in self.warned:
+            self.warned.add(msg)
+            print(msg, file=sys.stderr)
+
+    # ######################### statements ##################################
+    def statements(self, statements):
+        for node in statements:
+            kind = type(node)
+            if kind is Let:
+                self.infer(node.target)
+                self.assign(node.target.name, self.infer(node.expr))
+            elif kind is Print:
+                self.infer(node.channel)
+                for item in node.items:
+                    self.infer(item)
+            elif kind is If:
+                self.infer(node.condition)
+                self.statements(node.then_branch)
+                if node.else_branch is not None:
+                    self.statements(node.else_branch)
+            elif kind is For:
+                self.statementFor(node)
+            elif kind is Input:
+                self.infer(node.channel)
+                self.assign(node.name, INPUTS)
+            elif kind is Read:
+                for target in node.targets:
+                    self.infer(target)
+                    self.assign(target.name, self.data)
+            elif kind is Dim:
+                for dim in node.dims:
+                    self.infer(dim)
+                self.assign(node.name, INTEGER)
+            elif kind is Mat:
+                # ZER and CON give integers, arithmetic on whole arrays numbers or the types of the operands
+                types = {INT, FLOAT}
+                for operand in node.operands:
+                    types.update(self.infer(operand))
+                for dim in node.dims:
+                    self.infer(dim)
+                self.assign(node.name, types)
+            elif kind is Def:
+                # the parameters may be of any type
+                env = self.env
+                self.env = dict(env)
+                self.env.update({param: set(ANY) for param in node.params})
+                self.infer(node.expr)
+                self.env = env
+            elif kind is Checkpoint:
+                self.infer(node.every)
+            elif kind is Open:
+                self.infer(node.path)
+                self.infer(node.channel)
+            elif kind is Close:
+                for channel in node.channels:
+                    self.infer(channel)
+
+    def statementFor(self, node):
+        # the variable takes the start and then goes up by the step for as long as it is less than the end
+        self.assign(node.name, self.infer(node.start))
+        end = self.infer(node.end)
+        step = INTEGER if node.step is None else self.infer(node.step)
+        variable = frozenset(self.env.get(node.name))
+        self.assign(node.name, self.combine("+", variable, step, arithmetic))
+        if self.check:
+            if variable and end and not self.combine("<", variable, end, comparison):
+                self.conflict("FOR {} TO {}".format(node.name, text(node.end)), "<", variable, end)
+            if variable and step and not self.combine("+", variable, step, arithmetic):
+                self.conflict("FOR {} STEP {}".format(node.name, 1 if node.step is None else text(node.step)), "+",
+                              variable, step)
+
+    # ######################### expressions ##################################
+    def combine(self, op, left, right, rule):
+        types = set()
+        for first in left:
+            for second in right:
+                kind = rule(op, first, second)
+                if kind is not None:
+                    types.add(kind)
+        return types
+
+    def infer(self, node):
+        # the types an expression may have, reporting a conflict in it on the last pass
+        if node is None:
+            return NONE
+        kind = type(node)
+        if kind is Literal:
+            return frozenset((NAMES.get(type(node.value), STR),))
+        elif kind is Variable:
+            for index in node.indexes:
+                self.infer(index)
+            return frozenset(self.env.get(node.name, NONE))
+        elif kind is BinaryOp or kind is Compare:
+            left = self.infer(node.left)
+            right = self.infer(node.right)
+            types = self.combine(node.op, left, right, arithmetic if kind is BinaryOp else comparison)
+            if self.check and left and right and not types:
+                self.conflict(text(node), node.op, left, right)
+            return frozenset(types)
+        elif kind is Rnd:
+            return INTEGER
+        elif kind is Reduce:
+            types = self.infer(node.variable)
+            if node.function != "SUM":
+                return types
+            return frozenset(kind for kind in (INT, FLOAT) if kind in types or kind == INT and BOOL in types)
+        elif kind is Invariant:
+            return self.infer(node.expr)
+        elif kind is Call:
+            for arg in node.args:
+                self.infer(arg)
+            return ANY
+        elif kind is Eof:
+            self.infer(node.channel)
+            return frozenset((BOOL,))
+        elif kind is Conditional:
+            self.infer(node.condition)
+            return self.infer(node.then_expr) | self.infer(node.else_expr)
+        return ANY
+
+    # ######################### queries of the engines ##################################
+    def typeof(self, node):
+        # the types of an expression of the program analysed last, None when it was not analysed
+        if self.types is None:
+            return None
+        self.env = self.types
+        try:
+            return self.infer(node)
+        finally:
+            self.env = {}
+
+    def integer(self, node):
+        # whether an expression always gives an int
+        types = self.typeof(node)
+        return bool(types) and types <= INTEGER
+
+    def report(self):
+        # the types of the variables, for ?
+        if self.types is None:
+            return []
+        return ["{} {}".format(name, describe(types)) for name, types in sorted(self.types.items())
+                if types and not name.startswith("%")]
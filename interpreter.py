@@ -2,10 +2,28 @@
 Interpreter.py
 
 """
-from tokenizer import Tokentype, Lexer
-import pickle
+from tokenizer import Tokentype, LEXERS
+from parser import Parser
+from optimizer import Optimizer, text
+from evaluator import Evaluator, GOSUB_DEPTH
+from compiler import Compiler, CompileError, disassemble
+from vm import VM
+from translator import Translator
+from loop import Loop
+from variables import Variables, Array, UNSET
+from matrix import mat, reduce
+from profiler import Profiler
+from hooks import Hooks
+from parallel import Parallel
+from functions import Functions
+from checkpoint import Checkpoints
+from files import Files, value
+from inference import Inference
+import image
 import random
+import sys
 import os
+import time
 
 SYMBOLS = (
     Tokentype.PLUS,
@@ -18,29 +36,73 @@ SYMBOLS = (
     Tokentype.NE,
 )
 
+# array functions
+REDUCTIONS = (
+    Tokentype.SUM,
+    Tokentype.MIN,
+    Tokentype.MAX,
+)
+
+# statements whose line number operand is checked before a program runs
+JUMPS = (
+    Tokentype.GOTO,
+    Tokentype.GOSUB,
+    Tokentype.RESTORE,
+)
 
-class Loop:
-    def __init__(self, start, end, line, step=1):
-        self.start = start
-        self.end = end
-        self.line = line
-        self.step = step
+# execution engines: re-parse every line while executing it, walk a syntax tree parsed once per line,
+# compile the whole program to bytecode for the stack machine, or translate it to a python function
+ENGINES = ("classic", "ast", "vm", "python")
 
 
 class Interpreter:
 
-    def __init__(self):
-        self.symboltable = {}
+    def __init__(self, engine="classic", lexer="classic"):
+        self.variables = Variables()
         self.looptable = {}
         self.token_stream = None
         self.current_token = None
         self.position = 0  #
         self.result = None
         self.program = {}
-        self.lexer = Lexer()
+        self.lexer = LEXERS[lexer]()
         self.debug = False
         self.steps = []
+        self.lineindex = {}  # line number -> position in steps
         self.linepos = 0
+        self.token_cache = {}  # lineno -> (code, tokens)
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.engine = engine
+        self.parser = Parser()
+        self.optimizer = Optimizer()
+        self.optimize = True  # simplify the syntax trees of lines as they are parsed
+        self.hoisted = None  # (FOR line, line, invariant) hoisted out of the loops of the program, None until done
+        self.evaluator = Evaluator(self)
+        self.ast_cache = {}  # lineno -> (code, statements)
+        self.compiler = Compiler(self)
+        self.vm = VM(self)
+        self.bytecode = None  # compiled program, dropped whenever a line changes
+        self.translator = Translator(self)
+        self.translation = None  # python translation, dropped whenever a line changes
+        self.hooks = Hooks(self)  # execution hooks, a run is traced while any are registered
+        self.output = None  # file PRINT writes to, None for sys.stdout
+        self.input_stream = None  # file INPUT reads lines from, None to prompt with input()
+        self.random = random.Random()  # RND draws from it, seed() makes a run repeatable
+        self.parallel = Parallel(self)  # runs PARALLEL FOR loops on worker processes
+        self.gosubs = []  # line positions of the GOSUBs waiting for their RETURN
+        self.functions = Functions(self)  # functions defined with DEF FN
+        self.checkpoints = Checkpoints(self)  # saves and restores the state of runs
+        self.files = Files(self)  # files opened with OPEN and the DATA pool
+        self.inference = Inference(self)  # types of the variables of the program, inferred before it runs
+        self.checkpointed = False  # whether the program has CHECKPOINT statements, so it runs line by line
+        self.immediate = False  # whether a line typed at the prompt is executed rather than a program
+        self.directory = None  # directory the files of a server session are kept in, None for anywhere
+
+    @property
+    def symboltable(self):
+        # name -> value view of the variable store for the debug dumps
+        return self.variables.table()
 
     # #### helper methods ######
 
@@ -54,6 +116,15 @@ class Interpreter:
     def error(self, msg="Syntax Error"):
         raise SyntaxError(msg)
 
+    def path(self, name):
+        # the file a program names for OPEN, SAVE, LOAD, CHECKPOINT or a profile, which must lie inside
+        # the directory when there is one
+        if self.directory is None:
+            return name
+        if os.path.isabs(name) or ".." in name.replace("\\", "/").split("/"):
+            self.error("File name must be inside the session directory")
+        return os.path.join(self.directory, name)
+
     def advance(self):
         if self.position < len(self.token_stream):
             self.current_token = self.token_stream[self.position]
@@ -65,26 +136,397 @@ class Interpreter:
         self.compileStatement()
 
     def execute(self, text):
+        self.immediate = True
         # tokenize source stream
         self.token_stream = self.lexer.tokenize(text)
         # interpret token streamlist
+        if self.engine != "classic":
+            self.evaluator.execute(self.parse(self.token_stream))
+        else:
+            self.interpret()
+        self.dump()
+
+    def execute_line(self, lineno):
+        # interpret a program line from its cached token stream
+        self.token_stream = self.tokens(lineno)
         self.interpret()
+
+    def evaluate_line(self, lineno):
+        # walk the cached syntax tree of a program line
+        self.evaluator.execute(self.parsed(lineno))
+
+    def dump(self):
         print("SYMBOL TABLE {}".format(self.symboltable)) if self.debug else False
         print("LOOP TABLE {}".format(self.looptable)) if self.debug else False
         # print("Program {}".format(self.program)) if self.debug else False
 
-    def run(self):
+    def tokens(self, lineno):
+        # return the token stream for a program line, lexing it only on a cache miss
+        code = self.program.get(lineno)
+        entry = self.token_cache.get(lineno)
+        if entry is not None and entry[0] is code:
+            self.cache_hits += 1
+            return entry[1]
+        self.cache_misses += 1
+        tokens = self.lexer.tokenize(code)
+        self.token_cache.update({lineno: (code, tokens)})
+        return tokens
+
+    def parsed(self, lineno):
+        # return the statements of a program line, parsing it only when its source has changed
+        code = self.program.get(lineno)
+        entry = self.ast_cache.get(lineno)
+        if entry is not None and entry[0] is code:
+            return entry[1]
+        statements = self.parse(self.tokens(lineno))
+        self.ast_cache.update({lineno: (code, statements)})
+        return statements
+
+    def parse(self, tokens):
+        statements = self.parser.parse(tokens)
+        return self.optimizer.optimize(statements) if self.optimize else statements
+
+    def set_optimize(self, optimize):
+        # switch the optimizer, lines parsed with the other setting are parsed again
+        self.optimize = optimize
+        self.ast_cache = {}
+        self.bytecode = None
+        self.translation = None
+        self.hoisted = None
+
+    def hoist(self):
+        # hoist the loop invariants of the whole program once after it has changed
+        if not self.optimize or self.hoisted is not None:
+            return
+        lines = []
+        for lineno in sorted(self.program.keys()):
+            try:
+                lines.append((lineno, self.parsed(lineno)))
+            except Exception:
+                lines.append((lineno, None))
+        self.hoisted = self.optimizer.hoist(lines)
+        if self.hoisted:
+            self.bytecode = None
+            self.translation = None
+        for line, lineno, invariant in self.hoisted:
+            print("Hoisted {} in line {} out of the loop in line {}".format(text(invariant), lineno, line)) \
+                if self.debug else False
+
+    def set_line(self, lineno, code):
+        # insert or replace a program line
+        self.program.update({lineno: code})
+        self.invalidate(lineno)
+
+    def enter_line(self, lineno, code):
+        # insert or replace a line typed at the prompt. It is tokenized and parsed first, so a syntax error
+        # is reported at once and leaves the program as it was, and the line is stored with its tokens
+        # and syntax tree
+        tokens = self.lexer.tokenize(code)
+        statements = self.parse(tokens)
+        self.set_line(lineno, code)
+        self.token_cache.update({lineno: (code, tokens)})
+        self.ast_cache.update({lineno: (code, statements)})
+
+    def delete_line(self, lineno):
+        self.program.pop(lineno, None)
+        self.invalidate(lineno)
+
+    def invalidate(self, lineno):
+        self.token_cache.pop(lineno, None)
+        self.ast_cache.pop(lineno, None)
+        # hoisting changed the trees of the lines of loops with invariants, which have to be parsed again
+        for line, other, invariant in self.hoisted or []:
+            self.ast_cache.pop(line, None)
+            self.ast_cache.pop(other, None)
+        self.hoisted = None
+        self.bytecode = None
+        self.translation = None
+
+    def replace_program(self, program):
+        # swap in a whole new program (NEW / LOAD), dropping every cached line
+        self.program = program
+        self.token_cache = {}
+        self.ast_cache = {}
+        self.hoisted = None
+        self.bytecode = None
+        self.translation = None
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.steps = []
+        self.lineindex = {}
+        self.linepos = 0
+
+    def compile(self):
+        # return the bytecode for the program, compiling it only after it has changed
+        self.hoist()
+        if self.bytecode is None:
+            self.bytecode = self.compiler.compile()
+        return self.bytecode
+
+    def translate(self):
+        # return the python translation of the program, translating it only after it has changed
+        self.hoist()
+        if self.translation is None or self.translation.types is not self.inference.signature:
+            self.translation = self.translator.translate()
+            for lineno, reason in self.translation.fallbacks:
+                print("Line {} is interpreted: {}".format(lineno, reason)) if self.debug else False
+        return self.translation
+
+    def disassemble(self, lineno=None):
+        if self.engine == "python":
+            translation = self.translate()
+            if lineno is None:
+                print(translation.source, end="", file=self.output)
+            else:
+                for line in translation.segments.get(lineno, []):
+                    print(line, file=self.output)
+            for line, reason in translation.fallbacks:
+                print("Line {} is interpreted: {}".format(line, reason), file=self.output)
+            return
+        try:
+            program = self.compile()
+        except CompileError as e:
+            self.error("Cannot compile {}".format(e))
+        for line in disassemble(program, lineno):
+            print(line, file=self.output)
+
+    def current_line(self):
+        # number of the program line being run, None outside a run
+        return self.steps[self.linepos] if self.linepos < len(self.steps) else None
+
+    def seed(self, value):
+        # reseed RND in place, compiled and translated programs keep drawing from the same generator
+        self.random.seed(value)
+
+    def add_hook(self, event, callback, every=1):
+        # call callback(interpreter, event, argument) on every nth event of a run, see hooks.EVENTS
+        return self.hooks.add(event, callback, every)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def prepare(self):
+        # set up the line order for a run and check the jumps and the types
         self.steps = sorted(self.program.keys())
+        self.lineindex = {lineno: pos for pos, lineno in enumerate(self.steps)}
         self.linepos = 0
+        self.gosubs.clear()
+        self.immediate = False
         print("Program steps {}".format(self.steps)) if self.debug else False
+        self.check_jumps()
+        self.checkpointed = any(token.type is Tokentype.CHECKPOINT
+                                for lineno in self.steps for token in self.tokens(lineno))
+        self.files.prepare()
+        self.inference.analyse()
+        self.parallel.warned = set()
+        if self.engine != "classic":
+            self.hoist()
+            # a loop left by a break still holds on to the values it had hoisted
+            for line, lineno, invariant in self.hoisted or []:
+                self.variables.set(invariant.name, UNSET)
+
+    def run(self):
+        self.prepare()
+        if self.checkpointed or self.checkpoints.every:
+            self.run_checkpointed()
+            return
+        engine = self.engine
+        if engine == "vm":
+            try:
+                program = self.compile()
+            except (CompileError, SyntaxError) as e:
+                # run what the compiler cannot handle on the tree walker instead
+                print("Compile failed, using ast engine: {}".format(e)) if self.debug else False
+                engine = "ast"
+        execute_line = self.execute_line if engine == "classic" else self.evaluate_line
+        try:
+            if self.hooks:
+                # hooks see every line and statement, so the program runs on the traced tree walker
+                self.hooks.run(self.evaluate_line)
+            elif engine == "vm":
+                self.vm.run(program)
+            elif engine == "python":
+                self.run_translation()
+            elif self.debug:
+                self.hooks.run(execute_line)
+            else:
+                while self.linepos < len(self.steps):
+                    execute_line(self.steps[self.linepos])
+                    self.linepos += 1
+        except KeyboardInterrupt:
+            print("** BREAK **", file=self.output)
+        finally:
+            # what the program wrote to files is on disk when the run ends, CLOSE or not
+            self.files.flush()
+        print("Token cache hits {} misses {}".format(self.cache_hits, self.cache_misses)) if self.debug else False
+
+    def start(self):
+        # set up a run that run_steps carries out a slice at a time
+        self.prepare()
+
+    def run_steps(self, steps=None, seconds=None):
+        # go on with the run set up by start() for at most steps lines and, past its first line, seconds,
+        # and return whether lines are left to run. Lines run one at a time, so the vm and python engines
+        # run on the tree walker; between slices linepos, the loops and the variables hold the whole state
+        deadline = None if seconds is None else time.perf_counter() + seconds
+        traced = bool(self.hooks)
+        execute_line = self.execute_line if self.engine == "classic" and not traced else self.evaluate_line
+        evaluator = self.evaluator
+        if traced:
+            self.evaluator = self.hooks.evaluator
+        count = 0
         try:
             while self.linepos < len(self.steps):
-                code = self.program.get(self.steps[self.linepos])
-                print("Current line := {} Code to execute := {}".format(self.linepos, code)) if self.debug else False
-                self.execute(code)
+                if steps is not None and count >= steps:
+                    break
+                if deadline is not None and count and time.perf_counter() >= deadline:
+                    break
+                if traced:
+                    self.hooks.fire("line", self.steps[self.linepos])
+                execute_line(self.steps[self.linepos])
                 self.linepos += 1
+                count += 1
+        finally:
+            self.evaluator = evaluator
+        return self.linepos < len(self.steps)
+
+    def run_checkpointed(self):
+        # go on with a run line by line, as run_steps does, so that checkpoints are saved between lines, one
+        # every so many lines when asked to. Until then it goes one line at a time, so a CHECKPOINT asking for
+        # them has the first saved that many lines after it
+        checkpoints = self.checkpoints
+        try:
+            while self.run_steps(checkpoints.every or 1):
+                if checkpoints.every:
+                    checkpoints.save(checkpoints.name, self.linepos)
         except KeyboardInterrupt:
-            print("** BREAK **")
+            print("** BREAK **", file=self.output)
+        finally:
+            self.files.flush()
+
+    def checkpoint(self, name, every=None):
+        # CHECKPOINT: save the state, a run resumes with the line after this one. With every, the run also saves
+        # it every so many lines from now on, 0 stops that
+        if every is not None:
+            if type(every) is not int or every < 0:
+                self.error("CHECKPOINT interval must be a whole number")
+            self.checkpoints.name = name
+            self.checkpoints.every = every or None
+        self.checkpoints.save(name, None if self.immediate else self.linepos + 1)
+
+    def resume(self, name):
+        # RESUME: restore a checkpoint and go on with the run it was saved from
+        linepos = self.checkpoints.load(name)
+        if linepos is not None:
+            self.linepos = linepos
+            self.run_checkpointed()
+
+    def profile(self, name=None):
+        # run the program on the tree walker and report where the time goes, optionally saving the profile
+        profiler = Profiler(self)
+        profiler.run()
+        profiler.report()
+        if name is not None:
+            profiler.export(self.path(name))
+
+    def run_translation(self):
+        translation = self.translate()
+        try:
+            translation.function(self)
+        except IndexError as e:
+            self.stop_translation(translation, e)
+            self.error("Subscript out of range")
+        except BaseException as e:
+            self.stop_translation(translation, e)
+            raise
+        self.linepos = len(self.steps)
+
+    def stop_translation(self, translation, e):
+        # point linepos at the line the generated code failed in, interpreted lines have set it already
+        lineno = translation.line(e)
+        if lineno in self.lineindex:
+            self.linepos = self.lineindex.get(lineno)
+
+    def read_input(self, prompt):
+        # the value typed for INPUT, or the next line of the input stream when there is one
+        output = sys.stdout if self.output is None else self.output
+        if self.input_stream is None:
+            output.flush()
+            try:
+                result = input(prompt)
+            except EOFError:
+                self.error("Out of data")
+        else:
+            print(prompt, end="", file=output)
+            if self.input_stream.isatty():
+                output.flush()
+            result = self.input_stream.readline()
+            if not result:
+                self.error("Out of data")
+            result = result.rstrip("\r\n")
+        # a whole number becomes an int and a decimal one a float, like a line of a file read with INPUT #
+        return value(result)
+
+    def push_return(self, pos):
+        # note where a GOSUB was made for its RETURN
+        if len(self.gosubs) >= GOSUB_DEPTH:
+            self.error("GOSUB nested too deeply")
+        self.gosubs.append(pos)
+
+    def check_jumps(self):
+        # report a jump to a missing line before the program starts rather than when it is reached
+        for lineno in self.steps:
+            tokens = self.tokens(lineno)
+            for token, target in zip(tokens, tokens[1:]):
+                if token.type in JUMPS and target.type == Tokentype.INTEGER and target.value not in self.lineindex:
+                    self.error("Line number {} does not exist in line {}".format(target.value, lineno))
+
+    def new(self):
+        self.replace_program({})
+        self.clear()
+
+    def clear(self):
+        self.variables.clear()
+        self.looptable = {}
+        self.gosubs.clear()
+        self.functions.clear()
+        self.files.close()
+
+    def load(self, name):
+        self.load_file(self.path(name + ".bas"))
+
+    def load_file(self, path):
+        program, tokens = image.load(path)
+        self.replace_program(program)
+        # the tokens stored with the program fill the token cache, so its lines are never lexed
+        for lineno, stream in tokens.items():
+            self.token_cache.update({lineno: (program.get(lineno), stream)})
+
+    def save(self, name):
+        image.save(self.path(name + ".bas"), self.program)
+
+    def show(self):
+        print("Symbol Table {}".format(self.symboltable), file=self.output)
+        print("Loop Table {}".format(self.looptable), file=self.output)
+        print("Array bytes {}".format(self.variables.sizes()), file=self.output)
+        print("Token Cache hits {} misses {}".format(self.cache_hits, self.cache_misses), file=self.output)
+        for line in self.functions.report():
+            print("Function {}".format(line), file=self.output)
+        for line in self.inference.report():
+            print("Type {}".format(line), file=self.output)
+        if self.checkpoints.saved:
+            print("Checkpoints saved {}, the last wrote {} bytes of arrays".format(self.checkpoints.saved,
+                                                                                    self.checkpoints.written),
+                  file=self.output)
+        if self.optimize:
+            print("Optimizer removed {} nodes".format(self.optimizer.folded), file=self.output)
+            for line, lineno, invariant in self.hoisted or []:
+                print("Hoisted {} in line {} out of the loop in line {}".format(text(invariant), lineno, line),
+                      file=self.output)
+        if self.engine == "vm" and self.bytecode is not None:
+            print("Compiled lines {} of {}".format(self.compiler.compiled, len(self.compiler.lines)), file=self.output)
+        if self.engine == "python" and self.translation is not None:
+            print("Interpreted lines {}".format([lineno for lineno, reason in self.translation.fallbacks]), file=self.output)
 
     # ######################### processing methods ##################################
     def compileStatement(self):
@@ -104,12 +546,41 @@ class Interpreter:
         elif val == "INPUT":
             self.consume(Tokentype(val))
             self.compileInput()
+        elif val == "OPEN":
+            self.consume(Tokentype(val))
+            self.compileOpen()
+        elif val == "CLOSE":
+            self.consume(Tokentype(val))
+            if self.current_token.type in (Tokentype.COLON, Tokentype.ELSE, Tokentype.EOF):
+                self.files.close()
+            else:
+                self.files.close(self.compileChannel())
+                while self.current_token.type == Tokentype.COMMA:
+                    self.consume(Tokentype.COMMA)
+                    self.files.close(self.compileChannel())
+        elif val == "READ":
+            self.consume(Tokentype(val))
+            self.compileRead()
+        elif val == "DATA":
+            pass  # gathered before the program runs
+        elif val == "RESTORE":
+            self.consume(Tokentype(val))
+            lineno = self.current_token.value
+            if self.current_token.type == Tokentype.INTEGER:
+                self.consume(Tokentype.INTEGER)
+            else:
+                lineno = None
+            self.files.restore(lineno)
         elif val == "LIST":
             self.consume(Tokentype(val))
             self.compileList()
         elif val == "FOR":
             self.consume(Tokentype(val))
             self.compileFor()
+        elif val == "PARALLEL":
+            self.consume(Tokentype(val))
+            self.consume(Tokentype.FOR)
+            self.compileFor(True)
         elif val == "NEXT":
             self.consume(Tokentype(val))
             self.compileNext()
@@ -119,37 +590,74 @@ class Interpreter:
         elif val == "GOTO":
             self.consume(Tokentype(val))
             self.compileGoto()
+        elif val == "GOSUB":
+            self.consume(Tokentype(val))
+            self.compileGosub()
+        elif val == "RETURN":
+            self.consume(Tokentype(val))
+            self.compileReturn()
+        elif val == "DEF":
+            self.consume(Tokentype(val))
+            self.functions.define(self.parse_fragment(self.parser.parseDef))
+        elif val == "CHECKPOINT":
+            self.consume(Tokentype(val))
+            name = self.current_token.value
+            self.consume(Tokentype.STRING)
+            every = None
+            if self.current_token.type == Tokentype.COMMA:
+                self.consume(Tokentype.COMMA)
+                every = self.compileExpression()
+            if self.current_token.type == Tokentype.COLON:
+                self.error("CHECKPOINT must end its line")
+            self.checkpoint(name, every)
+        elif val == "RESUME":
+            self.consume(Tokentype(val))
+            name = self.current_token.value
+            self.consume(Tokentype.STRING)
+            self.resume(name)
+        elif val == "PROFILE":
+            self.consume(Tokentype(val))
+            name = self.current_token.value
+            if self.current_token.type == Tokentype.STRING:
+                self.consume(Tokentype.STRING)
+            else:
+                name = None
+            self.profile(name)
         elif val == "NEW":
             self.consume(Tokentype(val))
-            self.steps = []
-            self.linepos = 0
-            self.program = self.symboltable = self.looptable = {}
+            self.new()
         elif val == "CLEAR":
             self.consume(Tokentype(val))
-            self.symboltable = self.looptable = {}
+            self.clear()
         elif val == "LOAD":
             self.consume(Tokentype(val))
             name = self.current_token.value
             self.consume(Tokentype.STRING)
-            with open(name + ".bas", 'rb') as readfile:
-                self.program = pickle.load(readfile)
-                self.steps = []
-                self.linepos = 0
+            self.load(name)
         elif val == "SAVE":
             self.consume(Tokentype(val))
             name = self.current_token.value
             self.consume(Tokentype.STRING)
-            with open(name + ".bas", 'wb') as writefile:
-                pickle.dump(self.program, writefile)
+            self.save(name)
         elif val == "REM":
             pass  # do nothing ignore remarks
         elif val == "DIM":
             self.consume(Tokentype(val))
             self.compileDim()
+        elif val == "MAT":
+            self.consume(Tokentype(val))
+            self.compileMat()
+        elif val == "DIS":
+            self.consume(Tokentype(val))
+            lineno = self.current_token.value
+            if self.current_token.type == Tokentype.INTEGER:
+                self.consume(Tokentype.INTEGER)
+            else:
+                lineno = None
+            self.disassemble(lineno)
         elif val == "?":
             self.consume(Tokentype.DEBUG)
-            print("Symbol Table {}".format(self.symboltable))
-            print("Loop Table {}".format(self.looptable))
+            self.show()
         else:
             self.error()
         while self.current_token.type != Tokentype.COLON and self.current_token.type != Tokentype.EOF:
@@ -159,45 +667,104 @@ class Interpreter:
             self.compileStatement()
 
     def compileLet(self):
-        # 'let' Identifier ('['expression']')? '=' expression ';'
+        # 'let' Identifier ('['expression']')* '=' expression ';'
         name = self.current_token.value
-        pos = 0
         self.consume(Tokentype.IDENTIFIER)
-        while self.current_token.type == Tokentype.LBRACK:
-            self.consume(Tokentype.LBRACK)
-            pos = self.compileExpression()
-            self.consume(Tokentype.RBRACK)
+        indexes = self.compileSubscripts()
         self.consume(Tokentype.EQUALS)
         result = self.compileExpression()
-        if name in self.symboltable:
-            items = self.symboltable.get(name)
-        else:
-            items = [0]  # create a list to manipulate
-        if pos < len(items):
-            items[pos] = result
-        else:
-            raise self.error("Subscript out of range")
-        self.symboltable.update({name: items})
+        self.variables.store(self.variables.slot(name), result, indexes)
 
     def compileDim(self):
-        # 'dim' Identifier '[' expression ']'
+        # 'dim' Identifier '[' expression ']' ('[' expression ']')*
         name = self.current_token.value
         self.consume(Tokentype.IDENTIFIER)
-        self.consume(Tokentype.LBRACK)
-        result = self.compileExpression()
-        self.consume(Tokentype.RBRACK)
-        var = [0 for i in range(result)]
-        self.symboltable.update({name: var})
+        if self.current_token.type != Tokentype.LBRACK:
+            self.error()
+        self.variables.set(name, Array(self.compileSubscripts()))
+
+    def compileSubscripts(self):
+        # ('['expression']')*
+        indexes = []
+        while self.current_token.type == Tokentype.LBRACK:
+            self.consume(Tokentype.LBRACK)
+            indexes.append(self.compileExpression())
+            self.consume(Tokentype.RBRACK)
+        return indexes
+
+    def compileMat(self):
+        # 'mat' Identifier '=' (ZER|CON) ('['expression']')* | operand ((+|-|*) operand)?
+        name = self.current_token.value
+        self.consume(Tokentype.IDENTIFIER)
+        self.consume(Tokentype.EQUALS)
+        function = None
+        operands = []
+        dims = []
+        if self.current_token.type in (Tokentype.ZER, Tokentype.CON):
+            function = self.current_token.value
+            self.consume(self.current_token.type)
+            dims = self.compileSubscripts()
+        else:
+            operands.append(self.compileOperand())
+            if self.current_token.type in (Tokentype.PLUS, Tokentype.MINUS, Tokentype.MUL):
+                function = self.current_token.value
+                self.consume(self.current_token.type)
+                operands.append(self.compileOperand())
+        slot = self.variables.slot(name)
+        self.variables.values[slot] = mat(function, self.variables.values[slot], operands, dims)
+
+    def compileOperand(self):
+        # a bare variable name stands for the whole array, anything else is a factor
+        token = self.current_token
+        if token.type == Tokentype.IDENTIFIER and self.token_stream[self.position].type != Tokentype.LBRACK:
+            self.consume(Tokentype.IDENTIFIER)
+            return self.variables.get(token.value)
+        return self.compileFactor()
 
     def compilePrint(self):
-        # 'print'  expression (';' expression )*
+        # 'print' ('#' expression ',') expression (';' expression )*
+        channel = None
+        if self.current_token.type == Tokentype.HASH:
+            channel = self.compileChannel()
+            self.consume(Tokentype.COMMA)
         result = self.compileExpression()
         string = str(result)
         while self.current_token.value == ";":
             self.consume(Tokentype.SEMI)
             result = self.compileExpression()
             string += str(result)
-        print(string if string else "")
+        if channel is not None:
+            self.files.write(channel, string)
+        else:
+            print(string if string else "", file=self.output)
+
+    def compileOpen(self):
+        # 'open' expression 'for' ('input'|'output'|'append') 'as' ('#') expression
+        path = self.compileExpression()
+        self.consume(Tokentype.FOR)
+        mode = self.current_token.value
+        if self.current_token.type not in (Tokentype.INPUT, Tokentype.OUTPUT, Tokentype.APPEND):
+            self.error()
+        self.advance()
+        self.consume(Tokentype.AS)
+        self.files.open(path, mode, self.compileChannel())
+
+    def compileChannel(self):
+        # ('#') expression, the number of a file
+        if self.current_token.type == Tokentype.HASH:
+            self.consume(Tokentype.HASH)
+        return self.compileExpression()
+
+    def compileRead(self):
+        # 'read' identifier ('['expression']')* (',' identifier ('['expression']')*)*
+        while True:
+            name = self.current_token.value
+            self.consume(Tokentype.IDENTIFIER)
+            indexes = self.compileSubscripts()
+            self.variables.store(self.variables.slot(name), self.files.read(), indexes)
+            if self.current_token.type != Tokentype.COMMA:
+                return
+            self.consume(Tokentype.COMMA)
 
     def compileIf(self):
         # 'IF' expr 'THEN' statement* ( 'ELSE' statement*) 'ENDIF'
@@ -212,8 +779,8 @@ class Interpreter:
                 self.consume(Tokentype.ELSE)
                 self.compileStatement()
 
-    def compileFor(self):
-        # FOR identifier "=" expr "TO" expr (STEP expr)?
+    def compileFor(self, parallel=False):
+        # (PARALLEL) FOR identifier "=" expr "TO" expr (STEP expr)?
         name = self.current_token.value
         self.consume(Tokentype.IDENTIFIER)
         self.consume(Tokentype.EQUALS)
@@ -225,7 +792,9 @@ class Interpreter:
             self.consume(Tokentype.STEP)
             step = self.compileExpression()
         if name not in self.looptable:
-            self.symboltable.update({name: [e1]})
+            if parallel and self.parallel.run(self.current_line(), name, e1, e2, step):
+                return
+            self.variables.set(name, e1)
             self.looptable.update({name: Loop(e1, e2, self.linepos, step)})
 
     def compileNext(self):
@@ -234,9 +803,10 @@ class Interpreter:
         self.consume(Tokentype.IDENTIFIER)
         if name in self.looptable:
             loop = self.looptable.get(name)
-            val = self.symboltable.get(name)
-            if val[0] < loop.end:
-                self.symboltable.update({name: [val[0] + loop.step]})
+            values = self.variables.values
+            slot = self.variables.slot(name)
+            if values[slot] < loop.end:
+                values[slot] += loop.step
                 self.linepos = loop.line - 1  # deduct one to account for increment after execution
             else:
                 self.looptable.pop(name)
@@ -245,31 +815,63 @@ class Interpreter:
 
     def compileList(self):
         for lineno, code in sorted(self.program.items()):
-            print("{} {}".format(lineno, code))
+            print("{} {}".format(lineno, code), file=self.output)
 
     def compileInput(self):
-        # 'input' (prompt string) identifier
+        # 'input' (prompt string) identifier | 'input' '#' expression ',' identifier
+        if self.current_token.type == Tokentype.HASH:
+            channel = self.compileChannel()
+            self.consume(Tokentype.COMMA)
+            name = self.current_token.value
+            self.consume(Tokentype.IDENTIFIER)
+            self.variables.set(name, self.files.input(channel))
+            return
         prompt = "?"
         while self.current_token.type == Tokentype.STRING:
             prompt = self.compileFactor()
         name = self.current_token.value
         self.consume(Tokentype.IDENTIFIER)
-        result = input(prompt)
-        # a hack to cast numbers if the 1st char is a digit
-        result = int(result) if result[0].isdigit() else result
-        self.symboltable.update({name: result})
+        self.variables.set(name, self.read_input(prompt))
 
     def compileGoto(self):
         # 'goto' linenumber
         token = self.current_token
         self.consume(Tokentype.INTEGER)
-        if token.value in self.steps:
+        if token.value in self.lineindex:
             # reset linepos
-            self.linepos = self.steps.index(
+            self.linepos = self.lineindex.get(
                 token.value) - 1  # remove 1 to account for increment instruction after the goto is executed
         else:
             self.error("Line number does not exist")
 
+    def compileGosub(self):
+        # 'gosub' linenumber, which ends its line so that RETURN goes on with the next one
+        token = self.current_token
+        self.consume(Tokentype.INTEGER)
+        if self.current_token.type == Tokentype.COLON:
+            self.error("GOSUB must end its line")
+        if token.value not in self.lineindex:
+            self.error("Line number does not exist")
+        self.push_return(self.linepos)
+        self.linepos = self.lineindex.get(token.value) - 1
+
+    def compileReturn(self):
+        if not self.gosubs:
+            self.error("RETURN without GOSUB")
+        self.linepos = self.gosubs.pop()  # the line after the GOSUB runs next
+
+    def parse_fragment(self, parse):
+        # parse the construct at the current token with the Parser, for those that are only evaluated in
+        # part (IF expressions) or kept (DEF FN), and go on after it
+        parser = self.parser
+        parser.token_stream = self.token_stream
+        parser.current_token = self.current_token
+        parser.position = self.position
+        node = parse()
+        self.current_token = parser.current_token
+        self.position = parser.position
+        return node
+
     def compileExpression(self):
         # expression: term ( +|-|=|<|>|>=|<=|<> term)*
         result = self.compileTerm()
@@ -313,7 +915,9 @@ class Interpreter:
         return result
 
     def compileFactor(self):
-        # factor: integer | identifier ('['expr']')? | string | (expr) | RND '(' integer ')'
+        # factor: integer | identifier ('['expr']')* | string | (expr) | RND '(' integer ')'
+        #         | (SUM|MIN|MAX) '(' identifier ')' | FN identifier '(' expr (',' expr)* ')'
+        #         | IF expr THEN expr ELSE expr | EOF '(' expr ')'
         token = self.current_token
         if token.type == Tokentype.INTEGER:
             self.consume(Tokentype.INTEGER)
@@ -325,22 +929,22 @@ class Interpreter:
             self.consume(Tokentype.INTEGER)
             val = token.value
             self.consume(Tokentype.RPAREN)
-            return random.randint(1, val)
+            return self.random.randint(1, val)
+        elif token.type in REDUCTIONS:
+            self.consume(token.type)
+            self.consume(Tokentype.LPAREN)
+            name = self.current_token.value
+            self.consume(Tokentype.IDENTIFIER)
+            self.consume(Tokentype.RPAREN)
+            return reduce(token.value, self.variables.get(name))
         elif token.type == Tokentype.IDENTIFIER:
-            pos = 0
             self.consume(Tokentype.IDENTIFIER)
-            while self.current_token.type == Tokentype.LBRACK:
-                self.consume(Tokentype.LBRACK)
-                pos = self.compileExpression()
-                self.consume(Tokentype.RBRACK)
-            if token.value in self.symboltable:
-                items = self.symboltable.get(token.value)
-                if pos < len(items):
-                    return items[pos]
-                else:
-                    raise self.error("Subscript out of range")
-            else:
-                self.error("Variable not declared")
+            if token.value.upper() == "EOF" and self.current_token.type == Tokentype.LPAREN:
+                self.consume(Tokentype.LPAREN)
+                channel = self.compileExpression()
+                self.consume(Tokentype.RPAREN)
+                return self.files.eof(channel)
+            return self.variables.load(self.variables.slot(token.value), self.compileSubscripts())
         elif token.type == Tokentype.STRING:
             self.consume(Tokentype.STRING)
             return token.value
@@ -349,3 +953,16 @@ class Interpreter:
             result = self.compileExpression()
             self.consume(Tokentype.RPAREN)
             return result
+        elif token.type == Tokentype.FN:
+            self.consume(Tokentype.FN)
+            name = self.current_token.value
+            self.consume(Tokentype.IDENTIFIER)
+            self.consume(Tokentype.LPAREN)
+            args = [self.compileExpression()]
+            while self.current_token.type == Tokentype.COMMA:
+                self.consume(Tokentype.COMMA)
+                args.append(self.compileExpression())
+            self.consume(Tokentype.RPAREN)
+            return self.functions.call(name, args)
+        elif token.type == Tokentype.IF:
+            return self.evaluator.evaluate(self.parse_fragment(self.parser.parseFactor))
@@ -0,0 +1,11 @@
+"""
+Loop.py
+"""
+
+
+class Loop:
+    def __init__(self, start, end, line, step=1):
+        self.start = start
+        self.end = end
+        self.line = line
+        self.step = step
@@ -1,45 +1,250 @@
 """
 Machine.py
 """
-from interpreter import Interpreter
+from interpreter import Interpreter, ENGINES
+from tokenizer import LEXERS
+import functions
+import image
+import pool
+import server
+import argparse
+import asyncio
 import re
+import sys
+
+# when buffered program output is written out: after every line, or only when the buffer is full,
+# before INPUT waits at a terminal and at the end of the run
+FLUSH = ("line", "full")
+
+BANNER = 'PyBasic v0.3 (c) 2020 Gently Solutions Ltd'
+
+# exit status of a batch run
+OK = 0
+RUN_ERROR = 1
+LOAD_ERROR = 2
+
+
+def command(i, source):
+    # handle one line typed at the prompt: edit the program, change a setting or execute it.
+    # False when it ends the session
+    if source.upper() == "EXIT":
+        return False
+    if source.upper() == "DEBUG ON":
+        print("Debug flag turned on.", file=i.output)
+        i.debug = True
+        return True
+    if source.upper() == "DEBUG OFF":
+        print("Debug flag turned off.", file=i.output)
+        i.debug = False
+        return True
+    if source.upper() == "OPTIMIZE ON":
+        print("Optimizer turned on.", file=i.output)
+        i.set_optimize(True)
+        return True
+    if source.upper() == "OPTIMIZE OFF":
+        print("Optimizer turned off.", file=i.output)
+        i.set_optimize(False)
+        return True
+    if source.upper() == "MEMO ON":
+        print("Memoization turned on.", file=i.output)
+        i.functions.set_memo(functions.MEMO)
+        return True
+    if source.upper() == "MEMO OFF":
+        print("Memoization turned off.", file=i.output)
+        i.functions.set_memo(0)
+        return True
+    if source.upper().startswith("ENGINE"):
+        name = source[len("ENGINE"):].strip().lower()
+        if name in ENGINES:
+            print("Engine set to {}.".format(name), file=i.output)
+            i.engine = name
+        else:
+            print("Unknown engine, choose one of {}.".format(", ".join(ENGINES)), file=i.output)
+        return True
+    if source.upper().startswith("LEXER"):
+        name = source[len("LEXER"):].strip().lower()
+        if name in LEXERS:
+            print("Lexer set to {}.".format(name), file=i.output)
+            i.lexer = LEXERS[name]()
+        else:
+            print("Unknown lexer, choose one of {}.".format(", ".join(LEXERS)), file=i.output)
+        return True
+    regex = re.compile('^[0-9]+')
+    result = regex.match(source)
+    if result:
+        lineno = int(result.group())
+        code = source[result.end():]
+        if code == "":
+            i.delete_line(lineno)  # delete code line
+        else:
+            try:
+                i.enter_line(lineno, code)  # insert code line, checked and parsed
+            except SyntaxError as e:
+                print("{} in line {}".format(e, lineno), file=i.output)
+    else:
+        try:
+            i.execute(source)
+        except IndexError as e:
+            pass
+        except SyntaxError as e:
+            print(e, file=i.output)
+    return True
 
 
 def repl():
-    print('PyBasic v0.3 (c) 2020 Gently Solutions Ltd')
+    print(BANNER)
     print('Type "exit" to quit.')
     i = Interpreter()
     while True:
         source = input("> ")
-        if source.upper() == "EXIT":
+        if not command(i, source):
             break
-        if source.upper() == "DEBUG ON":
-            print("Debug flag turned on.")
-            i.debug = True
-            continue
-        if source.upper() == "DEBUG OFF":
-            print("Debug flag turned off.")
-            i.debug = False
-            continue
-        regex = re.compile('^[0-9]+')
-        result = regex.match(source)
-        if result:
-            lineno = int(result.group())
-            code = source[result.end():]
-            if code == "":
-                i.program.pop(lineno, -1)  # delete code line
-            else:
-                # todo - think about how to process code before storing
-                # should it be parsed and tokenized and grammatically checked ?
-                i.program.update({lineno: code})  # insert plain code line
+
+
+def batch(args):
+    # run one program without the prompt, return the exit status
+    parser = argparse.ArgumentParser(prog="machine.py run", description="Run a BASIC program non-interactively.")
+    parser.add_argument("program", nargs="?", help="text program or file saved with SAVE")
+    parser.add_argument("--input", metavar="FILE", help="read INPUT values from FILE, one per line, '-' for stdin")
+    parser.add_argument("--engine", choices=ENGINES, default="classic")
+    parser.add_argument("--lexer", choices=list(LEXERS), default="fast")
+    parser.add_argument("--no-optimize", dest="optimize", action="store_false", help="run the lines as parsed")
+    parser.add_argument("--flush", choices=FLUSH, default="full", help="when to write out buffered output")
+    parser.add_argument("--buffer", metavar="BYTES", type=int, default=1 << 20, help="output buffer size")
+    parser.add_argument("--workers", metavar="N", type=int, help="processes a PARALLEL FOR is split across, "
+                                                                  "one per core by default")
+    parser.add_argument("--checkpoint", metavar="NAME", help="save checkpoints of the run under NAME")
+    parser.add_argument("--every", metavar="LINES", type=int, default=100000,
+                        help="program lines run between the checkpoints of --checkpoint")
+    parser.add_argument("--resume", metavar="NAME", help="go on with the run saved in checkpoint NAME")
+    options = parser.parse_args(args)
+    if (options.program is None) == (options.resume is None):
+        parser.error("give either a program or --resume")
+    if options.every < 1:
+        parser.error("--every must be at least 1")
+    i = Interpreter(options.engine, options.lexer)
+    i.set_optimize(options.optimize)
+    if options.workers is not None:
+        i.parallel.workers = options.workers
+    if options.checkpoint is not None:
+        i.checkpoints.name = options.checkpoint
+        i.checkpoints.every = options.every
+    if options.program is not None:
+        try:
+            i.load_file(options.program)
+        except (OSError, SyntaxError) as e:
+            print("Cannot load {}: {}".format(options.program, e), file=sys.stderr)
+            return LOAD_ERROR
+    output = open(sys.stdout.fileno(), "w", buffering=1 if options.flush == "line" else max(options.buffer, 2),
+                  encoding=sys.stdout.encoding, errors="replace", closefd=False)
+    i.output = output
+    if options.input == "-":
+        i.input_stream = sys.stdin
+    elif options.input is not None:
+        try:
+            i.input_stream = open(options.input, buffering=1 << 16)
+        except OSError as e:
+            print("Cannot read {}: {}".format(options.input, e), file=sys.stderr)
+            return LOAD_ERROR
+    status = OK
+    try:
+        if options.resume is not None:
+            i.resume(options.resume)
         else:
-            try:
-                i.execute(source)
-            except IndexError as e:
-                pass
-            except SyntaxError as e:
-                print(e)
+            i.run()
+    except Exception as e:
+        output.flush()
+        lineno = i.steps[i.linepos] if i.linepos < len(i.steps) else None
+        print("{}{}".format(e, "" if lineno is None else " in line {}".format(lineno)), file=sys.stderr)
+        status = RUN_ERROR
+    finally:
+        i.files.close()
+        output.close()
+        if i.input_stream not in (None, sys.stdin):
+            i.input_stream.close()
+    return status
 
 
-if __name__ == '__main__':
+def run_pool(args):
+    # run many seeded instances of one program on a process pool, return the exit status
+    parser = argparse.ArgumentParser(prog="machine.py pool",
+                                     description="Run many instances of a BASIC program on a process pool.")
+    parser.add_argument("program", help="text program or file saved with SAVE")
+    parser.add_argument("--instances", "-n", metavar="N", type=int, default=1, help="number of instances to run")
+    parser.add_argument("--processes", "-j", metavar="N", type=int, help="worker processes, one per core by default")
+    parser.add_argument("--seed", type=int, default=0, help="RND seed of the first instance, the next get seed+1 ...")
+    parser.add_argument("--input", metavar="FILE", help="INPUT values of every instance, one per line")
+    parser.add_argument("--collect", metavar="NAME", action="append", default=[],
+                        help="variable whose final values are summarized, may be repeated")
+    parser.add_argument("--engine", choices=ENGINES, default="vm")
+    parser.add_argument("--lexer", choices=list(LEXERS), default="fast")
+    parser.add_argument("--no-optimize", dest="optimize", action="store_false", help="run the lines as parsed")
+    parser.add_argument("--quiet", "-q", action="store_true", help="print only the summary, not each output")
+    options = parser.parse_args(args)
+    try:
+        program, tokens = image.load(options.program)
+        inputs = []
+        if options.input is not None:
+            with open(options.input) as readfile:
+                inputs = readfile.read().splitlines()
+    except (OSError, SyntaxError) as e:
+        print("Cannot load: {}".format(e), file=sys.stderr)
+        return LOAD_ERROR
+    names = options.collect
+    status = OK
+    values = []
+    failed = 0
+    for result in pool.run(program, options.instances, options.seed, inputs, names, options.engine,
+                           options.lexer, options.optimize, options.processes):
+        if not options.quiet:
+            print("=== instance {} seed {}".format(result.index, result.seed))
+            print(result.output, end="")
+        if result.error is not None:
+            print("instance {}: {}".format(result.index, result.error), file=sys.stderr)
+            failed += 1
+            status = RUN_ERROR
+        values.append(pool.Result(result.index, result.seed, None, result.error, result.values))
+    print("{} instances, {} failed".format(options.instances, failed))
+    for name, (count, mean, deviation, least, most) in pool.summarize(values, names).items():
+        if count:
+            print("{}: n={} mean={:g} sd={:g} min={:g} max={:g}".format(name, count, mean, deviation, least, most))
+        else:
+            print("{}: no numeric values".format(name))
+    return status
+
+
+def serve(args):
+    # serve prompt sessions over TCP until interrupted, return the exit status
+    parser = argparse.ArgumentParser(prog="machine.py serve", description="Serve BASIC sessions over TCP.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=6502, help="port to listen on, 0 picks a free one")
+    parser.add_argument("--engine", choices=ENGINES, default="classic")
+    parser.add_argument("--lexer", choices=list(LEXERS), default="fast")
+    parser.add_argument("--no-optimize", dest="optimize", action="store_false", help="run the lines as parsed")
+    parser.add_argument("--directory", help="where the directories of the sessions are made, the temp directory "
+                                            "by default")
+    options = parser.parse_args(args)
+    sessions = server.Server(command, BANNER, options.engine, options.lexer, options.optimize, options.directory)
+    try:
+        asyncio.run(sessions.serve(options.host, options.port))
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print("Cannot serve: {}".format(e), file=sys.stderr)
+        return LOAD_ERROR
+    return OK
+
+
+def main(args):
+    if args and args[0] == "run":
+        return batch(args[1:])
+    if args and args[0] == "pool":
+        return run_pool(args[1:])
+    if args and args[0] == "serve":
+        return serve(args[1:])
     repl()
+    return OK
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,102 @@
+"""
+Matrix.py
+
+Whole array operations behind the MAT statement and the SUM, MIN and MAX functions. Every engine
+calls these, so an array is processed in bulk rather than one interpreted statement per element.
+"""
+from variables import Array, UNSET
+from array import array
+from itertools import repeat
+import operator
+
+OPERATORS = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+}
+
+REDUCTIONS = {
+    "SUM": sum,
+    "MIN": min,
+    "MAX": max,
+}
+
+
+def error(msg="Syntax Error"):
+    raise SyntaxError(msg)
+
+
+def build(dims, compute):
+    # an array of the values compute() yields, kept compact unless they are not all 64 bit integers
+    try:
+        return Array(dims, array("q", compute()))
+    except (TypeError, OverflowError):
+        pass
+    try:
+        return Array(dims, list(compute()))
+    except TypeError:
+        error("Type mismatch")
+
+
+def mat(function, target, operands, dims):
+    # the new value of the target of MAT target = ZER | CON | operand | operand (+|-|*) operand,
+    # where an operand is either an array or a scalar
+    if function in ("ZER", "CON"):
+        if not dims:
+            if type(target) is not Array:
+                error("Array not dimensioned")
+            dims = target.dims
+        result = Array(list(dims))
+        if function == "CON":
+            result.items = array("q", [1]) * len(result)
+        return result
+    for operand in operands:
+        if operand is UNSET:
+            error("Variable not declared")
+    if function is None:
+        source = operands[0]
+        if type(source) is not Array:
+            error("Type mismatch")
+        return Array(list(source.dims), source.items[:])
+    left, right = operands
+    function = OPERATORS[function]
+    if type(left) is Array and type(right) is Array:
+        if function is operator.mul:
+            return product(left, right)
+        if left.dims != right.dims:
+            error("Array dimensions do not match")
+        return build(list(left.dims), lambda: map(function, left.items, right.items))
+    elif type(left) is Array:
+        return build(list(left.dims), lambda: map(function, left.items, repeat(right)))
+    elif type(right) is Array:
+        return build(list(right.dims), lambda: map(function, repeat(left), right.items))
+    error("Type mismatch")
+
+
+def product(left, right):
+    # matrix product, a one dimensional left operand is a row vector and a right one a column vector
+    if len(left.dims) > 2 or len(right.dims) > 2:
+        error("Array dimensions do not match")
+    rows, inner = left.dims if len(left.dims) == 2 else [1] + left.dims
+    depth, cols = right.dims if len(right.dims) == 2 else right.dims + [1]
+    if inner != depth:
+        error("Array dimensions do not match")
+    items = left.items
+    columns = [right.items[col::cols] for col in range(cols)]
+    dims = ([rows] if len(left.dims) == 2 else []) + ([cols] if len(right.dims) == 2 else [])
+    return build(dims or [1], lambda: (sum(map(operator.mul, items[row * inner:(row + 1) * inner], column))
+                                       for row in range(rows) for column in columns))
+
+
+def reduce(function, value):
+    # SUM, MIN or MAX over every element of an array
+    if value is UNSET:
+        error("Variable not declared")
+    if type(value) is not Array:
+        error("Type mismatch")
+    if not len(value):
+        error("Subscript out of range")
+    try:
+        return REDUCTIONS[function](value.items)
+    except TypeError:
+        error("Type mismatch")
@@ -0,0 +1,343 @@
+"""
+Optimizer.py
+
+Simplifies the syntax trees of a line once, right after it is parsed, so that the engines walking,
+compiling or translating them do less work on every pass. Constant subexpressions are folded,
+identities such as x*1 and x+0 are dropped and neighbouring literals of a PRINT list are joined.
+An optimized line prints and computes exactly what the parsed one does: an expression that would
+fail is left alone to fail when it is run.
+
+Before a run, expressions in FOR/NEXT loops that depend only on variables the loop never assigns
+are hoisted: each becomes an Invariant, computed on its first use after the loop starts and kept
+in a hidden variable for the rest of that run of the loop.
+"""
+from parser import Literal, Variable, Rnd, Reduce, Invariant, BinaryOp, Compare, Call, Eof, Conditional, Let, Print, If, \
+    For, Next, Goto, Gosub, Return, Def, Input, Read, Dim, Mat, Command
+from evaluator import BINARY, COMPARE
+
+# longest string a constant expression is folded into, longer ones are built when they are needed
+STRING_LIMIT = 4096
+
+# hidden variables of hoisted expressions are named after their number, no BASIC name starts with %
+HIDDEN = "%{}"
+
+PRECEDENCE = {"+": 1, "-": 1, "*": 2, "/": 2}
+
+
+def is_constant(node, value):
+    # a number literal of the given value, True == 1 but must not count as 1
+    return type(node) is Literal and type(node.value) is int and node.value == value
+
+
+def is_number(node):
+    # whether an expression always gives an int or a float, variables may hold strings or booleans
+    kind = type(node)
+    if kind is Literal:
+        return type(node.value) is int or type(node.value) is float
+    elif kind is BinaryOp:
+        if node.op in ("-", "/"):
+            return True
+        return is_number(node.left) and is_number(node.right)
+    return False
+
+
+def is_integer(node):
+    # whether an expression always gives an int, x+0 is not x for a float x of -0.0
+    kind = type(node)
+    if kind is Literal:
+        return type(node.value) is int
+    elif kind is Rnd:
+        return True
+    elif kind is BinaryOp and node.op in ("+", "-", "*"):
+        return is_integer(node.left) and is_integer(node.right)
+    return False
+
+
+def text(node):
+    # BASIC source of an expression, for reports
+    kind = type(node)
+    if kind is Literal:
+        return '"{}"'.format(node.value) if type(node.value) is str else str(node.value)
+    elif kind is Variable:
+        return node.name + "".join("[{}]".format(text(index)) for index in node.indexes)
+    elif kind is Rnd:
+        return "RND({})".format(node.limit)
+    elif kind is Reduce:
+        return "{}({})".format(node.function, node.variable.name)
+    elif kind is Invariant:
+        return text(node.expr)
+    elif kind is Call:
+        return "FN {}({})".format(node.name, ", ".join(text(arg) for arg in node.args))
+    elif kind is Eof:
+        return "EOF({})".format(text(node.channel))
+    elif kind is Conditional:
+        return "IF {} THEN {} ELSE {}".format(text(node.condition), text(node.then_expr), text(node.else_expr))
+    precedence = PRECEDENCE.get(node.op, 0)
+    left = text(node.left)
+    right = text(node.right)
+    if type(node.left) in (Compare, Conditional) or PRECEDENCE.get(getattr(node.left, "op", None), 3) < precedence:
+        left = "({})".format(left)
+    if type(node.right) in (Compare, Conditional) or PRECEDENCE.get(getattr(node.right, "op", None), 3) <= precedence:
+        right = "({})".format(right)
+    return "{} {} {}".format(left, node.op, right)
+
+
+def walk(nodes):
+    # every statement of a list of statements, those of IF branches included
+    for node in nodes:
+        yield node
+        if type(node) is If:
+            yield from walk(node.then_branch)
+            if node.else_branch is not None:
+                yield from walk(node.else_branch)
+
+
+class Optimizer:
+
+    def __init__(self):
+        self.statements = {
+            Let: self.optimizeLet,
+            Print: self.optimizePrint,
+            If: self.optimizeIf,
+            For: self.optimizeFor,
+            Dim: self.optimizeDim,
+            Mat: self.optimizeMat,
+            Def: self.optimizeDef,
+        }
+        self.folded = 0  # nodes removed so far
+
+    def optimize(self, statements):
+        # the statements of a line, simplified in place
+        for statement in statements:
+            function = self.statements.get(type(statement))
+            if function is not None:
+                function(statement)
+        return statements
+
+    # ######################### statements ##################################
+    def optimizeLet(self, node):
+        node.target.indexes = self.expressions(node.target.indexes)
+        node.expr = self.expression(node.expr)
+
+    def optimizePrint(self, node):
+        # neighbouring literals print as the one string made of them
+        items = []
+        for item in self.expressions(node.items):
+            if type(item) is Literal and items and type(items[-1]) is Literal and \
+                    len(str(items[-1].value)) + len(str(item.value)) <= STRING_LIMIT:
+                items[-1] = Literal(str(items[-1].value) + str(item.value))
+                self.folded += 1
+            else:
+                items.append(item)
+        node.items = items
+        if node.channel is not None:
+            node.channel = self.expression(node.channel)
+
+    def optimizeIf(self, node):
+        node.condition = self.expression(node.condition)
+        self.optimize(node.then_branch)
+        if node.else_branch is not None:
+            self.optimize(node.else_branch)
+
+    def optimizeFor(self, node):
+        node.start = self.expression(node.start)
+        node.end = self.expression(node.end)
+        if node.step is not None:
+            node.step = self.expression(node.step)
+
+    def optimizeDim(self, node):
+        node.dims = self.expressions(node.dims)
+
+    def optimizeMat(self, node):
+        node.operands = self.expressions(node.operands)
+        node.dims = self.expressions(node.dims)
+
+    def optimizeDef(self, node):
+        node.expr = self.expression(node.expr)
+
+    # ######################### expressions ##################################
+    def expressions(self, nodes):
+        return [self.expression(node) for node in nodes]
+
+    def expression(self, node):
+        kind = type(node)
+        if kind is Variable:
+            node.indexes = self.expressions(node.indexes)
+        elif kind is BinaryOp or kind is Compare:
+            node.left = self.expression(node.left)
+            node.right = self.expression(node.right)
+            if type(node.left) is Literal and type(node.right) is Literal:
+                return self.fold(node)
+            if kind is BinaryOp:
+                return self.simplify(node)
+        elif kind is Call:
+            node.args = self.expressions(node.args)
+        elif kind is Conditional:
+            node.condition = self.expression(node.condition)
+            node.then_expr = self.expression(node.then_expr)
+            node.else_expr = self.expression(node.else_expr)
+            if type(node.condition) is Literal:
+                # only a condition that is True picks the first expression
+                self.folded += 2
+                return node.then_expr if node.condition.value is True else node.else_expr
+        return node
+
+    def fold(self, node):
+        # the literal value of an operation on two literals, as the evaluator would compute it
+        try:
+            if type(node) is Compare:
+                value = True if COMPARE[node.op](node.left.value, node.right.value) else False
+            else:
+                value = BINARY[node.op](node.left.value, node.right.value)
+        except (TypeError, ArithmeticError):
+            return node
+        if type(value) is str and len(value) > STRING_LIMIT:
+            return node
+        self.folded += 2
+        return Literal(value)
+
+    def simplify(self, node):
+        # x*1, 1*x and x-0 are x when x is a number, x+0 and 0+x only when it is an integer, since -0.0 + 0
+        # is 0.0. A string plus 0 has to stay an error and a boolean times 1 has to print as 1
+        left, right = node.left, node.right
+        if node.op == "*":
+            if is_constant(right, 1) and is_number(left):
+                self.folded += 2
+                return left
+            if is_constant(left, 1) and is_number(right):
+                self.folded += 2
+                return right
+        elif node.op == "-":
+            if is_constant(right, 0) and is_number(left):
+                self.folded += 2
+                return left
+        elif node.op == "+":
+            if is_constant(right, 0) and is_integer(left):
+                self.folded += 2
+                return left
+            if is_constant(left, 0) and is_integer(right):
+                self.folded += 2
+                return right
+        return node
+
+    # ######################### loop invariants ##################################
+    def hoist(self, lines):
+        # hoist the invariants of every loop of a program given as (line number, statements or None when
+        # the line does not parse) in line order, outer loops first. Returns (FOR line number, line number,
+        # invariant) of each one
+        hoisted = []
+        for start, end in self.loops(lines):
+            statements = lines[start][1]
+            node = statements[0]
+            body = statements[1:-1] if start == end else statements[1:]
+            bodies = [(lines[start][0], body)]
+            bodies.extend(lines[pos] for pos in range(start + 1, end))
+            if start != end:
+                bodies.append((lines[end][0], lines[end][1][:-1]))
+            written = {node.name}
+            for lineno, body in bodies:
+                for statement in walk(body):
+                    kind = type(statement)
+                    if kind is Let:
+                        written.add(statement.target.name)
+                    elif kind is Read:
+                        written.update(target.name for target in statement.targets)
+                    elif kind in (For, Next, Input, Dim, Mat):
+                        written.add(statement.name)
+            for lineno, body in bodies:
+                invariants = []
+                for statement in walk(body):
+                    self.liftStatement(statement, written, invariants, len(hoisted))
+                node.hoisted.extend(invariants)
+                hoisted.extend((lines[start][0], lineno, invariant) for invariant in invariants)
+        return hoisted
+
+    def loops(self, lines):
+        # (start, end) positions of the FOR/NEXT loops the program can only run from their FOR: the FOR leads
+        # its line, the first NEXT of its variable ends a line, every line between parses and nothing jumps
+        # into the loop from outside or out of it from inside
+        positions = {lineno: pos for pos, (lineno, statements) in enumerate(lines)}
+        jumps = []  # (position, target position) of every GOTO and GOSUB, None for where a RETURN goes
+        for pos, (lineno, statements) in enumerate(lines):
+            for statement in walk(statements or []):
+                if type(statement) is Goto or type(statement) is Gosub:
+                    jumps.append((pos, positions.get(statement.lineno)))
+                elif type(statement) is Return:
+                    jumps.append((pos, None))
+        loops = []
+        for start, (lineno, statements) in enumerate(lines):
+            if not statements or type(statements[0]) is not For:
+                continue
+            end = self.matchNext(lines, start, statements[0].name)
+            if end is None:
+                continue
+            if any(source is not None and not start <= source <= end and target is not None and start < target <= end
+                   for source, target in jumps):
+                continue
+            if any(start <= source <= end and (target is None or not start <= target <= end)
+                   for source, target in jumps):
+                continue
+            loops.append((start, end))
+        return loops
+
+    def matchNext(self, lines, start, name):
+        # position of the line the first NEXT of a FOR variable ends, None when it does not end one
+        for pos in range(start, len(lines)):
+            statements = lines[pos][1]
+            if statements is None:
+                return None
+            for statement in walk(statements[1:] if pos == start else statements):
+                if type(statement) is Command:
+                    return None
+                if type(statement) is Next and statement.name == name:
+                    return pos if statement is statements[-1] else None
+        return None
+
+    def liftStatement(self, node, written, invariants, count):
+        kind = type(node)
+        lift = self.lift
+        if kind is Let:
+            node.target.indexes = [lift(index, written, invariants, count) for index in node.target.indexes]
+            node.expr = lift(node.expr, written, invariants, count)
+        elif kind is Print:
+            node.items = [lift(item, written, invariants, count) for item in node.items]
+        elif kind is If:
+            node.condition = lift(node.condition, written, invariants, count)
+        elif kind is For:
+            node.start = lift(node.start, written, invariants, count)
+            node.end = lift(node.end, written, invariants, count)
+            if node.step is not None:
+                node.step = lift(node.step, written, invariants, count)
+        elif kind is Dim or kind is Mat:
+            node.dims = [lift(dim, written, invariants, count) for dim in node.dims]
+            if kind is Mat:
+                node.operands = [lift(operand, written, invariants, count) for operand in node.operands]
+
+    def lift(self, node, written, invariants, count):
+        # the expression with its largest invariant subexpressions replaced by Invariant nodes, plain
+        # literals and variables are left as they are
+        kind = type(node)
+        if kind in (BinaryOp, Compare, Reduce) or (kind is Variable and node.indexes):
+            if self.invariant(node, written):
+                invariant = Invariant(HIDDEN.format(count + len(invariants) + 1), node)
+                invariants.append(invariant)
+                return invariant
+        if kind is Variable:
+            node.indexes = [self.lift(index, written, invariants, count) for index in node.indexes]
+        elif kind is BinaryOp or kind is Compare:
+            node.left = self.lift(node.left, written, invariants, count)
+            node.right = self.lift(node.right, written, invariants, count)
+        return node
+
+    def invariant(self, node, written):
+        # whether an expression gives the same value all through the loop, RND never does
+        kind = type(node)
+        if kind is Literal or kind is Invariant:
+            return True
+        elif kind is Variable:
+            return node.name not in written and all(self.invariant(index, written) for index in node.indexes)
+        elif kind is Reduce:
+            return node.variable.name not in written
+        elif kind is BinaryOp or kind is Compare:
+            return self.invariant(node.left, written) and self.invariant(node.right, written)
+        return False
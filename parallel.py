@@ -0,0 +1,329 @@
+"""
+Parallel.py
+
+Runs the iterations of a PARALLEL FOR loop on worker processes. The iteration range is split into
+one contiguous chunk per worker, and every worker runs the lines of the loop over its chunk on the
+engine of the interpreter. Scalars are copied to the workers, integer DIM arrays are handed over
+in shared memory so the workers read and write them in place.
+
+A loop is only split when a check of its body shows that its iterations are independent: every
+array it assigns is only ever subscripted with the loop variable first, it assigns no scalars but
+the variables of FOR loops nested in it, and it has no PRINT, INPUT, RND, DIM, MAT, GOSUB, FN calls,
+CHECKPOINT, file statements, EOF, READ, RESTORE, commands or GOTO out of the loop. Any other loop
+runs serially with a warning. The workers write to copies of the arrays, which replace the
+originals only when every worker has succeeded; when one fails the loop runs serially from the
+start, so errors are reported just as without PARALLEL.
+"""
+from parser import Variable, Rnd, Reduce, Invariant, BinaryOp, Compare, Call, Eof, Conditional, Let, Print, If, For, \
+    Next, Goto, Gosub, Return, Def, Checkpoint, Input, Open, Close, Read, Restore, Dim, Mat, Command
+from optimizer import walk
+from variables import Array
+from array import array
+from multiprocessing import shared_memory
+import io
+import math
+import multiprocessing
+import os
+import sys
+
+# statements that make a loop run serially
+SERIAL = {
+    Print: "PRINT",
+    Input: "INPUT",
+    Open: "OPEN",
+    Close: "CLOSE",
+    Read: "READ",
+    Restore: "RESTORE",
+    Dim: "DIM",
+    Mat: "MAT",
+    Gosub: "GOSUB",
+    Return: "RETURN",
+    Def: "DEF FN",
+    Checkpoint: "CHECKPOINT",
+}
+
+
+class Serial(Exception):
+    # why a PARALLEL FOR has to run serially
+    pass
+
+
+def operands(statement):
+    # the expressions a statement evaluates, the target of a LET included
+    kind = type(statement)
+    if kind is Let:
+        return [statement.target, statement.expr]
+    elif kind is Print:
+        return statement.items
+    elif kind is If:
+        return [statement.condition]
+    elif kind is For:
+        return [statement.start, statement.end] + ([] if statement.step is None else [statement.step])
+    return []
+
+
+def expressions(nodes):
+    # every node of a list of expressions, subexpressions included
+    for node in nodes:
+        yield node
+        kind = type(node)
+        if kind is Variable:
+            yield from expressions(node.indexes)
+        elif kind is BinaryOp or kind is Compare:
+            yield from expressions([node.left, node.right])
+        elif kind is Reduce:
+            yield from expressions([node.variable])
+        elif kind is Invariant:
+            yield from expressions([node.expr])
+        elif kind is Call:
+            yield from expressions(node.args)
+        elif kind is Conditional:
+            yield from expressions([node.condition, node.then_expr, node.else_expr])
+
+
+def number(value):
+    # source text of an integer, the language has no negative literals
+    return str(value) if value >= 0 else "(0 - {})".format(-value)
+
+
+def attach(name):
+    # a shared block of the parent, which alone removes it
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        # before python 3.13 attaching registers the block again, with the resource tracker the pool
+        # processes share with the parent, which already holds it
+        return shared_memory.SharedMemory(name)
+
+
+def run_chunk(task):
+    # worker: run the loop over one chunk, return ("ok", values of the private variables) or ("error", message)
+    program, engine, lexer, optimize, scalars, arrays, privates = task
+    from interpreter import Interpreter
+    blocks = []
+    views = []
+    interpreter = None
+    try:
+        interpreter = Interpreter(engine)
+        interpreter.lexer = lexer()
+        interpreter.set_optimize(optimize)
+        interpreter.output = io.StringIO()
+        interpreter.parallel.workers = 1
+        interpreter.replace_program(program)
+        variables = interpreter.variables
+        for name, value in scalars.items():
+            variables.set(name, value)
+        for name, dims, size, block, items in arrays:
+            if block is None:
+                variables.set(name, Array(dims, items))
+                continue
+            blocks.append(attach(block))
+            views.append(blocks[-1].buf[:size * 8])
+            views.append(views[-1].cast("q"))
+            variables.set(name, Array(dims, views[-1]))
+        interpreter.run()
+        for name, dims, size, block, items in arrays:
+            if block is not None and type(variables.get(name).items) is not memoryview:
+                return "error", "{} was given a value other than a 64 bit integer".format(name)
+        return "ok", {name: variables.get(name) for name in privates}
+    except Exception as e:
+        return "error", str(e)
+    finally:
+        interpreter = None
+        for view in reversed(views):
+            view.release()
+        for block in blocks:
+            block.close()
+
+
+class Parallel:
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.workers = os.cpu_count() or 1  # processes a loop is split across, 1 runs every loop serially
+        self.warned = set()  # lines of the loops reported to run serially during this run
+
+    def warn(self, lineno, reason):
+        if lineno not in self.warned:
+            self.warned.add(lineno)
+            print("PARALLEL FOR in line {} runs serially: {}".format(lineno, reason), file=sys.stderr)
+
+    def run(self, lineno, name, start, end, step):
+        # run the loop of the PARALLEL FOR in a program line on the workers and leave linepos on its NEXT
+        # line, False when it has to run serially instead
+        interpreter = self.interpreter
+        if lineno is None or self.workers < 2 or interpreter.hooks:
+            return False
+        try:
+            last, arrays, written, privates = self.check(lineno, name)
+            if type(start) is not int or type(step) is not int:
+                raise Serial("start and step must be integers")
+            if type(end) not in (int, float):
+                raise Serial("the end must be a number")
+            if step <= 0 and start < end:
+                raise Serial("STEP must be positive")
+        except Serial as e:
+            self.warn(lineno, str(e))
+            return False
+        # the loop variable takes start + k * step for k = 0 .. count - 1, up to the first value >= end
+        count = 1 if start >= end else math.ceil((end - start) / step) + 1
+        while count > 1 and start + (count - 2) * step >= end:
+            count -= 1
+        while start + (count - 1) * step < end:
+            count += 1
+        if count < 2:
+            return False
+        workers = min(self.workers, count)
+        variables = interpreter.variables
+        steps = interpreter.steps
+        first = interpreter.lineindex.get(lineno)
+        program = {steps[pos]: interpreter.program.get(steps[pos]) for pos in range(first, last + 1)}
+        scalars = {key: value for key, value in variables.table().items()
+                   if type(value) is not Array and key != name}
+        blocks = {}
+        try:
+            specs = []
+            for key in sorted(arrays):
+                value = variables.get(key)
+                items = value.items
+                if type(items) is not array:
+                    specs.append((key, value.dims, len(items), None, items))
+                    continue
+                block = blocks[key] = shared_memory.SharedMemory(create=True, size=max(len(items) * 8, 8))
+                with memoryview(items) as source, block.buf[:len(items) * 8] as target:
+                    target[:] = source.cast("B")
+                specs.append((key, value.dims, len(items), block.name, None))
+            tasks = []
+            for pos in range(workers):
+                low = count * pos // workers
+                high = count * (pos + 1) // workers
+                chunk = dict(program)
+                chunk.update({lineno: " FOR {} = {} TO {} STEP {}".format(name, number(start + low * step),
+                                                                         number(start + (high - 1) * step),
+                                                                         number(step))})
+                tasks.append((chunk, interpreter.engine, type(interpreter.lexer), interpreter.optimize, scalars,
+                              specs, sorted(privates)))
+            with multiprocessing.Pool(workers) as pool:
+                results = pool.map(run_chunk, tasks)
+            for status, result in results:
+                if status != "ok":
+                    print("PARALLEL FOR in line {} is run again serially: {}".format(lineno, result)) \
+                        if interpreter.debug else False
+                    return False
+            for key in written:
+                items = array("q")
+                with blocks[key].buf[:len(variables.get(key).items) * 8] as source:
+                    items.frombytes(source)
+                variables.get(key).items = items
+        finally:
+            for block in blocks.values():
+                block.close()
+                block.unlink()
+        for key, value in results[-1][1].items():
+            variables.set(key, value)
+        variables.set(name, start + (count - 1) * step)
+        interpreter.linepos = last
+        print("PARALLEL FOR in line {} ran {} iterations on {} workers".format(lineno, count, workers)) \
+            if interpreter.debug else False
+        return True
+
+    def check(self, lineno, name):
+        # (position of the NEXT line, arrays used, arrays assigned, variables of nested loops) of the loop of a
+        # PARALLEL FOR whose iterations are independent, raises Serial otherwise
+        interpreter = self.interpreter
+        variables = interpreter.variables
+        steps = interpreter.steps
+        lineindex = interpreter.lineindex
+        first = lineindex.get(lineno)
+        if len(interpreter.parsed(lineno)) != 1:
+            raise Serial("PARALLEL FOR must be alone on its line")
+        lines = []  # (position, statements of the loop on that line)
+        last = None
+        for pos in range(first + 1, len(steps)):
+            try:
+                statements = interpreter.parsed(steps[pos])
+            except Exception:
+                raise Serial("line {} does not parse".format(steps[pos]))
+            closing = [node for node in walk(statements) if type(node) is Next and node.name == name]
+            if closing:
+                if closing[0] is not statements[-1]:
+                    raise Serial("NEXT {} must end its line".format(name))
+                lines.append((pos, statements[:-1]))
+                last = pos
+                break
+            lines.append((pos, statements))
+        if last is None:
+            raise Serial("no NEXT {}".format(name))
+
+        def is_array(key):
+            return type(variables.values[variables.slot(key)]) is Array
+
+        # nested loops: their variables are private to an iteration when used only inside those loops
+        regions = {}  # loop variable -> [(FOR position, NEXT position)]
+        for index, (pos, statements) in enumerate(lines):
+            for node in walk(statements):
+                if type(node) is not For:
+                    continue
+                if node.name == name or is_array(node.name):
+                    raise Serial("FOR {} inside the loop".format(node.name))
+                if node is not statements[0]:
+                    raise Serial("FOR {} must lead its line".format(node.name))
+                end = None
+                for later, body in lines[index:]:
+                    if any(type(inner) is Next and inner.name == node.name for inner in walk(body)):
+                        end = later
+                        break
+                if end is None:
+                    raise Serial("no NEXT {} inside the loop".format(node.name))
+                regions.setdefault(node.name, []).append((pos, end))
+        arrays = set()
+        written = set()
+        reduced = {}  # array -> SUM, MIN or MAX taken of it
+        accesses = []  # subscripted uses of arrays
+        for pos, statements in lines:
+            for node in walk(statements):
+                kind = type(node)
+                if kind in SERIAL:
+                    raise Serial("{} inside the loop".format(SERIAL.get(kind)))
+                elif kind is Command:
+                    raise Serial("{} inside the loop".format(node.name))
+                elif kind is Goto and not first <= lineindex.get(node.lineno, -1) <= last:
+                    raise Serial("GOTO out of the loop")
+                elif kind is Next and node.name not in regions:
+                    raise Serial("NEXT {} without its FOR inside the loop".format(node.name))
+                elif kind is Let:
+                    if not is_array(node.target.name):
+                        raise Serial("{} is assigned inside the loop".format(node.target.name))
+                    written.add(node.target.name)
+                for expression in expressions(operands(node)):
+                    if type(expression) is Rnd:
+                        raise Serial("RND inside the loop")
+                    elif type(expression) is Eof:
+                        raise Serial("EOF inside the loop")
+                    elif type(expression) is Call:
+                        # the workers run the lines of the loop alone, without the functions defined
+                        raise Serial("FN {} inside the loop".format(expression.name))
+                    elif type(expression) is Reduce:
+                        arrays.add(expression.variable.name)
+                        reduced.update({expression.variable.name: expression.function})
+                    elif type(expression) is Variable:
+                        key = expression.name
+                        if key in regions:
+                            if kind is For and node.name == key:
+                                raise Serial("FOR {} uses its own variable".format(key))
+                            if not any(low <= pos <= high for low, high in regions.get(key)):
+                                raise Serial("{} is used outside its FOR loop".format(key))
+                        elif is_array(key):
+                            arrays.add(key)
+                            accesses.append(expression)
+        for key in written:
+            if key in reduced:
+                raise Serial("{} of {} which the loop assigns".format(reduced.get(key), key))
+            if type(variables.get(key).items) is not array:
+                raise Serial("{} holds values other than 64 bit integers".format(key))
+        for node in accesses:
+            if node.name in written:
+                index = node.indexes[0] if node.indexes else None
+                if type(index) is not Variable or index.name != name or index.indexes:
+                    raise Serial("{} is not subscripted with {} first everywhere".format(node.name, name))
+        return last, arrays, written, set(regions)
@@ -0,0 +1,626 @@
+"""
+Parser.py
+
+Builds an abstract syntax tree for a line of tokens so that a program line
+is parsed once and can then be evaluated any number of times.
+"""
+from tokenizer import Tokentype
+
+# additive operators and relations share a precedence level, as in Interpreter.compileExpression
+OPERATORS = {
+    Tokentype.PLUS: "+",
+    Tokentype.MINUS: "-",
+    Tokentype.MUL: "*",
+    Tokentype.DIV: "/",
+}
+
+RELATIONS = {
+    Tokentype.EQUALS: "=",
+    Tokentype.GT: ">",
+    Tokentype.GTE: ">=",
+    Tokentype.LT: "<",
+    Tokentype.LTE: "<=",
+    Tokentype.NE: "<>",
+}
+
+# array functions, they take the name of an array
+REDUCTIONS = (Tokentype.SUM, Tokentype.MIN, Tokentype.MAX)
+
+COMMANDS = ("LIST", "RUN", "NEW", "CLEAR", "LOAD", "SAVE", "RESUME", "DIS", "PROFILE", "?")
+
+
+# ######################### expression nodes ##################################
+class Literal:
+    def __init__(self, value):
+        self.value = value
+
+
+class Variable:
+    def __init__(self, name, indexes=None):
+        self.name = name
+        self.indexes = indexes or []
+        self.slot = None  # resolved by the evaluator on first use
+
+
+class Rnd:
+    def __init__(self, limit):
+        self.limit = limit
+
+
+class Reduce:
+    def __init__(self, function, variable):
+        self.function = function
+        self.variable = variable
+
+
+class Invariant:
+    # an expression a loop never changes, kept in a hidden variable from its first use in each run of the loop
+    def __init__(self, name, expr):
+        self.name = name
+        self.expr = expr
+        self.slot = None
+
+
+class BinaryOp:
+    def __init__(self, op, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
+
+
+class Compare:
+    def __init__(self, op, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
+
+
+class Call:
+    # FN name(args), a function defined with DEF FN
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+
+class Eof:
+    # EOF(file number), whether a file opened for INPUT has no lines left
+    def __init__(self, channel):
+        self.channel = channel
+
+
+class Conditional:
+    # IF condition THEN expression ELSE expression, only a condition that is True picks the first
+    def __init__(self, condition, then_expr, else_expr):
+        self.condition = condition
+        self.then_expr = then_expr
+        self.else_expr = else_expr
+
+
+# ######################### statement nodes ##################################
+class Let:
+    def __init__(self, target, expr):
+        self.target = target
+        self.expr = expr
+
+
+class Print:
+    def __init__(self, items, channel=None):
+        self.items = items
+        self.channel = channel  # file number of PRINT #, None for the output
+
+
+class If:
+    def __init__(self, condition, then_branch, else_branch=None):
+        self.condition = condition
+        self.then_branch = then_branch
+        self.else_branch = else_branch
+
+
+class For:
+    def __init__(self, name, start, end, step=None):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.step = step
+        self.slot = None
+        self.hoisted = []  # invariants of the loop, forgotten each time it starts
+        self.parallel = False  # PARALLEL FOR, its iterations may run on worker processes
+
+
+class Next:
+    def __init__(self, name):
+        self.name = name
+        self.slot = None
+
+
+class Goto:
+    def __init__(self, lineno):
+        self.lineno = lineno
+
+
+class Gosub:
+    def __init__(self, lineno):
+        self.lineno = lineno
+
+
+class Return:
+    pass
+
+
+class Def:
+    # DEF FN name(params) = expression
+    def __init__(self, name, params, expr):
+        self.name = name
+        self.params = params
+        self.expr = expr
+
+
+class Checkpoint:
+    # CHECKPOINT "name" (, lines between automatic checkpoints)
+    def __init__(self, name, every=None):
+        self.name = name
+        self.every = every
+
+
+class Input:
+    def __init__(self, name, prompt=None, channel=None):
+        self.name = name
+        self.prompt = prompt
+        self.channel = channel  # file number of INPUT #, None for the input
+
+
+class Open:
+    # OPEN path FOR INPUT|OUTPUT|APPEND AS #number
+    def __init__(self, path, mode, channel):
+        self.path = path
+        self.mode = mode
+        self.channel = channel
+
+
+class Close:
+    # CLOSE #number, ..., every file without numbers
+    def __init__(self, channels):
+        self.channels = channels
+
+
+class Read:
+    def __init__(self, targets):
+        self.targets = targets
+
+
+class Data:
+    # DATA values, gathered into the pool READ takes them from before the program runs
+    def __init__(self, values):
+        self.values = values
+
+
+class Restore:
+    def __init__(self, lineno=None):
+        self.lineno = lineno
+
+
+class Dim:
+    def __init__(self, name, dims):
+        self.name = name
+        self.dims = dims
+
+
+class Mat:
+    # MAT name = ZER|CON (dims) or operand (op operand), a bare variable operand stands for a whole array
+    def __init__(self, name, function, operands, dims):
+        self.name = name
+        self.function = function
+        self.operands = operands
+        self.dims = dims
+        self.slot = None
+
+
+class Rem:
+    pass
+
+
+class Command:
+    # immediate commands (LIST, RUN, NEW ...) which may also appear in a program
+    def __init__(self, name, argument=None):
+        self.name = name
+        self.argument = argument
+
+
+class Parser:
+
+    def __init__(self):
+        self.token_stream = None
+        self.current_token = None
+        self.position = 0
+
+    # #### helper methods ######
+
+    def consume(self, content):
+        # consume a token and advance if the current token matches else error
+        if self.current_token.type == content:
+            self.advance()
+        else:
+            self.error()
+
+    def error(self, msg="Syntax Error"):
+        raise SyntaxError(msg)
+
+    def advance(self):
+        if self.position < len(self.token_stream):
+            self.current_token = self.token_stream[self.position]
+            self.position += 1
+
+    def parse(self, tokens):
+        # return the list of statements making up one line
+        self.token_stream = tokens
+        self.position = 0
+        self.advance()
+        statements = self.parseStatements()
+        if self.current_token.type != Tokentype.EOF:
+            self.error()
+        return statements
+
+    # ######################### grammar methods ##################################
+    def parseStatements(self):
+        # statement ( : statement )*
+        statements = [self.parseStatement()]
+        while self.current_token.type == Tokentype.COLON:
+            if type(statements[-1]) is Gosub:
+                # RETURN goes on with the line after the GOSUB
+                self.error("GOSUB must end its line")
+            if type(statements[-1]) is Checkpoint:
+                # a resumed run goes on with the line after the CHECKPOINT
+                self.error("CHECKPOINT must end its line")
+            self.consume(Tokentype.COLON)
+            statements.append(self.parseStatement())
+        return statements
+
+    def parseStatement(self):
+        val = self.current_token.value
+        if val == "LET":
+            self.consume(Tokentype(val))
+            return self.parseLet()
+        elif val == "PRINT":
+            self.consume(Tokentype(val))
+            return self.parsePrint()
+        elif val == "IF":
+            self.consume(Tokentype(val))
+            return self.parseIf()
+        elif val == "INPUT":
+            self.consume(Tokentype(val))
+            return self.parseInput()
+        elif val == "OPEN":
+            self.consume(Tokentype(val))
+            return self.parseOpen()
+        elif val == "CLOSE":
+            self.consume(Tokentype(val))
+            channels = []
+            if self.current_token.type not in (Tokentype.COLON, Tokentype.ELSE, Tokentype.EOF):
+                channels.append(self.parseChannel())
+                while self.current_token.type == Tokentype.COMMA:
+                    self.consume(Tokentype.COMMA)
+                    channels.append(self.parseChannel())
+            return Close(channels)
+        elif val == "READ":
+            self.consume(Tokentype(val))
+            targets = [self.parseVariable()]
+            while self.current_token.type == Tokentype.COMMA:
+                self.consume(Tokentype.COMMA)
+                targets.append(self.parseVariable())
+            return Read(targets)
+        elif val == "DATA":
+            self.consume(Tokentype(val))
+            return self.parseData()
+        elif val == "RESTORE":
+            self.consume(Tokentype(val))
+            lineno = None
+            if self.current_token.type == Tokentype.INTEGER:
+                lineno = self.current_token.value
+                self.consume(Tokentype.INTEGER)
+            return Restore(lineno)
+        elif val == "FOR":
+            self.consume(Tokentype(val))
+            return self.parseFor()
+        elif val == "PARALLEL":
+            self.consume(Tokentype(val))
+            self.consume(Tokentype.FOR)
+            node = self.parseFor()
+            node.parallel = True
+            return node
+        elif val == "NEXT":
+            self.consume(Tokentype(val))
+            name = self.current_token.value
+            self.consume(Tokentype.IDENTIFIER)
+            return Next(name)
+        elif val == "GOTO":
+            self.consume(Tokentype(val))
+            token = self.current_token
+            self.consume(Tokentype.INTEGER)
+            return Goto(token.value)
+        elif val == "GOSUB":
+            self.consume(Tokentype(val))
+            token = self.current_token
+            self.consume(Tokentype.INTEGER)
+            return Gosub(token.value)
+        elif val == "RETURN":
+            self.consume(Tokentype(val))
+            return Return()
+        elif val == "DEF":
+            self.consume(Tokentype(val))
+            return self.parseDef()
+        elif val == "DIM":
+            self.consume(Tokentype(val))
+            return self.parseDim()
+        elif val == "MAT":
+            self.consume(Tokentype(val))
+            return self.parseMat()
+        elif val == "REM":
+            # remarks run up to the next statement separator
+            while self.current_token.type != Tokentype.COLON and self.current_token.type != Tokentype.EOF:
+                self.advance()
+            return Rem()
+        elif val == "CHECKPOINT":
+            self.consume(Tokentype(val))
+            token = self.current_token
+            self.consume(Tokentype.STRING)
+            every = None
+            if self.current_token.type == Tokentype.COMMA:
+                self.consume(Tokentype.COMMA)
+                every = self.parseExpression()
+            return Checkpoint(token.value, every)
+        elif val in ("LOAD", "SAVE", "RESUME"):
+            self.consume(Tokentype(val))
+            token = self.current_token
+            self.consume(Tokentype.STRING)
+            return Command(val, token.value)
+        elif val == "PROFILE":
+            self.consume(Tokentype(val))
+            name = None
+            if self.current_token.type == Tokentype.STRING:
+                name = self.current_token.value
+                self.consume(Tokentype.STRING)
+            return Command(val, name)
+        elif val == "DIS":
+            self.consume(Tokentype(val))
+            lineno = None
+            if self.current_token.type == Tokentype.INTEGER:
+                lineno = self.current_token.value
+                self.consume(Tokentype.INTEGER)
+            return Command(val, lineno)
+        elif val in COMMANDS:
+            self.consume(self.current_token.type)
+            return Command(val)
+        self.error()
+
+    def parseLet(self):
+        # 'let' Identifier ('['expression']')? '=' expression
+        target = self.parseVariable()
+        self.consume(Tokentype.EQUALS)
+        return Let(target, self.parseExpression())
+
+    def parseDef(self):
+        # 'def' 'fn' Identifier '(' Identifier (',' Identifier)* ')' '=' expression
+        self.consume(Tokentype.FN)
+        name = self.current_token.value
+        self.consume(Tokentype.IDENTIFIER)
+        self.consume(Tokentype.LPAREN)
+        params = [self.current_token.value]
+        self.consume(Tokentype.IDENTIFIER)
+        while self.current_token.type == Tokentype.COMMA:
+            self.consume(Tokentype.COMMA)
+            params.append(self.current_token.value)
+            self.consume(Tokentype.IDENTIFIER)
+        self.consume(Tokentype.RPAREN)
+        if len(set(params)) != len(params):
+            self.error("Parameter named twice in FN {}".format(name))
+        self.consume(Tokentype.EQUALS)
+        return Def(name, tuple(params), self.parseExpression())
+
+    def parseDim(self):
+        # 'dim' Identifier '[' expression ']' ('[' expression ']')*
+        name = self.current_token.value
+        self.consume(Tokentype.IDENTIFIER)
+        if self.current_token.type != Tokentype.LBRACK:
+            self.error()
+        return Dim(name, self.parseSubscripts())
+
+    def parseMat(self):
+        # 'mat' Identifier '=' (ZER|CON) ('['expression']')* | factor ((+|-|*) factor)?
+        name = self.current_token.value
+        self.consume(Tokentype.IDENTIFIER)
+        self.consume(Tokentype.EQUALS)
+        if self.current_token.type in (Tokentype.ZER, Tokentype.CON):
+            function = self.current_token.value
+            self.advance()
+            return Mat(name, function, [], self.parseSubscripts())
+        operands = [self.parseFactor()]
+        function = None
+        if self.current_token.type in (Tokentype.PLUS, Tokentype.MINUS, Tokentype.MUL):
+            function = OPERATORS[self.current_token.type]
+            self.advance()
+            operands.append(self.parseFactor())
+        return Mat(name, function, operands, [])
+
+    def parsePrint(self):
+        # 'print' ('#' expression ',') expression (';' expression )*
+        channel = None
+        if self.current_token.type == Tokentype.HASH:
+            channel = self.parseChannel()
+            self.consume(Tokentype.COMMA)
+        items = [self.parseExpression()]
+        while self.current_token.type == Tokentype.SEMI:
+            self.consume(Tokentype.SEMI)
+            items.append(self.parseExpression())
+        return Print(items, channel)
+
+    def parseIf(self):
+        # 'IF' expr 'THEN' statement* ( 'ELSE' statement*)
+        condition = self.parseExpression()
+        self.consume(Tokentype.THEN)
+        then_branch = self.parseStatements()
+        else_branch = None
+        if self.current_token.type == Tokentype.ELSE:
+            self.consume(Tokentype.ELSE)
+            else_branch = self.parseStatements()
+        return If(condition, then_branch, else_branch)
+
+    def parseFor(self):
+        # FOR identifier "=" expr "TO" expr (STEP expr)?
+        name = self.current_token.value
+        self.consume(Tokentype.IDENTIFIER)
+        self.consume(Tokentype.EQUALS)
+        start = self.parseExpression()
+        self.consume(Tokentype.TO)
+        end = self.parseExpression()
+        step = None
+        while self.current_token.type == Tokentype.STEP:
+            self.consume(Tokentype.STEP)
+            step = self.parseExpression()
+        return For(name, start, end, step)
+
+    def parseInput(self):
+        # 'input' (prompt string) identifier | 'input' '#' expression ',' identifier
+        if self.current_token.type == Tokentype.HASH:
+            channel = self.parseChannel()
+            self.consume(Tokentype.COMMA)
+            name = self.current_token.value
+            self.consume(Tokentype.IDENTIFIER)
+            return Input(name, None, channel)
+        prompt = None
+        while self.current_token.type == Tokentype.STRING:
+            prompt = self.current_token.value
+            self.consume(Tokentype.STRING)
+        name = self.current_token.value
+        self.consume(Tokentype.IDENTIFIER)
+        return Input(name, prompt)
+
+    def parseOpen(self):
+        # 'open' expression 'for' ('input'|'output'|'append') 'as' ('#') expression
+        path = self.parseExpression()
+        self.consume(Tokentype.FOR)
+        mode = self.current_token.value
+        if self.current_token.type not in (Tokentype.INPUT, Tokentype.OUTPUT, Tokentype.APPEND):
+            self.error()
+        self.advance()
+        self.consume(Tokentype.AS)
+        return Open(path, mode, self.parseChannel())
+
+    def parseChannel(self):
+        # ('#') expression, the number of a file
+        if self.current_token.type == Tokentype.HASH:
+            self.consume(Tokentype.HASH)
+        return self.parseExpression()
+
+    def parseData(self):
+        # 'data' value (',' value)*, a value is a string or an integer, which may be negative
+        values = []
+        while True:
+            token = self.current_token
+            if token.type == Tokentype.STRING:
+                values.append(token.value)
+                self.advance()
+            elif token.type == Tokentype.MINUS:
+                self.consume(Tokentype.MINUS)
+                token = self.current_token
+                self.consume(Tokentype.INTEGER)
+                values.append(-token.value)
+            else:
+                self.consume(Tokentype.INTEGER)
+                values.append(token.value)
+            if self.current_token.type != Tokentype.COMMA:
+                return Data(tuple(values))
+            self.consume(Tokentype.COMMA)
+
+    def parseVariable(self):
+        # identifier ('['expr']')*
+        name = self.current_token.value
+        self.consume(Tokentype.IDENTIFIER)
+        return Variable(name, self.parseSubscripts())
+
+    def parseSubscripts(self):
+        # ('['expr']')*
+        indexes = []
+        while self.current_token.type == Tokentype.LBRACK:
+            self.consume(Tokentype.LBRACK)
+            indexes.append(self.parseExpression())
+            self.consume(Tokentype.RBRACK)
+        return indexes
+
+    def parseExpression(self):
+        # expression: term ( +|- term)* ( =|<|>|>=|<=|<> term)?
+        node = self.parseTerm()
+        while self.current_token.type in (Tokentype.PLUS, Tokentype.MINUS) or self.current_token.type in RELATIONS:
+            if self.current_token.type in RELATIONS:
+                # a relation ends the expression, exactly as compileExpression returns early
+                op = RELATIONS[self.current_token.type]
+                self.advance()
+                return Compare(op, node, self.parseTerm())
+            op = OPERATORS[self.current_token.type]
+            self.advance()
+            node = BinaryOp(op, node, self.parseTerm())
+        return node
+
+    def parseTerm(self):
+        # term: factor ( (MUL|DIV) factor)*
+        node = self.parseFactor()
+        while self.current_token.type in (Tokentype.MUL, Tokentype.DIV):
+            op = OPERATORS[self.current_token.type]
+            self.advance()
+            node = BinaryOp(op, node, self.parseFactor())
+        return node
+
+    def parseFactor(self):
+        # factor: integer | identifier ('['expr']')* | string | (expr) | RND '(' integer ')'
+        #         | (SUM|MIN|MAX) '(' identifier ')' | FN identifier '(' expr (',' expr)* ')'
+        #         | IF expr THEN expr ELSE expr | EOF '(' expr ')'
+        token = self.current_token
+        if token.type == Tokentype.INTEGER or token.type == Tokentype.STRING:
+            self.advance()
+            return Literal(token.value)
+        elif token.type == Tokentype.RND:
+            self.consume(Tokentype.RND)
+            self.consume(Tokentype.LPAREN)
+            token = self.current_token
+            self.consume(Tokentype.INTEGER)
+            self.consume(Tokentype.RPAREN)
+            return Rnd(token.value)
+        elif token.type in REDUCTIONS:
+            self.advance()
+            self.consume(Tokentype.LPAREN)
+            name = self.current_token.value
+            self.consume(Tokentype.IDENTIFIER)
+            self.consume(Tokentype.RPAREN)
+            return Reduce(token.value, Variable(name))
+        elif token.type == Tokentype.IDENTIFIER:
+            if token.value.upper() == "EOF" and self.token_stream[self.position].type == Tokentype.LPAREN:
+                # EOF is no keyword, the token ending every line has its name, it is a function by its parenthesis
+                self.consume(Tokentype.IDENTIFIER)
+                self.consume(Tokentype.LPAREN)
+                node = Eof(self.parseExpression())
+                self.consume(Tokentype.RPAREN)
+                return node
+            return self.parseVariable()
+        elif token.type == Tokentype.LPAREN:
+            self.consume(Tokentype.LPAREN)
+            node = self.parseExpression()
+            self.consume(Tokentype.RPAREN)
+            return node
+        elif token.type == Tokentype.FN:
+            self.consume(Tokentype.FN)
+            name = self.current_token.value
+            self.consume(Tokentype.IDENTIFIER)
+            self.consume(Tokentype.LPAREN)
+            args = [self.parseExpression()]
+            while self.current_token.type == Tokentype.COMMA:
+                self.consume(Tokentype.COMMA)
+                args.append(self.parseExpression())
+            self.consume(Tokentype.RPAREN)
+            return Call(name, args)
+        elif token.type == Tokentype.IF:
+            self.consume(Tokentype.IF)
+            condition = self.parseExpression()
+            self.consume(Tokentype.THEN)
+            then_expr = self.parseExpression()
+            self.consume(Tokentype.ELSE)
+            return Conditional(condition, then_expr, self.parseExpression())
+        self.error()
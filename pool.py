@@ -0,0 +1,88 @@
+"""
+Pool.py
+
+Runs many instances of one program across a multiprocessing pool, for Monte Carlo trials and the
+like. Every worker process loads and compiles the program once and then runs instance after
+instance on it, each with its own seed for RND and its own scripted INPUT lines. The result of
+every instance, its output included, is handed back as soon as it is done, in instance order.
+"""
+from interpreter import Interpreter
+import io
+import math
+import multiprocessing
+import os
+
+# the interpreter of a worker process, set up once by its initializer
+worker = None
+
+
+class Result:
+    # the outcome of one instance: its output, the error it stopped with or None, and the final values
+    # of the variables asked for
+    def __init__(self, index, seed, output, error, values):
+        self.index = index
+        self.seed = seed
+        self.output = output
+        self.error = error
+        self.values = values
+
+
+def setup(program, engine, lexer, optimize):
+    # pool initializer, prepares the interpreter every instance of this worker runs on
+    global worker
+    worker = Interpreter(engine, lexer)
+    worker.set_optimize(optimize)
+    worker.replace_program(program)
+    if engine == "vm":
+        worker.compile()
+    elif engine == "python":
+        worker.translate()
+
+
+def run_instance(task):
+    # run one instance on the worker's interpreter, from cleared variables
+    index, seed, lines, names = task
+    interpreter = worker
+    interpreter.clear()
+    interpreter.seed(seed)
+    interpreter.output = io.StringIO()
+    interpreter.input_stream = io.StringIO("".join(line + "\n" for line in lines))
+    error = None
+    try:
+        interpreter.run()
+    except Exception as e:
+        lineno = interpreter.steps[interpreter.linepos] if interpreter.linepos < len(interpreter.steps) else None
+        error = "{}{}".format(e, "" if lineno is None else " in line {}".format(lineno))
+    table = interpreter.variables.table()
+    return Result(index, seed, interpreter.output.getvalue(), error, {name: table.get(name) for name in names})
+
+
+def run(program, count, seed=0, inputs=(), names=(), engine="vm", lexer="fast", optimize=True, processes=None):
+    # yield the Result of each of count instances of a program (line number -> source), instance i is
+    # seeded with seed + i. inputs are the INPUT lines of every instance, or a function giving the lines
+    # of instance i. names are the variables whose final values each Result holds
+    processes = processes or os.cpu_count() or 1
+    # a few chunks per process keep every worker busy without a round trip per instance
+    chunksize = max(1, count // (processes * 4))
+    tasks = ((index, seed + index, list(inputs(index) if callable(inputs) else inputs), tuple(names))
+             for index in range(count))
+    with multiprocessing.Pool(processes, setup, (program, engine, lexer, optimize)) as workers:
+        for result in workers.imap(run_instance, tasks, chunksize):
+            yield result
+
+
+def summarize(results, names):
+    # name -> (count, mean, standard deviation, minimum, maximum) of the numeric final values of a variable
+    # over the instances that ended without an error
+    summary = {}
+    for name in names:
+        values = [result.values.get(name) for result in results if result.error is None]
+        values = [value for value in values if type(value) in (int, float)]
+        if not values:
+            summary.update({name: (0, None, None, None, None)})
+            continue
+        mean = sum(values) / len(values)
+        deviation = math.sqrt(sum((value - mean) ** 2 for value in values) / (len(values) - 1)) \
+            if len(values) > 1 else 0.0
+        summary.update({name: (len(values), mean, deviation, min(values), max(values))})
+    return summary
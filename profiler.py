@@ -0,0 +1,131 @@
+"""
+Profiler.py
+
+Runs a program on the tree walker while recording per line hit counts and wall time, and the time
+spent in each kind of statement. Nothing of it is installed outside a PROFILE run, so an ordinary
+RUN pays nothing for it.
+"""
+import json
+import time
+
+
+class Profiler:
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.clock = time.perf_counter
+        self.lines = {}  # line number -> [hits, seconds]
+        self.statements = {}  # statement name -> [count, seconds of its own]
+        self.stacks = {}  # collapsed stack -> seconds of its own, for flame graphs
+        self.stack = []  # frames being timed
+        self.nested = []  # seconds spent in nested frames, per frame being timed
+        self.elapsed = 0.0
+
+    def run(self):
+        # RUN on the tree walker with every line and statement timed
+        interpreter = self.interpreter
+        evaluator = interpreter.evaluator
+        statements = evaluator.statements
+        evaluator.statements = {kind: self.timed(kind.__name__.upper(), function)
+                                for kind, function in statements.items()}
+        clock = self.clock
+        lines = self.lines
+        start = clock()
+        try:
+            interpreter.prepare()
+            steps = interpreter.steps
+            while interpreter.linepos < len(steps):
+                lineno = steps[interpreter.linepos]
+                self.enter("line {}".format(lineno))
+                begin = clock()
+                try:
+                    interpreter.evaluate_line(lineno)
+                finally:
+                    seconds = self.leave(clock() - begin)
+                    entry = lines.get(lineno)
+                    if entry is None:
+                        lines.update({lineno: [1, seconds]})
+                    else:
+                        entry[0] += 1
+                        entry[1] += seconds
+                interpreter.linepos += 1
+        except KeyboardInterrupt:
+            print("** BREAK **", file=interpreter.output)
+        finally:
+            self.elapsed = clock() - start
+            evaluator.statements = statements
+            # what the program wrote to files is on disk when the run ends, as after RUN
+            interpreter.files.flush()
+
+    def timed(self, name, function):
+        clock = self.clock
+
+        def run(node):
+            self.enter(name)
+            begin = clock()
+            try:
+                function(node)
+            finally:
+                seconds = self.leave(clock() - begin, False)
+                entry = self.statements.get(name)
+                if entry is None:
+                    self.statements.update({name: [1, seconds]})
+                else:
+                    entry[0] += 1
+                    entry[1] += seconds
+        return run
+
+    def enter(self, frame):
+        self.stack.append(frame)
+        self.nested.append(0.0)
+
+    def leave(self, seconds, inclusive=True):
+        # close the innermost frame, returns its time with or without the frames nested in it
+        nested = self.nested.pop()
+        key = ";".join(["program"] + self.stack)
+        self.stack.pop()
+        self.stacks.update({key: self.stacks.get(key, 0.0) + seconds - nested})
+        if self.nested:
+            self.nested[-1] += seconds
+        return seconds if inclusive else seconds - nested
+
+    # ######################### reports ##################################
+    def report(self, limit=20):
+        # the hottest lines first, then the time per kind of statement
+        output = self.interpreter.output
+        program = self.interpreter.program
+        total = sum(seconds for hits, seconds in self.lines.values()) or 1.0
+        print("Profile: {} lines executed in {:.3f}s".format(sum(hits for hits, seconds in self.lines.values()),
+                                                             self.elapsed), file=output)
+        print("{:>6} {:>10} {:>10} {:>7} {:>10}  {}".format("line", "hits", "seconds", "%", "per hit", "code"),
+              file=output)
+        hot = sorted(self.lines.items(), key=lambda item: item[1][1], reverse=True)
+        for lineno, (hits, seconds) in hot[:limit]:
+            print("{:>6} {:>10} {:>10.4f} {:>6.1f}% {:>8.2f}us  {}".format(lineno, hits, seconds, 100 * seconds / total,
+                                                                         1e6 * seconds / hits,
+                                                                         program.get(lineno, "").strip()),
+                  file=output)
+        if len(hot) > limit:
+            print("{:>6} more lines".format(len(hot) - limit), file=output)
+        print("{:<10} {:>10} {:>10} {:>7}".format("statement", "count", "seconds", "%"), file=output)
+        for name, (count, seconds) in sorted(self.statements.items(), key=lambda item: item[1][1], reverse=True):
+            print("{:<10} {:>10} {:>10.4f} {:>6.1f}%".format(name, count, seconds, 100 * seconds / total), file=output)
+
+    def export(self, name):
+        # a .json file gets the full profile, any other name collapsed stacks in microseconds for flamegraph.pl
+        with open(name, "w") as writefile:
+            if name.lower().endswith(".json"):
+                json.dump(self.profile(), writefile, indent=1)
+            else:
+                for stack, seconds in sorted(self.stacks.items()):
+                    writefile.write("{} {}\n".format(stack, max(int(round(seconds * 1e6)), 0)))
+
+    def profile(self):
+        program = self.interpreter.program
+        return {
+            "seconds": self.elapsed,
+            "lines": [{"line": lineno, "code": program.get(lineno, "").strip(), "hits": hits, "seconds": seconds}
+                      for lineno, (hits, seconds) in sorted(self.lines.items())],
+            "statements": [{"statement": name, "count": count, "seconds": seconds}
+                           for name, (count, seconds) in sorted(self.statements.items())],
+        }
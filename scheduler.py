@@ -0,0 +1,81 @@
+"""
+Scheduler.py
+
+Interleaves many programs on one thread. Each program is an Interpreter whose run advances a slice
+at a time through run_steps, round robin, so every program gets a turn after at most one slice of
+each of the others however long they run. The CPU time of every slice is charged to its program,
+and a program that uses up its quota is stopped with the state it had, where it could be resumed.
+"""
+from collections import deque
+import time
+
+# states of a task
+READY = "ready"  # has lines left to run
+DONE = "done"  # ran to its end
+FAILED = "failed"  # stopped with an error
+STOPPED = "stopped"  # used up its CPU quota
+
+
+class Task:
+    # a program run by the scheduler
+
+    def __init__(self, name, interpreter, quota):
+        self.name = name
+        self.interpreter = interpreter
+        self.quota = quota  # CPU seconds it may use, None for no limit
+        self.used = 0.0  # CPU seconds used so far
+        self.slices = 0  # slices run so far
+        self.state = READY
+        self.error = None  # what it failed with
+
+    def __repr__(self):
+        return "Task({}, {}, {:.3f}s in {} slices)".format(self.name, self.state, self.used, self.slices)
+
+
+class Scheduler:
+
+    def __init__(self, steps=1000, seconds=0.01):
+        self.steps = steps  # program lines per slice, None for no limit
+        self.seconds = seconds  # seconds per slice, None for no limit
+        self.queue = deque()  # tasks waiting for their next slice
+        self.tasks = []  # every task, in the order added
+
+    def add(self, interpreter, name=None, quota=None):
+        # start the run of an interpreter's program and queue it for its first slice
+        task = Task(len(self.tasks) if name is None else name, interpreter, quota)
+        interpreter.start()
+        self.tasks.append(task)
+        self.queue.append(task)
+        return task
+
+    def step(self):
+        # run the next task for one slice, False when no task is left to run
+        if not self.queue:
+            return False
+        task = self.queue.popleft()
+        seconds = self.seconds
+        if task.quota is not None:
+            seconds = max(task.quota - task.used, 0.0) if seconds is None else min(seconds, task.quota - task.used)
+        begin = time.thread_time()
+        try:
+            going = task.interpreter.run_steps(self.steps, seconds)
+        except Exception as e:
+            task.error = e
+            task.state = FAILED
+            going = False
+        task.used += time.thread_time() - begin
+        task.slices += 1
+        if going:
+            if task.quota is not None and task.used >= task.quota:
+                task.state = STOPPED
+            else:
+                self.queue.append(task)
+        elif task.state == READY:
+            task.state = DONE
+        return True
+
+    def run(self):
+        # run slices until every task is done, failed or stopped, and return the tasks
+        while self.step():
+            pass
+        return self.tasks
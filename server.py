@@ -0,0 +1,232 @@
+"""
+Server.py
+
+Serves BASIC sessions over TCP with asyncio. Every connection is a session with an Interpreter of
+its own, a directory of its own for the files it reads and writes, and the line editing and
+commands of the prompt of machine.py. All sessions run on the event loop. RUN and RESUME go on a
+slice of a few milliseconds at a time through run_steps, so a long run never holds up the other
+connections, and a run stops when its connection closes. PRINT writes to the connection, which is
+drained between slices, and a line with INPUT waits for its lines of the connection before it runs.
+"""
+from interpreter import Interpreter
+from tokenizer import Tokentype
+from collections import deque
+import asyncio
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+# seconds a run goes on before the other sessions get their turn
+SLICE = 0.005
+
+# lines a connection may send ahead of the session taking them
+AHEAD = 1000
+
+RESUME = re.compile(r'\s*RESUME\s*"([^"]*)"\s*$', re.IGNORECASE)
+
+
+class Output:
+    # file PRINT of a session writes to
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    def write(self, text):
+        if not self.writer.is_closing():
+            self.writer.write(text.encode(errors="replace"))
+        return len(text)
+
+    def flush(self):
+        pass  # the session drains the connection between slices
+
+    def isatty(self):
+        return True
+
+
+class Input:
+    # file INPUT of a session reads lines from, those the session has taken for it before the line runs
+
+    def __init__(self):
+        self.lines = deque()
+
+    def readline(self):
+        # the next line taken for INPUT, "" when there is none
+        return self.lines.popleft() + "\n" if self.lines else ""
+
+    def isatty(self):
+        return True
+
+
+def inputs(tokens):
+    # the number of INPUT statements of a line that read the connection rather than a file
+    return sum(1 for pos, token in enumerate(tokens) if token.type is Tokentype.INPUT and
+               (pos + 1 == len(tokens) or tokens[pos + 1].type is not Tokentype.HASH))
+
+
+class Session:
+    # one connection: its interpreter, its directory and the lines sent on it
+
+    def __init__(self, server, reader, writer, directory):
+        self.command = server.command
+        self.banner = server.banner
+        self.reader = reader
+        self.writer = writer
+        self.directory = directory
+        self.output = Output(writer)
+        self.input = Input()
+        interpreter = self.interpreter = Interpreter(server.engine, server.lexer)
+        interpreter.set_optimize(server.optimize)
+        interpreter.output = self.output
+        interpreter.input_stream = self.input
+        interpreter.directory = directory
+        # every session would fork the worker processes of a PARALLEL FOR, and the sessions share the cores
+        interpreter.parallel.workers = 1
+        self.lines = asyncio.Queue(AHEAD)  # lines sent on the connection, None once it is closed
+        self.closed = False  # whether the connection is closed, which stops a run
+
+    async def listen(self):
+        # queue the lines of the connection until it closes
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                await self.lines.put(line.decode(errors="replace").rstrip("\r\n"))
+        except (ConnectionError, ValueError):
+            pass
+        self.closed = True
+        await self.lines.put(None)
+
+    async def take(self, count):
+        # have count lines ready for INPUT, fewer when the connection closes first
+        while len(self.input.lines) < count:
+            line = await self.lines.get()
+            if line is None:
+                self.lines.put_nowait(None)  # for the prompt
+                return
+            self.input.lines.append(line)
+
+    async def run(self):
+        # the prompt of the session, until EXIT or the connection closes
+        listener = asyncio.create_task(self.listen())
+        self.output.write('{}\nType "exit" to end the session.\n'.format(self.banner))
+        try:
+            while True:
+                self.output.write("> ")
+                await self.writer.drain()
+                if self.input.lines:
+                    # sent for an INPUT that was never reached
+                    source = self.input.lines.popleft()
+                else:
+                    source = await self.lines.get()
+                if source is None or not await self.execute(source):
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            listener.cancel()
+
+    async def execute(self, source):
+        # run a line typed to the session, False when it ends the session
+        interpreter = self.interpreter
+        try:
+            resume = RESUME.match(source)
+            if source.strip().upper() == "RUN":
+                interpreter.start()
+                await self.advance()
+            elif resume is not None:
+                linepos = interpreter.checkpoints.load(resume.group(1))
+                if linepos is not None:
+                    interpreter.linepos = linepos
+                    await self.advance()
+            else:
+                await self.take(inputs(interpreter.lexer.tokenize(source)))
+                return self.command(interpreter, source)
+        except ConnectionError:
+            return False
+        except Exception as e:
+            # the prompt of machine.py ends at a run time error, a session reports it and goes on
+            print(e, file=self.output)
+        return True
+
+    async def advance(self):
+        # go on with the run of the interpreter a slice at a time until it ends or the connection closes.
+        # A line with INPUT runs once its lines have been sent, a checkpoint saved every so many lines is
+        # saved after that many
+        interpreter = self.interpreter
+        checkpoints = interpreter.checkpoints
+        waits = {}  # line position -> INPUT statements of that line
+        for pos, lineno in enumerate(interpreter.steps):
+            count = inputs(interpreter.tokens(lineno))
+            if count:
+                waits.update({pos: count})
+        due = checkpoints.every
+        going = True
+        try:
+            while going and not self.closed:
+                if not waits and not checkpoints.every:
+                    going = interpreter.run_steps(None, SLICE)
+                else:
+                    # line by line, up to a line whose INPUT lines have not been sent yet
+                    deadline = time.perf_counter() + SLICE
+                    while going and time.perf_counter() < deadline:
+                        if len(self.input.lines) < waits.get(interpreter.linepos, 0):
+                            break
+                        going = interpreter.run_steps(1)
+                        if checkpoints.every:
+                            due = (due or checkpoints.every) - 1
+                            if due <= 0 and going:
+                                checkpoints.save(checkpoints.name, interpreter.linepos)
+                                due = checkpoints.every
+                    if going:
+                        await self.take(waits.get(interpreter.linepos, 0))
+                await self.writer.drain()
+                await asyncio.sleep(0)
+        finally:
+            interpreter.files.flush()
+
+    async def close(self):
+        self.interpreter.files.close()
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class Server:
+
+    def __init__(self, command, banner, engine="classic", lexer="fast", optimize=True, directory=None):
+        self.command = command  # function(interpreter, source) running a line typed at the prompt
+        self.banner = banner  # greeting of every session
+        self.engine = engine
+        self.lexer = lexer
+        self.optimize = optimize
+        self.directory = directory  # the directories of the sessions are made in it, None for the temp directory
+        self.sessions = set()
+
+    async def connect(self, reader, writer):
+        # a session lasts as long as its connection, its directory and the files in it go with it
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+        session = Session(self, reader, writer, tempfile.mkdtemp(prefix="session-", dir=self.directory))
+        self.sessions.add(session)
+        try:
+            await session.run()
+        finally:
+            await session.close()
+            self.sessions.discard(session)
+
+    async def serve(self, host, port, ready=None):
+        # accept connections until cancelled, ready(port) is called once the server listens
+        server = await asyncio.start_server(self.connect, host, port)
+        async with server:
+            port = server.sockets[0].getsockname()[1]
+            print("Serving BASIC sessions on {}:{}".format(host, port), file=sys.stderr)
+            if ready is not None:
+                ready(port)
+            await server.serve_forever()
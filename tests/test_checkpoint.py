@@ -0,0 +1,118 @@
+"""
+Test_checkpoint.py
+
+A run resumed from a checkpoint goes on exactly as the run it was saved from, on every engine.
+"""
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+from interpreter import Interpreter, ENGINES  # noqa: E402
+
+PROGRAM = ["10 DIM A[201]", "15 DEF FN SQ(X) = X * X", "20 FOR I = 1 TO 200", "30 LET A[I] = RND(1000)",
+           "40 NEXT I", '45 OPEN "out.txt" FOR OUTPUT AS #1', "50 FOR J = 1 TO 3", "60 GOSUB 200",
+           '70 IF J = 2 THEN CHECKPOINT "run"', "80 NEXT J", "85 READ D", "90 PRINT SUM(A); FN SQ(J); RND(1000000); D",
+           "95 CLOSE", "100 GOTO 300", "200 LET A[J] = A[J] + 1", '210 PRINT "sub"; J', "220 PRINT #1, J",
+           "230 RETURN", "250 DATA 7, 8", '300 PRINT "done"']
+
+
+def interpreter(engine, lines=()):
+    interpreter = Interpreter(engine, "fast")
+    interpreter.output = io.StringIO()
+    interpreter.seed(5)
+    for line in lines:
+        lineno, code = line.split(" ", 1)
+        interpreter.enter_line(int(lineno), " " + code)
+    return interpreter
+
+
+def read(name):
+    with open(name) as readfile:
+        return readfile.read()
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def test_resume_goes_on_with_the_run(self):
+        outputs = set()
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                full = interpreter(engine, PROGRAM)
+                full.run()
+                written = read("out.txt")
+                # the file is written again from where the checkpoint left it
+                resumed = interpreter(engine)
+                resumed.resume("run")
+                self.assertEqual(full.output.getvalue(), "sub1\nsub2\n" + resumed.output.getvalue())
+                self.assertEqual(read("out.txt"), written)
+                self.assertEqual(written, "1\n2\n3\n")
+                self.assertEqual(resumed.variables.table().get("D"), 7)
+                outputs.add(resumed.output.getvalue())
+        self.assertEqual(len(outputs), 1)
+
+    def test_resume_twice(self):
+        # a checkpoint is not used up by resuming it
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                interpreter(engine, PROGRAM).run()
+                first = interpreter(engine)
+                first.resume("run")
+                second = interpreter(engine)
+                second.resume("run")
+                self.assertEqual(first.output.getvalue(), second.output.getvalue())
+
+    def test_every(self):
+        # a run saving every so many lines keeps doing so once resumed. The run stops halfway for want of
+        # a file, which is there for the resumed run
+        lines = ['10 CHECKPOINT "every", 5', "20 LET T = 0", "30 FOR I = 1 TO 20", "40 LET T = T + I",
+                 '45 IF I = 10 THEN OPEN "go.txt" FOR INPUT AS #1', "50 NEXT I", "60 PRINT T"]
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                if os.path.exists("go.txt"):
+                    os.remove("go.txt")
+                stopped = interpreter(engine, lines)
+                with self.assertRaises(SyntaxError):
+                    stopped.run()
+                self.assertGreater(stopped.checkpoints.saved, 3)
+                open("go.txt", "w").close()
+                resumed = interpreter(engine)
+                resumed.resume("every")
+                self.assertEqual(resumed.output.getvalue(), "210\n")
+                self.assertGreater(resumed.checkpoints.saved, 3)
+
+    def test_immediate(self):
+        # typed at the prompt, CHECKPOINT keeps the program and the variables and RESUME brings them back
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                saved = interpreter(engine, ["10 PRINT X * 2"])
+                saved.execute("LET X = 21")
+                saved.execute('CHECKPOINT "prompt"')
+                restored = interpreter(engine)
+                restored.execute('RESUME "prompt"')
+                self.assertEqual(restored.output.getvalue(), "")
+                self.assertEqual(restored.variables.table().get("X"), 21)
+                restored.run()
+                self.assertEqual(restored.output.getvalue(), "42\n")
+
+    def test_missing(self):
+        with self.assertRaises(SyntaxError):
+            interpreter("ast").resume("missing")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+"""
+Test_files.py
+
+DATA, READ, RESTORE and the sequential files behave alike on every engine, errors and their lines
+included.
+"""
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+from interpreter import Interpreter, ENGINES  # noqa: E402
+
+
+def run(engine, lines):
+    # what a program prints, and the error it stops with and the line of it, None when it ends
+    interpreter = Interpreter(engine, "fast")
+    interpreter.output = io.StringIO()
+    for line in lines:
+        lineno, code = line.split(" ", 1)
+        interpreter.enter_line(int(lineno), " " + code)
+    try:
+        interpreter.run()
+    except SyntaxError as e:
+        steps = interpreter.steps
+        return interpreter.output.getvalue(), (str(e), steps[interpreter.linepos]
+                                               if interpreter.linepos < len(steps) else None)
+    return interpreter.output.getvalue(), None
+
+
+def read(name):
+    with open(name) as readfile:
+        return readfile.read()
+
+
+class TestFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def compare(self, lines, expected):
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                self.assertEqual(run(engine, lines), expected)
+
+    # ######################### DATA ##################################
+    def test_read_and_restore(self):
+        self.compare(["10 READ A, B", "20 PRINT A + B", "30 READ C", "40 PRINT C", "50 RESTORE", "60 READ D",
+                      "70 PRINT D", "80 RESTORE 200", "90 READ E", "95 PRINT E", "100 DATA 1, -2",
+                      '200 DATA "x y", 25'], ("-1\nx y\n1\nx y\n", None))
+
+    def test_read_into_an_array(self):
+        self.compare(["10 DIM A[3]", "20 FOR I = 0 TO 2", "30 READ A[I]", "40 NEXT I", "50 PRINT SUM(A)",
+                      "60 DATA 4, 5", "70 DATA 6"], ("15\n", None))
+
+    def test_out_of_data(self):
+        self.compare(["10 READ A", "20 READ B", "30 DATA 1"], ("", ("Out of DATA", 20)))
+
+    def test_restore_to_a_missing_line(self):
+        # checked with the jumps before the first line runs
+        self.compare(["10 RESTORE 15", "20 DATA 1"], ("", ("Line number 15 does not exist in line 10", 10)))
+
+    # ######################### files ##################################
+    def test_modes(self):
+        # OUTPUT empties the file, APPEND adds to it and INPUT # reads its lines back as numbers or strings
+        lines = ['10 OPEN "f.txt" FOR OUTPUT AS #1', '20 PRINT #1, 12', '30 PRINT #1, "a b"', "40 CLOSE #1",
+                 '50 OPEN "f.txt" FOR APPEND AS #2', "60 PRINT #2, 0 - 3 / 2", "70 CLOSE",
+                 '80 OPEN "f.txt" FOR INPUT AS #1', "90 IF EOF(1) THEN GOTO 130", "100 INPUT #1, V",
+                 "110 PRINT V + V", "120 GOTO 90", "130 CLOSE 1"]
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                with open("f.txt", "w") as writefile:
+                    writefile.write("left over\n")
+                self.assertEqual(run(engine, lines), ("24\na ba b\n-3.0\n", None))
+                self.assertEqual(read("f.txt"), "12\na b\n-1.5\n")
+
+    def test_flushed_without_close(self):
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                self.assertEqual(run(engine, ['10 OPEN "g.txt" FOR OUTPUT AS #1', "20 FOR I = 1 TO 3",
+                                              "30 PRINT #1, I", "40 NEXT I"]), ("", None))
+                self.assertEqual(read("g.txt"), "1\n2\n3\n")
+
+    def test_flushed_after_profile(self):
+        interpreter = Interpreter("classic", "fast")
+        interpreter.output = io.StringIO()
+        interpreter.enter_line(10, ' OPEN "p.txt" FOR OUTPUT AS #1')
+        interpreter.enter_line(20, " PRINT #1, 5")
+        interpreter.profile()
+        self.assertEqual(read("p.txt"), "5\n")
+
+    def test_input_from_an_output_file(self):
+        self.compare(['10 OPEN "g.txt" FOR OUTPUT AS #1', "20 INPUT #1, V"],
+                     ("", ("File #1 is not open for INPUT", 20)))
+
+    def test_print_to_an_input_file(self):
+        with open("h.txt", "w") as writefile:
+            writefile.write("1\n")
+        self.compare(['10 OPEN "h.txt" FOR INPUT AS #1', "20 PRINT #1, 2"],
+                     ("", ("File #1 is not open for OUTPUT", 20)))
+
+    def test_not_open(self):
+        self.compare(["10 PRINT #3, 1"], ("", ("File #3 is not open", 10)))
+
+    def test_already_open(self):
+        self.compare(['10 OPEN "g.txt" FOR OUTPUT AS #1', '20 OPEN "g.txt" FOR OUTPUT AS #1'],
+                     ("", ("File #1 is already open", 20)))
+
+    def test_past_the_end(self):
+        self.compare(['10 OPEN "g.txt" FOR OUTPUT AS #1', "20 CLOSE 1", '30 OPEN "g.txt" FOR INPUT AS #1',
+                      "40 INPUT #1, V"], ("", ("Out of data in file #1", 40)))
+
+    def test_missing_file(self):
+        path = os.path.join(os.path.abspath("missing"), "x.txt")
+        self.compare(['10 OPEN "missing/x.txt" FOR INPUT AS #1'],
+                     ("", ("Cannot open {}: No such file or directory".format(path), 10)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+"""
+Test_gosub.py
+
+GOSUB and RETURN behave alike on every engine, errors and their lines included.
+"""
+import io
+import os
+import sys
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+from interpreter import Interpreter, ENGINES  # noqa: E402
+from evaluator import GOSUB_DEPTH  # noqa: E402
+
+
+def run(engine, lines):
+    # what a program prints, and the error it stops with and the line of it, None when it ends
+    interpreter = Interpreter(engine, "fast")
+    interpreter.output = io.StringIO()
+    for line in lines:
+        lineno, code = line.split(" ", 1)
+        interpreter.enter_line(int(lineno), " " + code)
+    try:
+        interpreter.run()
+    except SyntaxError as e:
+        steps = interpreter.steps
+        return interpreter.output.getvalue(), (str(e), steps[interpreter.linepos]
+                                               if interpreter.linepos < len(steps) else None)
+    return interpreter.output.getvalue(), None
+
+
+class TestGosub(unittest.TestCase):
+
+    def compare(self, lines, expected):
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                self.assertEqual(run(engine, lines), expected)
+
+    def test_nested(self):
+        self.compare(["10 GOSUB 100", "20 PRINT 20", "30 GOTO 200", "100 GOSUB 150", "110 PRINT 110", "120 RETURN",
+                      "150 PRINT 150", "160 RETURN", "200 PRINT 200"], ("150\n110\n20\n200\n", None))
+
+    def test_recursion_to_the_depth(self):
+        # GOSUB_DEPTH GOSUBs may wait for their RETURN at once
+        self.compare(["10 LET D = 0", "20 GOSUB 100", "30 PRINT D", "40 GOTO 200", "100 LET D = D + 1",
+                      "110 IF D < {} THEN GOSUB 100".format(GOSUB_DEPTH), "120 RETURN", '200 PRINT "end"'],
+                     ("{}\nend\n".format(GOSUB_DEPTH), None))
+
+    def test_nested_too_deeply(self):
+        self.compare(["10 LET D = 0", "20 GOSUB 100", "100 LET D = D + 1", "110 GOSUB 100"],
+                     ("", ("GOSUB nested too deeply", 110)))
+
+    def test_return_without_gosub(self):
+        self.compare(["10 PRINT 1", "20 RETURN"], ("1\n", ("RETURN without GOSUB", 20)))
+
+    def test_return_after_the_gosubs_returned(self):
+        self.compare(["10 GOSUB 100", "20 PRINT 20", "100 PRINT 100", "110 RETURN"],
+                     ("100\n20\n100\n", ("RETURN without GOSUB", 110)))
+
+    def test_gosub_to_a_missing_line(self):
+        # reported before the first line runs
+        self.compare(["10 PRINT 1", "20 GOSUB 500"], ("", ("Line number 500 does not exist in line 20", 10)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+"""
+Test_optimizer.py
+
+The optimizer must not change what a program prints: every sample program is run on every engine
+with the optimizer on and off, and the outputs have to match.
+"""
+import io
+import os
+import sys
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+from interpreter import Interpreter, ENGINES  # noqa: E402
+
+PROGRAMS = os.path.join(HERE, "..", "benchmarks", "programs")
+
+
+def run(engine, optimize, path=None, lines=()):
+    # the output of a run of a program file or of program lines
+    interpreter = Interpreter(engine, "fast")
+    interpreter.set_optimize(optimize)
+    interpreter.seed(1)
+    interpreter.output = io.StringIO()
+    if path is not None:
+        interpreter.load_file(path)
+    for line in lines:
+        lineno, code = line.split(" ", 1)
+        interpreter.enter_line(int(lineno), " " + code)
+    interpreter.run()
+    return interpreter.output.getvalue()
+
+
+class TestOptimizer(unittest.TestCase):
+
+    def compare(self, path=None, lines=()):
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                self.assertEqual(run(engine, True, path, lines), run(engine, False, path, lines))
+
+    def test_programs(self):
+        names = sorted(name for name in os.listdir(PROGRAMS) if name.endswith(".bas"))
+        self.assertTrue(names)
+        for name in names:
+            with self.subTest(program=name):
+                self.compare(os.path.join(PROGRAMS, name))
+
+    def test_negative_zero(self):
+        # -0.0 + 0 is 0.0, so x+0 must not be simplified to x for a float x
+        lines = ["10 LET Z = 0", "20 PRINT Z / 5 * (0 - 1) + 0", "30 PRINT 0 + Z / 5 * (0 - 1)"]
+        self.compare(lines=lines)
+        self.assertEqual(run("ast", True, lines=lines), "0.0\n0.0\n")
+
+    def test_identities(self):
+        lines = ['10 LET A = 7', '20 LET S = "x"', '30 PRINT A * 1; 1 * A; A - 0; A + 0; 0 + A',
+                 '40 PRINT "a" + "b"; 2 * 3 + 1; 1 < 2', '50 PRINT (1 < 2) * 1']
+        self.compare(lines=lines)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+"""
+Test_scheduler.py
+
+A run carried out a slice at a time with run_steps prints what the whole run prints on every engine,
+and the scheduler gives every program its turn however long the others run.
+"""
+import io
+import os
+import sys
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+from interpreter import Interpreter, ENGINES  # noqa: E402
+from scheduler import Scheduler, DONE, FAILED, STOPPED  # noqa: E402
+
+PROGRAM = ["10 LET T = 0", "20 FOR I = 1 TO 10", "30 GOSUB 100", "40 NEXT I", "50 PRINT T", "60 GOTO 200",
+           "100 LET T = T + I * I", "110 IF I = 5 THEN PRINT T", "120 RETURN", '200 PRINT "end"']
+
+
+def interpreter(engine, lines):
+    interpreter = Interpreter(engine, "fast")
+    interpreter.output = io.StringIO()
+    for line in lines:
+        lineno, code = line.split(" ", 1)
+        interpreter.enter_line(int(lineno), " " + code)
+    return interpreter
+
+
+class TestScheduler(unittest.TestCase):
+
+    def test_slices_print_what_the_run_prints(self):
+        expected = interpreter("ast", PROGRAM)
+        expected.run()
+        for engine in ENGINES:
+            for steps in (1, 3, 1000):
+                with self.subTest(engine=engine, steps=steps):
+                    sliced = interpreter(engine, PROGRAM)
+                    sliced.start()
+                    slices = 1
+                    while sliced.run_steps(steps):
+                        slices += 1
+                    self.assertEqual(sliced.output.getvalue(), expected.output.getvalue())
+                    self.assertEqual(sliced.variables.table(), expected.variables.table())
+                    if steps == 1:
+                        # one slice per line run, the FOR line runs again for every NEXT that goes on
+                        self.assertEqual(slices, 64)
+
+    def test_a_slice_runs_at_least_a_line(self):
+        sliced = interpreter("ast", ["10 PRINT 1", "20 PRINT 2"])
+        sliced.start()
+        self.assertTrue(sliced.run_steps(None, 0))
+        self.assertEqual(sliced.output.getvalue(), "1\n")
+
+    def test_round_robin(self):
+        # every task gets a slice in turn, however long the others run
+        scheduler = Scheduler(steps=10, seconds=None)
+        endless = scheduler.add(interpreter("ast", ["10 GOTO 10"]), "endless", quota=0.2)
+        short = scheduler.add(interpreter("vm", PROGRAM), "short")
+        also = scheduler.add(interpreter("python", PROGRAM), "also")
+        for turn in range(3):
+            for task in scheduler.tasks:
+                scheduler.step()
+                self.assertEqual(task.slices, turn + 1)
+        scheduler.run()
+        self.assertEqual((endless.state, short.state, also.state), (STOPPED, DONE, DONE))
+        self.assertEqual(short.slices, 7)
+        self.assertEqual(short.interpreter.output.getvalue(), also.interpreter.output.getvalue())
+        self.assertGreaterEqual(endless.used, 0.2)
+
+    def test_failure_leaves_the_others_running(self):
+        scheduler = Scheduler(steps=1)
+        failing = scheduler.add(interpreter("ast", ["10 PRINT 1", "20 PRINT X"]))
+        other = scheduler.add(interpreter("ast", PROGRAM))
+        scheduler.run()
+        self.assertEqual(failing.state, FAILED)
+        self.assertEqual(str(failing.error), "Variable not declared")
+        self.assertEqual(failing.interpreter.output.getvalue(), "1\n")
+        self.assertEqual(other.state, DONE)
+        self.assertEqual(other.interpreter.output.getvalue(), "55\n385\nend\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+"""
+Test_server.py
+
+Sessions served over TCP print what the prompt prints on every engine, keep their files apart, and
+a run stops when its connection closes without holding up the other sessions.
+"""
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+from interpreter import ENGINES  # noqa: E402
+import machine  # noqa: E402
+import server  # noqa: E402
+
+PROGRAM = ["10 LET T = 0", "20 FOR I = 1 TO 10", "30 GOSUB 100", "40 NEXT I", "50 PRINT T", "60 GOTO 200",
+           "100 LET T = T + I * I", "120 RETURN", "200 INPUT N", "210 PRINT N * 2"]
+
+
+async def talk(port, lines):
+    # send lines to a new session and return all it sends back until it ends
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write("".join(line + "\n" for line in lines).encode())
+    text = await asyncio.wait_for(reader.read(), 10)
+    writer.close()
+    return text.decode()
+
+
+async def wait(condition, seconds=5):
+    for _ in range(int(seconds * 100)):
+        if condition():
+            return True
+        await asyncio.sleep(0.01)
+    return False
+
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def serve(self, test, engine="classic"):
+        # run test(sessions, port) against a server of its own
+        async def main():
+            sessions = server.Server(machine.command, "banner", engine, "fast", True, self.directory)
+            ready = asyncio.get_running_loop().create_future()
+            serving = asyncio.create_task(sessions.serve("127.0.0.1", 0, ready.set_result))
+            try:
+                return await test(sessions, await ready)
+            finally:
+                serving.cancel()
+        return asyncio.run(main())
+
+    def test_engines_agree(self):
+        async def test(sessions, port):
+            text = await talk(port, PROGRAM + ["RUN", "21", "PRINT T", "exit"])
+            await wait(lambda: not sessions.sessions)
+            return text
+        outputs = {}
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                text = self.serve(test, engine)
+                outputs.update({engine: text})
+                self.assertIn("385\n?42\n", text)
+        self.assertEqual(len(set(outputs.values())), 1)
+
+    def test_sessions_are_isolated(self):
+        async def test(sessions, port):
+            first = await talk(port, ['10 OPEN "f.txt" FOR OUTPUT AS #1', '20 PRINT #1, "first"', "RUN",
+                                      'SAVE "p"', 'LOAD "p"', "LIST", "exit"])
+            second = await talk(port, ['LOAD "p"', '10 OPEN "f.txt" FOR INPUT AS #1', "RUN", 'SAVE "../p"',
+                                       '10 OPEN "/tmp/f.txt" FOR OUTPUT AS #1', "RUN", 'CHECKPOINT "../c"',
+                                       'RESUME "/tmp/c"', 'PROFILE "../p.json"', "exit"])
+            await wait(lambda: not sessions.sessions)
+            return first, second
+        first, second = self.serve(test)
+        self.assertIn('PRINT #1, "first"', first)
+        self.assertIn("No such file or directory", second)
+        self.assertNotIn("first", second)
+        self.assertEqual(second.count("File name must be inside the session directory"), 5)
+        # the directories go with their sessions
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_disconnect_stops_the_run(self):
+        threads = threading.active_count()
+
+        async def test(sessions, port):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"10 GOTO 10\nRUN\n")
+            await writer.drain()
+            self.assertTrue(await wait(lambda: len(sessions.sessions) == 1))
+            # the endless run leaves the other sessions their turns
+            other = await talk(port, ["10 PRINT 6 * 7", "RUN", "exit"])
+            self.assertIn("42\n", other)
+            writer.close()
+            return await wait(lambda: not sessions.sessions)
+        self.assertTrue(self.serve(test))
+        self.assertEqual(threading.active_count(), threads)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_error_keeps_the_session(self):
+        async def test(sessions, port):
+            text = await talk(port, ["10 PRINT X", "RUN", "PRINT 5", "exit"])
+            await wait(lambda: not sessions.sessions)
+            return text
+        text = self.serve(test)
+        self.assertIn("Variable not declared\n> 5\n", text)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+"""
+Test_translator.py
+
+The python engine must print what the other engines print.
+"""
+import io
+import os
+import sys
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+from interpreter import Interpreter, ENGINES  # noqa: E402
+
+
+def run(engine, lines):
+    interpreter = Interpreter(engine, "fast")
+    interpreter.output = io.StringIO()
+    for line in lines:
+        lineno, code = line.split(" ", 1)
+        interpreter.enter_line(int(lineno), " " + code)
+    interpreter.run()
+    return interpreter.output.getvalue()
+
+
+class TestTranslator(unittest.TestCase):
+
+    def compare(self, lines):
+        expected = run("ast", lines)
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                self.assertEqual(run(engine, lines), expected)
+
+    def test_loop_left_by_goto(self):
+        # the loop left by the GOTO stays in the loop table, and the next FOR I goes on with it
+        self.compare(["10 FOR I = 1 TO 5", "20 IF I = 3 THEN GOTO 50", "30 PRINT I", "40 NEXT I",
+                      '50 PRINT "out";I', "60 FOR I = 1 TO 2", '70 PRINT "again";I', "80 NEXT I"])
+
+    def test_native_loops(self):
+        self.compare(["10 LET T = 0", "20 FOR I = 1 TO 10", "30 FOR J = I TO 10 STEP 3", "40 LET T = T + J",
+                      "50 NEXT J", "60 NEXT I", "70 PRINT T; I; J", "80 FOR K = 5 TO 1", "90 NEXT K", "100 PRINT K"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,6 +2,7 @@
 Tokenizer.py
 """
 import enum
+import re
 
 # Language KEYWORDS
 KEYWORDS = [
@@ -26,6 +27,29 @@ KEYWORDS = [
     "RND",
     "CLEAR",
     "DIM",
+    "DIS",
+    "MAT",
+    "ZER",
+    "CON",
+    "SUM",
+    "MIN",
+    "MAX",
+    "PROFILE",
+    "PARALLEL",
+    "GOSUB",
+    "RETURN",
+    "DEF",
+    "FN",
+    "CHECKPOINT",
+    "RESUME",
+    "OPEN",
+    "CLOSE",
+    "OUTPUT",
+    "APPEND",
+    "AS",
+    "READ",
+    "DATA",
+    "RESTORE",
 ]
 
 
@@ -73,9 +97,36 @@ class Tokentype(enum.Enum):
     CLEAR = "CLEAR"
     DEBUG = "DEBUG"
     DIM = "DIM"
+    DIS = "DIS"
+    MAT = "MAT"
+    ZER = "ZER"
+    CON = "CON"
+    SUM = "SUM"
+    MIN = "MIN"
+    MAX = "MAX"
+    PROFILE = "PROFILE"
+    PARALLEL = "PARALLEL"
+    GOSUB = "GOSUB"
+    RETURN = "RETURN"
+    DEF = "DEF"
+    FN = "FN"
+    CHECKPOINT = "CHECKPOINT"
+    RESUME = "RESUME"
+    OPEN = "OPEN"
+    CLOSE = "CLOSE"
+    OUTPUT = "OUTPUT"
+    APPEND = "APPEND"
+    AS = "AS"
+    READ = "READ"
+    DATA = "DATA"
+    RESTORE = "RESTORE"
+    COMMA = "COMMA"
+    HASH = "HASH"
 
 
 class Token:
+    __slots__ = ("value", "type")
+
     def __init__(self, type, val):
         self.value = val
         self.type = type
@@ -88,7 +139,7 @@ class Lexer:
         self.current_char = None
 
     def error(self):
-        raise Exception('Invalid character')
+        raise SyntaxError('Invalid character')
 
     def advance(self):
         """Advance the `pos` pointer and set the `current_char` variable."""
@@ -128,6 +179,14 @@ class Lexer:
         self.advance()  # move past the closing quote identifier
         return result
 
+    def remark(self):
+        """Skip the text of a REM up to the next statement separator, it is never split into tokens."""
+        while self.current_char is not None and self.current_char != ':':
+            if self.current_char == '"':
+                self.string()
+            else:
+                self.advance()
+
     def peek(self):
         """Peek at the next character without advancing"""
         return self.text[self.pos+1]
@@ -150,6 +209,8 @@ class Lexer:
             if self.current_char.isalpha():  # must start with alpha char
                 value = self.identifier()
                 if value.upper() in KEYWORDS:
+                    if value.upper() == "REM":
+                        self.remark()
                     return Token(Tokentype(value.upper()), value.upper())
                 else:
                     return Token(Tokentype.IDENTIFIER, value)
@@ -201,6 +262,14 @@ class Lexer:
                 self.advance()
                 return Token(Tokentype.COLON, ':')
 
+            if self.current_char == ',':
+                self.advance()
+                return Token(Tokentype.COMMA, ',')
+
+            if self.current_char == '#':
+                self.advance()
+                return Token(Tokentype.HASH, '#')
+
             if self.current_char == '?':
                 self.advance()
                 return Token(Tokentype.DEBUG, '?')
@@ -243,3 +312,82 @@ class Lexer:
             token = self.get_next_token()
         token_list.append(token)   # append the EOF token
         return token_list
+
+
+# one alternative per token kind after optional white space: integer, word, string (closing quote optional),
+# symbol, and any other character which is an error
+TOKEN_PATTERN = re.compile(r'\s*(?:(\d+)|([^\W\d_][^\W_]*)|("[^"]*"?)|(>=|<=|<>|[-+*/()\[\]=;:,#?<>])|(\S))')
+
+# the text of a REM, up to the next statement separator outside a string
+REMARK = re.compile(r'(?:[^:"]|"[^"]*"?)*')
+
+SYMBOLS = {
+    "+": Tokentype.PLUS,
+    "-": Tokentype.MINUS,
+    "*": Tokentype.MUL,
+    "/": Tokentype.DIV,
+    "(": Tokentype.LPAREN,
+    ")": Tokentype.RPAREN,
+    "[": Tokentype.LBRACK,
+    "]": Tokentype.RBRACK,
+    "=": Tokentype.EQUALS,
+    ";": Tokentype.SEMI,
+    ":": Tokentype.COLON,
+    ",": Tokentype.COMMA,
+    "#": Tokentype.HASH,
+    "?": Tokentype.DEBUG,
+    ">": Tokentype.GT,
+    ">=": Tokentype.GTE,
+    "<": Tokentype.LT,
+    "<=": Tokentype.LTE,
+    "<>": Tokentype.NE,
+}
+
+# tokens never change once made, so every keyword and symbol is one shared instance
+KEYWORD_TOKENS = {keyword: Token(Tokentype(keyword), keyword) for keyword in set(KEYWORDS)}
+SYMBOL_TOKENS = {symbol: Token(type, symbol) for symbol, type in SYMBOLS.items()}
+EOF_TOKEN = Token(Tokentype.EOF, None)
+
+
+class FastLexer:
+    # produces the same tokens as Lexer with a single regular expression pass over the line
+
+    def error(self):
+        raise SyntaxError('Invalid character')
+
+    def tokenize(self, text):
+        """ Return a list of tokens from the input"""
+        token_list = []
+        append = token_list.append
+        keywords = KEYWORD_TOKENS
+        remark = KEYWORD_TOKENS.get("REM")
+        pos = 0
+        while pos is not None:
+            start = pos
+            pos = None
+            for match in TOKEN_PATTERN.finditer(text, start):
+                integer, word, string, symbol, other = match.groups()
+                if word:
+                    token = keywords.get(word.upper())
+                    append(Token(Tokentype.IDENTIFIER, word) if token is None else token)
+                    if token is remark:
+                        # the text of a remark is skipped, the scan goes on after it
+                        pos = REMARK.match(text, match.end()).end()
+                        break
+                elif symbol:
+                    append(SYMBOL_TOKENS[symbol])
+                elif integer:
+                    append(Token(Tokentype.INTEGER, int(integer)))
+                elif string:
+                    append(Token(Tokentype.STRING, string[1:-1] if len(string) > 1 and string[-1] == '"' else string[1:]))
+                else:
+                    self.error()
+        append(EOF_TOKEN)
+        return token_list
+
+
+# lexers that can be chosen for an Interpreter
+LEXERS = {
+    "classic": Lexer,
+    "fast": FastLexer,
+}
@@ -0,0 +1,597 @@
+"""
+Translator.py
+
+Translates a whole program into Python source and compiles that into a code object.
+Variables become locals and properly nested FOR/NEXT pairs become native while loops.
+A loop whose start and end are inferred to be integers becomes a for loop over a range.
+GOTO becomes a dispatch on line position, GOSUB and RETURN too, with the return stack of the
+interpreter. Lines which cannot be translated are run by the interpreter's tree walker in
+between.
+"""
+from parser import Literal, Variable, Rnd, Reduce, Invariant, BinaryOp, Compare, Call, Eof, Conditional, Let, Print, If, \
+    For, Next, Goto, Gosub, Return, Def, Checkpoint, Input, Open, Close, Read, Data, Restore, Dim, Mat, Rem
+from variables import UNSET, Array
+from matrix import mat, reduce
+
+OPERATORS = {
+    "+": "+",
+    "-": "-",
+    "*": "*",
+    "/": "/",
+    "=": "==",
+    ">": ">",
+    ">=": ">=",
+    "<": "<",
+    "<=": "<=",
+    "<>": "!=",
+}
+
+
+class Untranslatable(Exception):
+    pass
+
+
+class Translation:
+    def __init__(self):
+        self.source = ""
+        self.function = None
+        self.segments = {}  # line number -> python source lines generated for it
+        self.fallbacks = []  # (line number, reason) of lines left to the interpreter
+        self.types = None  # signature of the inferred types it was translated for
+        self.origins = {}  # line of the python source -> line number it was generated for
+        self.bridge = None  # code of the function running interpreted lines
+
+    def line(self, e):
+        # the line number the program was running when it raised e, None when the interpreter ran it
+        lineno = None
+        tb = e.__traceback__
+        while tb is not None:
+            code = tb.tb_frame.f_code
+            if code is self.bridge:
+                return None
+            if code.co_filename == "<basic>":
+                lineno = self.origins.get(tb.tb_lineno, lineno)
+            tb = tb.tb_next
+        return lineno
+
+
+class Translator:
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.lines = []  # (lineno, statements or None when the line does not parse)
+        self.positions = {}  # line number -> position
+        self.names = {}  # variable name -> python local
+        self.arrays = set()
+        self.loops = {}  # position of a native FOR line -> position of its NEXT line
+        self.functions = set()  # names of the functions the program defines and may be called from it
+        self.globals = set()  # variables read by the functions the program defines
+        self.fallbacks = {}  # position -> reason
+        self.labels = set()
+        self.source = []
+        self.indent = 0
+        self.loopcount = 0
+        self.lineno = None
+        self.pos = None
+        self.assigned = set()  # scalars surely assigned where the code being emitted runs
+        self.lazy = 0  # depth of expressions which may not be evaluated, whose reads prove no assignment
+
+    # ######################### analysis ##################################
+    def analyse(self):
+        interpreter = self.interpreter
+        self.lines = []
+        for lineno in sorted(interpreter.program.keys()):
+            try:
+                self.lines.append((lineno, interpreter.parsed(lineno)))
+            except SyntaxError:
+                self.lines.append((lineno, None))
+        self.positions = {lineno: pos for pos, (lineno, statements) in enumerate(self.lines)}
+        self.names = {}
+        self.arrays = set()
+        self.fallbacks = {}
+        for pos, (lineno, statements) in enumerate(self.lines):
+            if statements is None:
+                self.fallbacks.update({pos: "syntax error"})
+                continue
+            for node in walk(statements):
+                if isinstance(node, (Variable, Invariant, Let, For, Next, Input, Dim, Mat)):
+                    name = node.target.name if isinstance(node, Let) else node.name
+                    if name not in self.names:
+                        self.names.update({name: "v{}".format(interpreter.variables.slot(name))})
+                if isinstance(node, (Dim, Mat)) or (isinstance(node, Variable) and node.indexes):
+                    self.arrays.add(node.name)
+            try:
+                self.checkStatements(statements, True)
+            except Untranslatable as e:
+                self.fallbacks.update({pos: str(e)})
+        self.findFunctions()
+        self.findLoops()
+        # jump targets, the lines after GOSUBs and interpreted ones and dynamic FOR lines start dispatch blocks
+        self.labels = {0}
+        for pos, (lineno, statements) in enumerate(self.lines):
+            for node in walk(statements or []):
+                if isinstance(node, (Goto, Gosub)) and node.lineno in self.positions:
+                    self.labels.add(self.positions.get(node.lineno))
+                if isinstance(node, Gosub):
+                    self.labels.add(pos + 1)
+                if isinstance(node, For) and pos in self.fallbacks:
+                    self.labels.add(pos)
+            if pos in self.fallbacks:
+                self.labels.add(pos + 1)
+
+    def checkStatements(self, statements, terminal):
+        for pos, node in enumerate(statements):
+            last = terminal and pos == len(statements) - 1
+            kind = type(node)
+            if kind is If:
+                self.checkStatements(node.then_branch, last)
+                if node.else_branch is not None:
+                    self.checkStatements(node.else_branch, last)
+            elif kind is Goto and not last:
+                raise Untranslatable("GOTO followed by more statements")
+            elif kind is Return and not last:
+                raise Untranslatable("RETURN followed by more statements")
+            elif kind is Def:
+                raise Untranslatable("DEF FN")
+            elif kind is Checkpoint:
+                raise Untranslatable("CHECKPOINT")
+            elif kind is For and node.parallel:
+                raise Untranslatable("PARALLEL FOR")
+            elif kind not in (Let, Print, Input, Open, Close, Read, Data, Restore, Dim, Mat, Rem, For, Next, Goto, Gosub,
+                              Return):
+                raise Untranslatable("{} statement".format(getattr(node, "name", kind.__name__)))
+
+    def findFunctions(self):
+        # functions are defined as the program runs. The translation calls those the program defines, when
+        # they only call such functions themselves, and keeps the variables they read up to date for them;
+        # a line calling any other function is interpreted
+        definitions = [node for lineno, statements in self.lines for node in walk(statements or [])
+                       if isinstance(node, Def)]
+        self.functions = {node.name for node in definitions}
+        changed = True
+        while changed:
+            changed = False
+            for node in definitions:
+                if node.name in self.functions and any(isinstance(call, Call) and call.name not in self.functions
+                                                       for call in walk([node.expr])):
+                    self.functions.discard(node.name)
+                    changed = True
+        self.globals = set()
+        for node in definitions:
+            for child in walk([node.expr]):
+                if isinstance(child, Variable) and child.name not in node.params:
+                    self.globals.add(child.name)
+                elif isinstance(child, Reduce):
+                    self.globals.add(child.variable.name)
+        for pos, (lineno, statements) in enumerate(self.lines):
+            if pos in self.fallbacks:
+                continue
+            for node in walk(statements):
+                if isinstance(node, Call) and node.name not in self.functions:
+                    self.fallbacks.update({pos: "FN {} is not defined by the program".format(node.name)})
+                    break
+
+    def findLoops(self):
+        # a FOR leading its line pairs natively with the first NEXT of its variable when that NEXT ends
+        # its line, and neither jumps nor interpreted lines nor unpaired loops lie between them
+        candidates = []
+        for pos, (lineno, statements) in enumerate(self.lines):
+            if pos in self.fallbacks or not isinstance(statements[0], For):
+                continue
+            name = statements[0].name
+            end = self.matchNext(pos, name)
+            if end is not None and name not in self.arrays:
+                candidates.append((end - pos, pos, end))
+        targets = set()
+        for lineno, statements in self.lines:
+            for node in walk(statements or []):
+                if isinstance(node, (Goto, Gosub)) and node.lineno in self.positions:
+                    targets.add(self.positions.get(node.lineno))
+        # a FOR that is not native leaves its loop in the interpreter's loop table when a jump leaves the loop,
+        # and a later FOR of its variable goes on with that loop, so no loop of such a variable is native
+        excluded = set()
+        while True:
+            self.loops = {}
+            for size, start, end in sorted(candidates):
+                if self.lines[start][1][0].name not in excluded and self.nativeRegion(start, end, targets):
+                    self.loops.update({start: end})
+            dynamic = {node.name for pos, (lineno, statements) in enumerate(self.lines)
+                       for node in walk(statements or []) if isinstance(node, For) and
+                       not (pos in self.loops and node is statements[0])}
+            if not dynamic & {self.lines[start][1][0].name for start in self.loops}:
+                break
+            excluded |= dynamic
+        for pos, (lineno, statements) in enumerate(self.lines):
+            if pos in self.fallbacks or pos in self.loops:
+                continue
+            for node in walk(statements):
+                if isinstance(node, (For, Next)) and not self.paired(pos, node):
+                    self.fallbacks.update({pos: "FOR/NEXT not properly nested"})
+                    break
+
+    def matchNext(self, start, name):
+        for pos in range(start, len(self.lines)):
+            line = self.lines[pos][1] or []
+            for node in walk(line[1:] if pos == start else line):
+                if isinstance(node, Next) and node.name == name:
+                    return pos if node is line[-1] else None
+        return None
+
+    def nativeRegion(self, start, end, targets):
+        for pos in range(start, end + 1):
+            if pos in self.fallbacks or (pos != start and pos in targets):
+                return False
+            statements = self.lines[pos][1]
+            for node in walk(statements[1:] if pos == start else statements):
+                if isinstance(node, (Goto, Gosub, Return)):
+                    return False
+                if isinstance(node, For) and not (node is statements[0] and self.loops.get(pos, end + 1) <= end):
+                    return False
+                if isinstance(node, Next) and not (node is statements[-1] and self.closes(pos, start, end)):
+                    return False
+        return True
+
+    def closes(self, pos, start, end):
+        # is the NEXT ending line pos the end of the loop itself or of a native loop nested in it
+        return pos == end or any(first > start and last == pos for first, last in self.loops.items())
+
+    def paired(self, pos, node):
+        if isinstance(node, For):
+            return pos in self.loops and node is self.lines[pos][1][0]
+        return node is self.lines[pos][1][-1] and pos in self.loops.values()
+
+    # ######################### code generation ##################################
+    def emit(self, text):
+        self.source.append("    " * self.indent + text)
+
+    def translate(self):
+        self.analyse()
+        self.source = []
+        self.indent = 0
+        self.loopcount = 0
+        translation = Translation()
+        translation.types = self.interpreter.inference.signature
+        for name, local in self.names.items():
+            self.emit("# {} = {}".format(local, name))
+        self.emit("def program(interpreter):")
+        self.indent += 1
+        self.emit("values = interpreter.variables.values")
+        self.emit("output = interpreter.output")
+        self.emit("returns = interpreter.gosubs")
+        self.emitLoad()
+        self.emit("pos = 0")
+        self.emit("try:")
+        self.indent += 1
+        self.emit("while True:")
+        self.indent += 1
+        pos = 0
+        keyword = "if"
+        while pos < len(self.lines):
+            self.emit("{} pos == {}:".format(keyword, pos))
+            keyword = "elif"
+            self.indent += 1
+            pos = self.emitBlock(pos, translation)
+            self.indent -= 1
+        self.emit("{} pos >= {}:".format(keyword, len(self.lines)))
+        self.emit("    break")
+        self.emit("else:")
+        self.indent += 1
+        self.emit("# entered a line inside a block, interpret up to the next block")
+        self.emitStore()
+        self.emit("pos = interpret(pos)")
+        self.emitLoad()
+        self.indent -= 3
+        self.emit("finally:")
+        self.indent += 1
+        self.emitStore()
+        translation.source = "\n".join(self.source) + "\n"
+        namespace = {
+            "randint": self.interpreter.random.randint,
+            "Array": Array,
+            "UNSET": UNSET,
+            "mat": mat,
+            "reduce": reduce,
+            "read_input": self.interpreter.read_input,
+            "push_return": self.interpreter.push_return,
+            "call": self.interpreter.functions.call,
+            "files": self.interpreter.files,
+            "interpret": self.interpreter_bridge(),
+        }
+        translation.bridge = namespace.get("interpret").__code__
+        exec(compile(translation.source, "<basic>", "exec"), namespace)
+        translation.function = namespace.get("program")
+        translation.fallbacks = [(self.lines[pos][0], reason) for pos, reason in sorted(self.fallbacks.items())]
+        return translation
+
+    def interpreter_bridge(self):
+        # run lines on the tree walker from pos until the next block starts, return where to continue
+        interpreter = self.interpreter
+        labels = frozenset(self.labels)
+        fallbacks = frozenset(self.fallbacks)
+        steps = [lineno for lineno, statements in self.lines]
+
+        def interpret(pos):
+            while pos < len(steps) and (pos not in labels or pos in fallbacks):
+                interpreter.linepos = pos
+                interpreter.evaluate_line(steps[pos])
+                pos = interpreter.linepos + 1
+            return pos
+        return interpret
+
+    def emitLoad(self):
+        for name, local in self.names.items():
+            self.emit("{} = values[{}]".format(local, self.interpreter.variables.slot(name)))
+
+    def emitStore(self):
+        if not self.names:
+            self.emit("pass")
+        for name, local in self.names.items():
+            self.emit("values[{}] = {}".format(self.interpreter.variables.slot(name), local))
+
+    def emitBlock(self, pos, translation):
+        # emit the lines from pos up to the next block, return the position of that block. A block may be
+        # entered from anywhere, so no variable is known to be assigned at its start
+        self.assigned = set()
+        while True:
+            lineno, statements = self.lines[pos]
+            self.lineno = lineno
+            self.pos = pos
+            first = len(self.source)
+            if pos in self.fallbacks:
+                self.emit("# {} {} is interpreted: {}".format(lineno, self.interpreter.program.get(lineno),
+                                                             self.fallbacks.get(pos)))
+                self.emitStore()
+                self.emit("pos = interpret({})".format(pos))
+                self.emitLoad()
+                self.emit("continue")
+                self.segment(translation, lineno, first)
+                return pos + 1
+            self.emit("# {} {}".format(lineno, self.interpreter.program.get(lineno)))
+            if pos in self.loops:
+                pos = self.emitLoop(pos, translation)
+            else:
+                self.emitStatements(statements)
+                self.segment(translation, lineno, first)
+            pos += 1
+            if pos >= len(self.lines) or pos in self.labels:
+                self.emit("pos = {}".format(pos))
+                self.emit("continue")
+                return pos
+
+    def segment(self, translation, lineno, first):
+        translation.segments.setdefault(lineno, []).extend(self.source[first:])
+        translation.origins.update({index + 1: lineno for index in range(first, len(self.source))})
+
+    def emitLoop(self, start, translation):
+        # FOR ... NEXT as a native loop, runs the body before testing like the interpreter does
+        end = self.loops.get(start)
+        statements = self.lines[start][1]
+        node = statements[0]
+        local = self.names.get(node.name)
+        counted = self.counted(start, end)
+        self.loopcount += 1
+        limit = "e{}".format(self.loopcount)
+        step = "s{}".format(self.loopcount)
+        first = len(self.source)
+        self.emit("{} = {}".format(local, self.expression(node.start)))
+        self.assigned.add(node.name)
+        self.emit("{} = {}".format(limit, self.expression(node.end)))
+        if not counted:
+            self.emit("{} = {}".format(step, 1 if node.step is None else self.expression(node.step)))
+        for invariant in node.hoisted:
+            self.emit("{} = UNSET".format(self.names.get(invariant.name)))
+        if counted:
+            # the variable runs up to the first value not less than the end, and at least once
+            increment = 1 if node.step is None else node.step.value
+            self.emit("for {} in range({}, max({}, {}) + {}{}):".format(local, local, limit, local, increment,
+                                                                       "" if increment == 1 else
+                                                                       ", {}".format(increment)))
+        else:
+            self.emit("while True:")
+        self.indent += 1
+        body = len(self.source)
+        statements = statements[1:-1] if start == end else statements[1:]
+        self.emitStatements(statements, False)
+        self.segment(translation, self.lines[start][0], first)
+        pos = start + 1
+        while pos <= end:
+            lineno, statements = self.lines[pos]
+            self.lineno = lineno
+            first = len(self.source)
+            self.emit("# {} {}".format(lineno, self.interpreter.program.get(lineno)))
+            if pos in self.loops:
+                pos = self.emitLoop(pos, translation)
+            else:
+                self.emitStatements(statements[:-1] if pos == end else statements, False)
+                self.segment(translation, lineno, first)
+            pos += 1
+        first = len(self.source)
+        if not counted:
+            self.emit("if {} < {}:".format(local, limit))
+            self.emit("    {} = {} + {}".format(local, local, step))
+            self.emit("else:")
+            self.emit("    break")
+        elif all(line.lstrip().startswith("#") for line in self.source[body:]):
+            self.emit("pass")
+        self.indent -= 1
+        self.segment(translation, self.lines[end][0], first)
+        return end
+
+    def counted(self, start, end):
+        # whether a native loop runs over a range: its start and end are always integers, its step a positive
+        # integer constant, and no statement of its body assigns its variable
+        node = self.lines[start][1][0]
+        if node.step is not None and not (type(node.step) is Literal and type(node.step.value) is int and
+                                          node.step.value > 0):
+            return False
+        inference = self.interpreter.inference
+        if not inference.integer(node.start) or not inference.integer(node.end):
+            return False
+        for pos in range(start, end + 1):
+            statements = self.lines[pos][1]
+            for child in walk(statements[1:] if pos == start else statements):
+                if isinstance(child, Let) and child.target.name == node.name:
+                    return False
+                if isinstance(child, (For, Input, Dim, Mat)) and child.name == node.name:
+                    return False
+                if isinstance(child, Read) and any(target.name == node.name for target in child.targets):
+                    return False
+        return True
+
+    def emitStatements(self, statements, block=True):
+        # block is true when the statements make up a whole python block that must not be empty
+        start = len(self.source)
+        for node in statements:
+            if self.globals and any(isinstance(child, Call) for child in walk([node])):
+                # the functions read variables from the store, not from the locals
+                for name in sorted(self.globals & set(self.names)):
+                    self.emit("values[{}] = {}".format(self.interpreter.variables.slot(name), self.names.get(name)))
+            self.emitStatement(node)
+        if block and len(self.source) == start:
+            self.emit("pass")
+
+    def emitStatement(self, node):
+        kind = type(node)
+        if kind is Let:
+            # python evaluates the value before the target
+            expression = self.expression(node.expr)
+            self.emit("{} = {}".format(self.variable(node.target), expression))
+            self.assigned.add(node.target.name)
+        elif kind is Print and node.channel is not None:
+            self.emit("files.write({}, ''.join((str({}),)))".format(self.expression(node.channel), "), str(".join(
+                self.expression(item) for item in node.items)))
+        elif kind is Print:
+            items = [self.expression(item) for item in node.items]
+            if len(items) == 1:
+                self.emit("print(str({}), file=output)".format(items[0]))
+            else:
+                self.emit("print(''.join((str({}),)), file=output)".format("), str(".join(items)))
+        elif kind is If:
+            # a branch may not run, so what it assigns is not known to be assigned after the IF
+            self.emit("if {}:".format(self.condition(node.condition)))
+            assigned = set(self.assigned)
+            self.indent += 1
+            self.emitStatements(node.then_branch)
+            self.indent -= 1
+            self.assigned = set(assigned)
+            if node.else_branch is not None:
+                self.emit("else:")
+                self.indent += 1
+                self.emitStatements(node.else_branch)
+                self.indent -= 1
+                self.assigned = assigned
+        elif kind is Goto:
+            if node.lineno in self.positions:
+                self.emit("pos = {}".format(self.positions.get(node.lineno)))
+                self.emit("continue")
+            else:
+                self.emit("raise SyntaxError('Line number does not exist')")
+        elif kind is Gosub:
+            if node.lineno in self.positions:
+                self.emit("push_return({})".format(self.pos))
+                self.emit("pos = {}".format(self.positions.get(node.lineno)))
+                self.emit("continue")
+            else:
+                self.emit("raise SyntaxError('Line number does not exist')")
+        elif kind is Return:
+            self.emit("if not returns:")
+            self.emit("    raise SyntaxError('RETURN without GOSUB')")
+            self.emit("pos = returns.pop() + 1")
+            self.emit("continue")
+        elif kind is Input and node.channel is not None:
+            self.emit("{} = files.input({})".format(self.names.get(node.name), self.expression(node.channel)))
+            self.assigned.add(node.name)
+        elif kind is Open:
+            self.emit("files.open({}, {!r}, {})".format(self.expression(node.path), node.mode,
+                                                       self.expression(node.channel)))
+        elif kind is Close:
+            if not node.channels:
+                self.emit("files.close()")
+            for channel in node.channels:
+                self.emit("files.close({})".format(self.expression(channel)))
+        elif kind is Read:
+            for target in node.targets:
+                self.emit("{} = files.read()".format(self.variable(target)))
+                self.assigned.add(target.name)
+        elif kind is Restore:
+            self.emit("files.restore({!r})".format(node.lineno))
+        elif kind is Input:
+            self.emit("{} = read_input({!r})".format(self.names.get(node.name), "?" if node.prompt is None
+                                                     else node.prompt))
+            self.assigned.add(node.name)
+        elif kind is Dim:
+            self.emit("{} = Array([{}])".format(self.names.get(node.name),
+                                                ", ".join(self.expression(dim) for dim in node.dims)))
+        elif kind is Mat:
+            local = self.names.get(node.name)
+            self.emit("{} = mat({!r}, {}, [{}], [{}])".format(local, node.function, local,
+                                                             ", ".join(self.operand(item) for item in node.operands),
+                                                             ", ".join(self.expression(dim) for dim in node.dims)))
+
+    def operand(self, node):
+        # a bare variable is passed whole, so an array operand is the array itself
+        if type(node) is Variable and not node.indexes:
+            return self.names.get(node.name)
+        return self.expression(node)
+
+    def condition(self, node):
+        # comparisons always give booleans, anything else only counts when it is True
+        if isinstance(node, Compare):
+            return self.expression(node)
+        return "{} is True".format(self.expression(node))
+
+    def variable(self, node):
+        local = self.names.get(node.name)
+        if node.name not in self.arrays:
+            return local
+        if len(node.indexes) > 1:
+            return "{}[{}.offset(({},))]".format(local, local, ", ".join(self.expression(index)
+                                                                         for index in node.indexes))
+        return "{}[{}]".format(local, self.expression(node.indexes[0]) if node.indexes else 0)
+
+    def expression(self, node):
+        kind = type(node)
+        if kind is Literal:
+            return repr(node.value)
+        elif kind is Variable:
+            if node.name in self.arrays or node.name in self.assigned:
+                return self.variable(node)
+            # a read of a variable maybe never assigned fails like on the other engines rather than copying UNSET
+            local = self.names.get(node.name)
+            if not self.lazy:
+                self.assigned.add(node.name)
+            return "({} if {} is not UNSET else UNSET.error())".format(local, local)
+        elif kind is Rnd:
+            return "randint(1, {})".format(node.limit)
+        elif kind is Reduce:
+            return "reduce({!r}, {})".format(node.function, self.operand(node.variable))
+        elif kind is Invariant:
+            # the kept value, or the expression computed and kept on the first use
+            local = self.names.get(node.name)
+            self.lazy += 1
+            expression = self.expression(node.expr)
+            self.lazy -= 1
+            return "({} if {} is not UNSET else ({} := {}))".format(local, local, local, expression)
+        elif kind is Call:
+            return "call({!r}, ({}))".format(node.name, "".join(self.expression(arg) + ", " for arg in node.args))
+        elif kind is Eof:
+            return "files.eof({})".format(self.expression(node.channel))
+        elif kind is Conditional:
+            condition = self.condition(node.condition)
+            self.lazy += 1
+            then_expr = self.expression(node.then_expr)
+            else_expr = self.expression(node.else_expr)
+            self.lazy -= 1
+            return "({} if {} else {})".format(then_expr, condition, else_expr)
+        return "({} {} {})".format(self.expression(node.left), OPERATORS[node.op], self.expression(node.right))
+
+
+def walk(nodes):
+    # every node of a list of statements, in source order
+    for node in nodes:
+        yield node
+        for child in vars(node).values():
+            if isinstance(child, list):
+                yield from walk(child)
+            elif hasattr(child, "__dict__"):
+                yield from walk([child])
@@ -0,0 +1,147 @@
+"""
+Variables.py
+
+Variable store shared by every execution engine. Names are resolved to integer slots once,
+scalars are stored unboxed and DIM arrays in compact typed storage.
+"""
+from array import array
+import sys
+
+
+class Unset:
+    # value of a variable before its first assignment, any use of it is an error
+
+    def error(self, *args):
+        raise SyntaxError("Variable not declared")
+
+    __add__ = __radd__ = __sub__ = __rsub__ = __mul__ = __rmul__ = __truediv__ = __rtruediv__ = error
+    __lt__ = __le__ = __gt__ = __ge__ = __eq__ = __ne__ = error
+    __getitem__ = __setitem__ = __str__ = __index__ = offset = error
+    __hash__ = object.__hash__
+
+    def __repr__(self):
+        return "UNSET"
+
+
+UNSET = Unset()
+
+
+class Array:
+    # a DIM array, its elements are kept row-major in one flat store. Numbers start out as 64 bit
+    # integers in an array.array, the first value that does not fit turns the store into a list
+
+    def __init__(self, dims, items=None):
+        size = 1
+        for dim in dims:
+            if type(dim) is not int or dim < 0:
+                raise SyntaxError("Subscript out of range")
+            size *= dim
+        self.dims = dims
+        self.items = array("q", [0]) * size if items is None else items
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, pos):
+        return self.items[pos]
+
+    def __setitem__(self, pos, value):
+        items = self.items
+        if type(items) is list:
+            items[pos] = value
+        elif type(value) is int and -0x8000000000000000 <= value <= 0x7fffffffffffffff:
+            items[pos] = value
+        else:
+            self.items = items.tolist()
+            self.items[pos] = value
+
+    def offset(self, indexes):
+        # a bare name is the first element and a single subscript indexes the flat store, otherwise
+        # there must be one subscript per dimension
+        if not indexes:
+            return 0
+        if len(indexes) == 1:
+            if indexes[0] >= len(self.items):
+                raise SyntaxError("Subscript out of range")
+            return indexes[0]
+        if len(indexes) != len(self.dims):
+            raise SyntaxError("Subscript out of range")
+        pos = 0
+        for index, dim in zip(indexes, self.dims):
+            if not 0 <= index < dim:
+                raise SyntaxError("Subscript out of range")
+            pos = pos * dim + index
+        return pos
+
+    def nbytes(self):
+        items = self.items
+        if type(items) is list:
+            return sys.getsizeof(items) + sum(sys.getsizeof(value) for value in items)
+        return sys.getsizeof(items)
+
+    def __repr__(self):
+        items = self.items[:10].tolist() if type(self.items) is array else self.items[:10]
+        return "[{}]{}{}".format("][".join(str(dim) for dim in self.dims), items,
+                                 "..." if len(self.items) > 10 else "")
+
+
+class Variables:
+
+    def __init__(self):
+        self.slots = {}  # name -> slot
+        self.names = []  # slot -> name
+        self.values = []  # slot -> value
+
+    def error(self, msg="Syntax Error"):
+        raise SyntaxError(msg)
+
+    def slot(self, name):
+        # the slot of a variable, allocated on first use and kept for the life of the store
+        slot = self.slots.get(name)
+        if slot is None:
+            slot = len(self.values)
+            self.slots.update({name: slot})
+            self.names.append(name)
+            self.values.append(UNSET)
+        return slot
+
+    def get(self, name):
+        slot = self.slots.get(name)
+        return UNSET if slot is None else self.values[slot]
+
+    def set(self, name, value):
+        self.values[self.slot(name)] = value
+
+    def load(self, slot, indexes=()):
+        # read a variable, subscripts select an array element and a bare array name its first element
+        value = self.values[slot]
+        if value is UNSET:
+            self.error("Variable not declared")
+        if type(value) is Array:
+            return value[value.offset(indexes)]
+        elif not any(indexes):
+            return value
+        self.error("Subscript out of range")
+
+    def store(self, slot, value, indexes=()):
+        items = self.values[slot]
+        if type(items) is Array:
+            items[items.offset(indexes)] = value
+        elif not any(indexes):
+            self.values[slot] = value
+        else:
+            self.error("Subscript out of range")
+
+    def clear(self):
+        # forget every value but keep the slots, compiled code goes on using them
+        self.values[:] = [UNSET] * len(self.values)
+
+    def table(self):
+        # name -> value of every assigned variable, for the debug dumps, without the hidden ones of hoisted
+        # loop invariants whose names start with %
+        return {name: value for name, value in zip(self.names, self.values)
+                if value is not UNSET and not name.startswith("%")}
+
+    def sizes(self):
+        # name -> bytes used by every DIM array
+        return {name: value.nbytes() for name, value in zip(self.names, self.values) if type(value) is Array}
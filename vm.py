@@ -0,0 +1,198 @@
+"""
+VM.py
+
+Stack based virtual machine executing the bytecode built by the Compiler
+"""
+from variables import UNSET, Array
+from matrix import reduce
+from evaluator import GOSUB_DEPTH
+from compiler import LOAD_CONST, LOAD, STORE, LOAD_INDEX, STORE_INDEX, BINARY, COMPARE, JUMP, JUMP_IF_FALSE, FOR, \
+    NEXT, PRINT, INPUT, DIM, RND, POP, EXEC, CLEAR, ERROR, HALT, MAT, REDUCE, LOAD_HOISTED, STORE_HOISTED, PARALLEL, \
+    GOSUB, RETURN, CALL, PRINT_FILE, INPUT_FILE, READ, EOF, COMPARE_JUMP
+
+
+class VM:
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.program = None
+        self.loops = {}  # slot -> [end, step, resume pc]
+        self.returns = []  # pcs the RETURNs of the GOSUBs made go back to
+
+    def error(self, msg="Syntax Error"):
+        raise SyntaxError(msg)
+
+    def run(self, program):
+        self.program = program
+        self.loops = {}
+        self.returns = []
+        try:
+            self.dispatch(program.code)
+        except IndexError as e:
+            self.stop(e)
+            self.error("Subscript out of range")
+        except BaseException as e:
+            self.stop(e)
+            raise
+        self.interpreter.linepos = len(self.interpreter.steps)
+
+    def stop(self, e):
+        # point linepos at the line of the instruction that failed, read from the frame of dispatch
+        tb = e.__traceback__
+        while tb is not None and tb.tb_frame.f_code is not VM.dispatch.__code__:
+            tb = tb.tb_next
+        if tb is None:
+            return
+        pc = tb.tb_frame.f_locals.get("pc", 0)
+        lines = self.program.lines
+        if 0 < pc <= len(lines) and lines[pc - 1] in self.interpreter.lineindex:
+            self.interpreter.linepos = self.interpreter.lineindex.get(lines[pc - 1])
+
+    def dispatch(self, code):
+        variables = self.interpreter.variables
+        values = variables.values
+        output = self.interpreter.output
+        randint = self.interpreter.random.randint
+        loops = self.loops
+        returns = self.returns
+        call = self.interpreter.functions.call
+        files = self.interpreter.files
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        pc = 0
+        while True:
+            op, arg = code[pc]
+            pc += 1
+            if op == LOAD:
+                value = values[arg]
+                if value is UNSET:
+                    self.error("Variable not declared")
+                push(value)
+            elif op == LOAD_CONST:
+                push(arg)
+            elif op == BINARY:
+                right = pop()
+                stack[-1] = arg(stack[-1], right)
+            elif op == STORE:
+                values[arg] = pop()
+            elif op == COMPARE:
+                right = pop()
+                stack[-1] = True if arg(stack[-1], right) else False
+            elif op == JUMP_IF_FALSE:
+                if pop() is not True:
+                    pc += arg
+            elif op == COMPARE_JUMP:
+                right = pop()
+                if not arg[0](pop(), right):
+                    pc += arg[1]
+            elif op == NEXT:
+                loop = loops.get(arg)
+                if loop is None:
+                    self.error("NEXT without FOR")
+                value = values[arg]
+                if value < loop[0]:
+                    values[arg] = value + loop[1]
+                    pc = loop[2]
+                else:
+                    del loops[arg]
+            elif op == JUMP:
+                pc += arg
+            elif op == LOAD_HOISTED:
+                value = values[arg[0]]
+                if value is not UNSET:
+                    push(value)
+                    pc += arg[1]
+            elif op == STORE_HOISTED:
+                values[arg] = stack[-1]
+            elif op == LOAD_INDEX:
+                slot, count = arg
+                items = values[slot]
+                if count == 1 and type(items) is Array:
+                    stack[-1] = items[stack[-1]]
+                else:
+                    indexes = stack[-count:]
+                    del stack[-count:]
+                    push(variables.load(slot, indexes))
+            elif op == STORE_INDEX:
+                value = pop()
+                slot, count = arg
+                items = values[slot]
+                if count == 1 and type(items) is Array:
+                    items[pop()] = value
+                else:
+                    indexes = stack[-count:]
+                    del stack[-count:]
+                    variables.store(slot, value, indexes)
+            elif op == FOR:
+                step = pop()
+                end = pop()
+                start = pop()
+                slot, resume, invariants = arg
+                if slot not in loops:
+                    values[slot] = start
+                    loops[slot] = [end, step, pc + resume]
+                    for invariant in invariants:
+                        values[invariant] = UNSET
+            elif op == PARALLEL:
+                slot, lineno, name = arg
+                if slot not in loops and self.interpreter.parallel.run(lineno, name, stack[-3], stack[-2], stack[-1]):
+                    # the workers ran the loop, go on with the line after its NEXT
+                    del stack[-3:]
+                    pos = self.interpreter.linepos + 1
+                    steps = self.interpreter.steps
+                    pc = self.program.starts.get(steps[pos]) if pos < len(steps) else len(code) - 1
+            elif op == PRINT:
+                string = "".join([str(value) for value in stack[len(stack) - arg:]])
+                del stack[len(stack) - arg:]
+                print(string if string else "", file=output)
+            elif op == PRINT_FILE:
+                string = "".join([str(value) for value in stack[len(stack) - arg:]])
+                del stack[len(stack) - arg:]
+                files.write(pop(), string)
+            elif op == READ:
+                push(files.read())
+            elif op == INPUT_FILE:
+                values[arg] = files.input(pop())
+            elif op == EOF:
+                stack[-1] = files.eof(stack[-1])
+            elif op == CALL:
+                name, count = arg
+                args = stack[-count:]
+                del stack[-count:]
+                push(call(name, args))
+            elif op == GOSUB:
+                if len(returns) >= GOSUB_DEPTH:
+                    self.error("GOSUB nested too deeply")
+                returns.append(pc)
+                pc += arg
+            elif op == RETURN:
+                if not returns:
+                    self.error("RETURN without GOSUB")
+                pc = returns.pop()
+            elif op == REDUCE:
+                push(reduce(arg[1], values[arg[0]]))
+            elif op == MAT:
+                self.interpreter.evaluator.executeMat(arg)
+            elif op == RND:
+                push(randint(1, arg))
+            elif op == POP:
+                pop()
+            elif op == INPUT:
+                values[arg[0]] = self.interpreter.read_input(arg[1])
+            elif op == DIM:
+                slot, count = arg
+                dims = stack[-count:]
+                del stack[-count:]
+                values[slot] = Array(dims)
+            elif op == CLEAR:
+                loops.clear()
+                returns.clear()
+                self.interpreter.clear()
+            elif op == EXEC:
+                # commands run through the tree walker
+                self.interpreter.evaluator.execute([arg])
+            elif op == ERROR:
+                self.error(arg)
+            elif op == HALT:
+                return